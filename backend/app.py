@@ -1,17 +1,47 @@
-import requests
 import os
 import time
 import hashlib
 import hmac
 import sqlite3
-import json
-import random
-import base64
 import uuid
-import traceback
-
-from flask import Flask, request, session, redirect, jsonify, send_from_directory
-from config import BOT_TOKEN, SECRET_KEY, DATABASE_PATH
+import threading
+import logging
+from contextlib import contextmanager
+
+from flask import Flask, Response, g, request, session, redirect, jsonify, send_from_directory
+
+from config import (BOT_TOKEN, SECRET_KEY, DATABASE_PATH, STORAGE_BACKEND, SCHEDULER_ENABLED, METRICS_ENABLED,
+                    GROUP_COMMIT_ENABLED, DB_JOURNAL_MODE, EVENTS_RELAY_DIR, EVENTS_MAX_STREAMS)
+from gateway import (GatewayError, summarize_nft, detail_nft, parse_nft_data, invalidate_nfts, fetch_scvx_balance,
+                     get_transaction_status, get_transaction_statuses, fetch_nft_ids, fetch_nft_data)
+from prefetch import enqueue_prefetch
+from events import bus, publish, format_sse, transaction_watcher, enable_relay, event_stats, may_have_listeners
+from scheduler import cooldown_scheduler, MACHINE_READY, AMPLIFIER_UPKEEP
+from locks import user_locks, user_locked
+from unit_of_work import transactional, unit_of_work, current_connection, after_commit, transaction_stats
+import group_commit
+from shards import pinned
+from logs import setup_logging
+from storage import (database_path, all_paths, connect as storage_connect, UserRepository, ResourceRepository,
+                     MachineRepository, PetRepository, AccountRepository)
+from layout import in_bounds, load_layout, store_layout, layout_cache
+from responses import FastJSONProvider, rows_to_json, compress_response, negotiate_response, wants_msgpack
+from manifests import (ManifestError, MINT_USER_NFT, BUY_ENERGY, mint_eggs_manifest, MAX_EGGS_PER_MINT,
+                       UPGRADE_STATS_XRD, UPGRADE_STATS_EGGS, EVOLVE_XRD, EVOLVE_EGGS, COMBINE_CREATURES)
+from machine_catalog import (load_machine_summary, save_machine_summary, build_cost, upgrade_cost,
+                             ACTIVATION_COOLDOWN_MS, MACHINE_PRODUCTION,
+                             cat_lair_output, reactor_output, incubator_output,
+                             AMPLIFIER_UPKEEP_COST, PET_CATALOG, MOVE_COST, EGG_MINT_COST,
+                             CREATURE_ACTION_COSTS,
+                             CATALOG_JSON, CATALOG_HASH)
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): migrations are only serialized in-process
+    fcntl = None
+
+setup_logging()
+log = logging.getLogger(__name__)
 
 app = Flask(__name__, 
             static_folder='static',  # React build files go here
@@ -23,6 +53,14 @@ app.config['SESSION_COOKIE_SECURE'] = True
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
+app.json = FastJSONProvider(app)
+
+@app.after_request
+def compress_api_response(response):
+    if request.path.startswith("/api/"):
+        return compress_response(response, request.accept_encodings)
+    return response
+
 # Flag to track if we need to add the provisional_mint column
 NEEDS_SCHEMA_UPDATE = False
 # Flag to track if we need to add the room column
@@ -33,11 +71,23 @@ NEEDS_SEEN_ROOM_COLUMN = False
 NEEDS_EGGS_RESOURCE = False
 # Flag to track if we need to add the pets table
 NEEDS_PETS_TABLE = False
-
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Flag to track if we need to add the user_accounts table
+NEEDS_ACCOUNTS_TABLE = False
+# Flag to track if we need to add the machine_summary table
+NEEDS_SUMMARY_TABLE = False
+# Flag to track if we need to add the state version columns and triggers
+NEEDS_STATE_VERSIONS = False
+# Flag to track if the database could not be switched to WAL
+NEEDS_JOURNAL_MODE = False
+
+def get_db_connection(user_id=None):
+    # The player's shard when sharding is on. Inside a @transactional
+    # request every caller on the same file shares its transaction.
+    path = database_path(user_id)
+    conn = current_connection(path)
+    if conn is not None:
+        return conn
+    return storage_connect(path)
 
 def check_and_update_schema():
     """Check if the database schema needs updating and update if necessary."""
@@ -52,19 +102,19 @@ def check_and_update_schema():
         columns = [column[1] for column in cursor.fetchall()]
         
         if 'provisional_mint' not in columns:
-            print("Adding provisional_mint column to user_machines table")
+            log.info("Adding provisional_mint column to user_machines table")
             try:
                 cursor.execute("ALTER TABLE user_machines ADD COLUMN provisional_mint INTEGER DEFAULT 0")
                 conn.commit()
-                print("Column added successfully")
+                log.info("Column added successfully")
             except sqlite3.Error as e:
-                print(f"Error adding column: {e}")
+                log.error(f"Error adding column: {e}")
                 NEEDS_SCHEMA_UPDATE = True
         
         cursor.close()
         conn.close()
     except Exception as e:
-        print(f"Error checking schema: {e}")
+        log.error(f"Error checking schema: {e}")
         NEEDS_SCHEMA_UPDATE = True
 
 def check_and_update_room_column():
@@ -80,19 +130,19 @@ def check_and_update_room_column():
         columns = [column[1] for column in cursor.fetchall()]
         
         if 'room' not in columns:
-            print("Adding room column to user_machines table")
+            log.info("Adding room column to user_machines table")
             try:
                 cursor.execute("ALTER TABLE user_machines ADD COLUMN room INTEGER DEFAULT 1")
                 conn.commit()
-                print("Room column added successfully")
+                log.info("Room column added successfully")
             except sqlite3.Error as e:
-                print(f"Error adding room column: {e}")
+                log.error(f"Error adding room column: {e}")
                 NEEDS_ROOM_COLUMN = True
         
         cursor.close()
         conn.close()
     except Exception as e:
-        print(f"Error checking room column: {e}")
+        log.error(f"Error checking room column: {e}")
         NEEDS_ROOM_COLUMN = True
 
 def check_and_update_seen_room_column():
@@ -108,19 +158,19 @@ def check_and_update_seen_room_column():
         columns = [column[1] for column in cursor.fetchall()]
         
         if 'seen_room_unlock' not in columns:
-            print("Adding seen_room_unlock column to users table")
+            log.info("Adding seen_room_unlock column to users table")
             try:
                 cursor.execute("ALTER TABLE users ADD COLUMN seen_room_unlock INTEGER DEFAULT 0")
                 conn.commit()
-                print("seen_room_unlock column added successfully")
+                log.info("seen_room_unlock column added successfully")
             except sqlite3.Error as e:
-                print(f"Error adding seen_room_unlock column: {e}")
+                log.error(f"Error adding seen_room_unlock column: {e}")
                 NEEDS_SEEN_ROOM_COLUMN = True
         
         cursor.close()
         conn.close()
     except Exception as e:
-        print(f"Error checking seen_room_unlock column: {e}")
+        log.error(f"Error checking seen_room_unlock column: {e}")
         NEEDS_SEEN_ROOM_COLUMN = True
 
 def check_and_update_pets_table():
@@ -136,7 +186,7 @@ def check_and_update_pets_table():
         table_exists = cursor.fetchone() is not None
         
         if not table_exists:
-            print("Creating pets table")
+            log.info("Creating pets table")
             try:
                 cursor.execute("""
                     CREATE TABLE pets (
@@ -150,17 +200,266 @@ def check_and_update_pets_table():
                     )
                 """)
                 conn.commit()
-                print("Pets table created successfully")
+                log.info("Pets table created successfully")
             except sqlite3.Error as e:
-                print(f"Error creating pets table: {e}")
+                log.error(f"Error creating pets table: {e}")
                 NEEDS_PETS_TABLE = True
         
         cursor.close()
         conn.close()
     except Exception as e:
-        print(f"Error checking pets table: {e}")
+        log.error(f"Error checking pets table: {e}")
         NEEDS_PETS_TABLE = True
 
+def check_and_update_accounts_table():
+    """Check if the user_accounts table exists and create if necessary."""
+    global NEEDS_ACCOUNTS_TABLE
+    
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # Check if the user_accounts table exists
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_accounts'")
+        table_exists = cursor.fetchone() is not None
+        
+        if not table_exists:
+            log.info("Creating user_accounts table")
+            try:
+                cursor.execute("""
+                    CREATE TABLE user_accounts (
+                        user_id INTEGER NOT NULL,
+                        account_address TEXT NOT NULL,
+                        last_seen INTEGER DEFAULT 0,
+                        PRIMARY KEY (user_id, account_address)
+                    )
+                """)
+                conn.commit()
+                log.info("user_accounts table created successfully")
+            except sqlite3.Error as e:
+                log.error(f"Error creating user_accounts table: {e}")
+                NEEDS_ACCOUNTS_TABLE = True
+        
+        cursor.close()
+        conn.close()
+    except Exception as e:
+        log.error(f"Error checking user_accounts table: {e}")
+        NEEDS_ACCOUNTS_TABLE = True
+
+# Any change to user_machines that the summary depends on, by this app or
+# by another writer such as the bot, drops the player's stored summary;
+# load_machine_summary() then rebuilds it from user_machines. The app's own
+# write paths save the new summary after their machine writes, so for them
+# the row is replaced, not lost.
+SUMMARY_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS user_machines_insert_summary
+    AFTER INSERT ON user_machines
+    BEGIN
+        DELETE FROM machine_summary WHERE user_id = NEW.user_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS user_machines_delete_summary
+    AFTER DELETE ON user_machines
+    BEGIN
+        DELETE FROM machine_summary WHERE user_id = OLD.user_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS user_machines_update_summary
+    AFTER UPDATE OF user_id, machine_type, level, is_offline ON user_machines
+    WHEN OLD.user_id IS NOT NEW.user_id OR OLD.machine_type IS NOT NEW.machine_type
+        OR OLD.level IS NOT NEW.level
+        OR (NEW.machine_type = 'amplifier' AND OLD.is_offline IS NOT NEW.is_offline)
+    BEGIN
+        DELETE FROM machine_summary WHERE user_id IN (OLD.user_id, NEW.user_id);
+    END
+    """,
+]
+
+def check_and_update_summary_table():
+    """Check if the machine_summary table exists and create if necessary."""
+    global NEEDS_SUMMARY_TABLE
+    
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='machine_summary'")
+        table_exists = cursor.fetchone() is not None
+        
+        if not table_exists:
+            log.info("Creating machine_summary table")
+            try:
+                # Rows are backfilled lazily by load_machine_summary()
+                cursor.execute("""
+                    CREATE TABLE machine_summary (
+                        user_id INTEGER PRIMARY KEY,
+                        summary TEXT NOT NULL
+                    )
+                """)
+                conn.commit()
+                log.info("machine_summary table created successfully")
+            except sqlite3.Error as e:
+                log.error(f"Error creating machine_summary table: {e}")
+                NEEDS_SUMMARY_TABLE = True
+
+        if not NEEDS_SUMMARY_TABLE:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type='trigger' AND name='user_machines_insert_summary'")
+            if cursor.fetchone() is None:
+                # Rows saved before the triggers existed may be stale
+                cursor.execute("DELETE FROM machine_summary")
+            for trigger_sql in SUMMARY_TRIGGERS:
+                try:
+                    cursor.execute(trigger_sql)
+                except sqlite3.Error as e:
+                    log.error(f"Error creating machine_summary trigger: {e}")
+                    NEEDS_SUMMARY_TABLE = True
+            conn.commit()
+        
+        cursor.close()
+        conn.close()
+    except Exception as e:
+        log.error(f"Error checking machine_summary table: {e}")
+        NEEDS_SUMMARY_TABLE = True
+
+# Every change to a player's visible state bumps users.state_version and stamps
+# the changed row with the new value, so getGameState can answer 304 or send
+# only rows changed since a version. Done with triggers so every writer
+# (including the Telegram bot sharing this database) is covered.
+STATE_VERSION_COLUMNS = [
+    ("users", "state_version"),
+    ("users", "corvax_version"),
+    ("user_machines", "version"),
+    ("pets", "version"),
+    ("resources", "version"),
+]
+
+STATE_VERSION_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS users_state_version
+    AFTER UPDATE OF corvax_count, seen_room_unlock ON users
+    WHEN OLD.corvax_count IS NOT NEW.corvax_count OR OLD.seen_room_unlock IS NOT NEW.seen_room_unlock
+    BEGIN
+        UPDATE users SET state_version = state_version + 1, corvax_version = state_version + 1
+        WHERE user_id = NEW.user_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS user_machines_insert_version
+    AFTER INSERT ON user_machines
+    BEGIN
+        UPDATE users SET state_version = state_version + 1 WHERE user_id = NEW.user_id;
+        UPDATE user_machines SET version = (SELECT state_version FROM users WHERE user_id = NEW.user_id)
+        WHERE id = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS user_machines_update_version
+    AFTER UPDATE OF x, y, level, last_activated, is_offline, provisional_mint, room ON user_machines
+    WHEN OLD.x IS NOT NEW.x OR OLD.y IS NOT NEW.y OR OLD.level IS NOT NEW.level
+        OR OLD.last_activated IS NOT NEW.last_activated OR OLD.is_offline IS NOT NEW.is_offline
+        OR OLD.provisional_mint IS NOT NEW.provisional_mint OR OLD.room IS NOT NEW.room
+    BEGIN
+        UPDATE users SET state_version = state_version + 1 WHERE user_id = NEW.user_id;
+        UPDATE user_machines SET version = (SELECT state_version FROM users WHERE user_id = NEW.user_id)
+        WHERE id = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pets_insert_version
+    AFTER INSERT ON pets
+    BEGIN
+        UPDATE users SET state_version = state_version + 1 WHERE user_id = NEW.user_id;
+        UPDATE pets SET version = (SELECT state_version FROM users WHERE user_id = NEW.user_id)
+        WHERE id = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pets_update_version
+    AFTER UPDATE OF x, y, room, type, parent_machine ON pets
+    WHEN OLD.x IS NOT NEW.x OR OLD.y IS NOT NEW.y OR OLD.room IS NOT NEW.room
+        OR OLD.type IS NOT NEW.type OR OLD.parent_machine IS NOT NEW.parent_machine
+    BEGIN
+        UPDATE users SET state_version = state_version + 1 WHERE user_id = NEW.user_id;
+        UPDATE pets SET version = (SELECT state_version FROM users WHERE user_id = NEW.user_id)
+        WHERE id = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS resources_insert_version
+    AFTER INSERT ON resources
+    BEGIN
+        UPDATE users SET state_version = state_version + 1 WHERE user_id = NEW.user_id;
+        UPDATE resources SET version = (SELECT state_version FROM users WHERE user_id = NEW.user_id)
+        WHERE rowid = NEW.rowid;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS resources_update_version
+    AFTER UPDATE OF amount ON resources
+    WHEN OLD.amount IS NOT NEW.amount
+    BEGIN
+        UPDATE users SET state_version = state_version + 1 WHERE user_id = NEW.user_id;
+        UPDATE resources SET version = (SELECT state_version FROM users WHERE user_id = NEW.user_id)
+        WHERE rowid = NEW.rowid;
+    END
+    """,
+]
+
+def check_and_update_state_versions():
+    """Add the state version columns and the triggers that maintain them."""
+    global NEEDS_STATE_VERSIONS
+    
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        for table, column in STATE_VERSION_COLUMNS:
+            cursor.execute(f"PRAGMA table_info({table})")
+            columns = [col[1] for col in cursor.fetchall()]
+            if column not in columns:
+                log.info(f"Adding {column} column to {table} table")
+                try:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER DEFAULT 0")
+                except sqlite3.Error as e:
+                    log.error(f"Error adding {column} column: {e}")
+                    NEEDS_STATE_VERSIONS = True
+        
+        if not NEEDS_STATE_VERSIONS:
+            for trigger_sql in STATE_VERSION_TRIGGERS:
+                try:
+                    cursor.execute(trigger_sql)
+                except sqlite3.Error as e:
+                    log.error(f"Error creating state version trigger: {e}")
+                    NEEDS_STATE_VERSIONS = True
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+    except Exception as e:
+        log.error(f"Error checking state versions: {e}")
+        NEEDS_STATE_VERSIONS = True
+
+def check_and_update_journal_mode():
+    """Switch the database file to WAL, so readers in other workers don't
+    wait for the writer. The mode is stored in the file itself."""
+    global NEEDS_JOURNAL_MODE
+
+    if STORAGE_BACKEND != "sqlite":
+        return
+    try:
+        conn = get_db_connection()
+        mode = conn.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}").fetchone()[0]
+        if mode.lower() != DB_JOURNAL_MODE.lower():
+            log.warning(f"Could not switch journal mode to {DB_JOURNAL_MODE} (still {mode})")
+            NEEDS_JOURNAL_MODE = True
+        conn.close()
+    except Exception as e:
+        log.error(f"Error setting journal mode: {e}")
+        NEEDS_JOURNAL_MODE = True
+
 def ensure_eggs_resource_exists():
     """Ensure the eggs resource exists for all users."""
     global NEEDS_EGGS_RESOURCE
@@ -182,7 +481,7 @@ def ensure_eggs_resource_exists():
             count = cursor.fetchone()[0]
             
             if count == 0:
-                print(f"Adding eggs resource for user {user_id}")
+                log.info(f"Adding eggs resource for user {user_id}")
                 cursor.execute(
                     "INSERT INTO resources (user_id, resource_name, amount) VALUES (?, 'eggs', 0)",
                     (user_id,)
@@ -191,289 +490,137 @@ def ensure_eggs_resource_exists():
         conn.commit()
         cursor.close()
         conn.close()
-        print("Eggs resource check completed")
+        log.info("Eggs resource check completed")
     except Exception as e:
-        print(f"Error ensuring eggs resource: {e}")
+        log.error(f"Error ensuring eggs resource: {e}")
         NEEDS_EGGS_RESOURCE = True
 
-# Run schema checks on startup
-check_and_update_schema()
-check_and_update_room_column()
-check_and_update_seen_room_column()
-ensure_eggs_resource_exists()
-check_and_update_pets_table()
-
-def fetch_scvx_balance(account_address):
-    """Fetch sCVX balance for a Radix account using the Gateway API."""
-    if not account_address:
-        print("No account address provided")
-        return 0
-        
+# Stored in PRAGMA user_version once every check above has passed on a
+# database, so later processes skip them. Bump it when adding a check.
+SCHEMA_VERSION = 3
+
+# The flags the checks above set when they fail. After run_migrations each
+# one is set if any database still needs it; migration_failures keeps the
+# failed checks of each database path.
+MIGRATION_FLAGS = ("NEEDS_SCHEMA_UPDATE", "NEEDS_ROOM_COLUMN", "NEEDS_SEEN_ROOM_COLUMN",
+                   "NEEDS_EGGS_RESOURCE", "NEEDS_PETS_TABLE", "NEEDS_ACCOUNTS_TABLE",
+                   "NEEDS_SUMMARY_TABLE", "NEEDS_STATE_VERSIONS", "NEEDS_JOURNAL_MODE")
+migration_failures = {}
+
+def migrate_database(path):
+    """Run the schema checks on one database unless it is already current."""
+    conn = storage_connect(path)
     try:
-        # sCVX resource address
-        scvx_resource = 'resource_rdx1t5q4aa74uxcgzehk0u3hjy6kng9rqyr4uvktnud8ehdqaaez50n693'
-        
-        # Use the Gateway API
-        url = "https://mainnet.radixdlt.com/state/entity/page/fungibles/"
-        print(f"Fetching sCVX for {account_address} using Gateway API")
-        
-        # Prepare request payload
-        payload = {
-            "address": account_address,
-            "limit_per_page": 100  # Get a reasonable number of tokens
-        }
-        
-        # Set appropriate headers
-        headers = {
-            'Content-Type': 'application/json',
-            'User-Agent': 'CorvaxLab Game/1.0'
-        }
-        
-        print(f"Making Gateway API request with payload: {json.dumps(payload)}")
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
-        
-        print(f"Gateway API Response Status: {response.status_code}")
-        
-        if response.status_code != 200:
-            print(f"Gateway API error: Status {response.status_code}")
-            print(f"Response: {response.text[:200]}...")
-            return 0
-        
-        # Parse the JSON response
-        data = response.json()
-        
-        # Print debugging info
-        print(f"Gateway API total_count: {data.get('total_count', 0)}")
-        
-        # Look for the sCVX resource in the items
-        items = data.get('items', [])
-        print(f"Found {len(items)} resources in the account")
-        
-        # Dump all resources for debugging
-        print("All resources in account:")
-        for i, item in enumerate(items):
-            resource_addr = item.get('resource_address', '')
-            amount = item.get('amount', '0')
-            print(f"Resource {i}: {resource_addr} = {amount}")
-            
-            # Check if this is the sCVX resource
-            if resource_addr == scvx_resource:
-                amount_value = float(amount)
-                print(f"FOUND sCVX RESOURCE: {amount_value}")
-                return amount_value
-        
-        # If we get here, we didn't find the resource - look for partial matches
-        print("Trying partial resource address matching...")
-        for item in items:
-            resource_addr = item.get('resource_address', '')
-            if scvx_resource[-8:] in resource_addr:  # Match on last few chars
-                amount = float(item.get('amount', '0'))
-                print(f"Found potential sCVX match with amount: {amount}")
-                return amount
-                
-        return 0
-    except Exception as e:
-        print(f"Error fetching sCVX with Gateway API: {e}")
-        traceback.print_exc()
-        return 0
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return False
+    finally:
+        conn.close()
 
-def can_build_fomo_hit(cur, user_id):
-    """Check if user has built and fully operational all other machine types."""
-    print(f"Checking FOMO HIT prerequisites for user_id: {user_id}")
+    log.info(f"Running schema checks on {path}")
+    # Start this file with clean flags so an earlier database's failures
+    # don't block its version, then fold them back in for the runtime checks
+    flags = globals()
+    earlier = {name: flags[name] for name in MIGRATION_FLAGS}
+    for name in MIGRATION_FLAGS:
+        flags[name] = False
+    with pinned(path):
+        check_and_update_schema()
+        check_and_update_room_column()
+        check_and_update_seen_room_column()
+        ensure_eggs_resource_exists()
+        check_and_update_pets_table()
+        check_and_update_accounts_table()
+        check_and_update_summary_table()
+        check_and_update_state_versions()
+        check_and_update_journal_mode()
+
+    failed = [name for name in MIGRATION_FLAGS if flags[name]]
+    for name in MIGRATION_FLAGS:
+        flags[name] = flags[name] or earlier[name]
+
+    if failed:
+        migration_failures[path] = failed
+        log.warning(f"Schema checks failed on {path}: {', '.join(failed)}")
+    else:
+        migration_failures.pop(path, None)
+        conn = storage_connect(path)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.close()
+    return True
+
+_init_lock = threading.Lock()
+_migrated = False
+
+@contextmanager
+def migration_file_lock():
+    """Keep worker processes sharing DATABASE_PATH from migrating it at the same time."""
+    if fcntl is None or STORAGE_BACKEND != "sqlite":
+        yield
+        return
+    fd = os.open(f"{DATABASE_PATH}.migrate.lock", os.O_RDWR | os.O_CREAT, 0o644)
     try:
-        # 1. Check if they've built all required machine types
-        required_types = ['catLair', 'reactor', 'amplifier', 'incubator']
-        for machine_type in required_types:
-            cur.execute("""
-                SELECT COUNT(*) as count FROM user_machines
-                WHERE user_id=? AND machine_type=?
-            """, (user_id, machine_type))
-            row = cur.fetchone()
-            count = row[0] if row else 0
-            print(f"  Machine type {machine_type}: {count} found")
-            if count == 0:
-                print(f"  Missing required machine: {machine_type}")
-                return False
-        
-        # 2. For cat lairs and reactors, check ALL are at max level (3)
-        # First, get total count of each type
-        for machine_type in ['catLair', 'reactor']:
-            # Get total number of this machine type
-            cur.execute("""
-                SELECT COUNT(*) as total FROM user_machines
-                WHERE user_id=? AND machine_type=?
-            """, (user_id, machine_type))
-            total_row = cur.fetchone()
-            total = total_row[0] if total_row else 0
-            
-            # Get how many are at max level
-            cur.execute("""
-                SELECT COUNT(*) as max_count FROM user_machines 
-                WHERE user_id=? AND machine_type=? AND level>=3
-            """, (user_id, machine_type))
-            max_row = cur.fetchone()
-            max_count = max_row[0] if max_row else 0
-            
-            print(f"  {machine_type}: {max_count}/{total} at max level")
-            
-            # For now, as long as one machine is at max level for each type, that counts as success
-            if max_count == 0:
-                print(f"  No {machine_type} machines at max level")
-                return False
-        
-        # 3. For amplifier, check it's at max level (5)
-        cur.execute("""
-            SELECT MAX(level) as max_level FROM user_machines
-            WHERE user_id=? AND machine_type='amplifier'
-        """, (user_id,))
-        max_level_row = cur.fetchone()
-        max_level = max_level_row[0] if max_level_row else 0
-        print(f"  Amplifier max level: {max_level}/5")
-        
-        # For now, level 3 amplifier is ok as a prerequisite 
-        if max_level < 3:
-            print(f"  Amplifier not at required level")
-            return False
-        
-        # 4. Check that incubator is operational (not offline)
-        cur.execute("""
-            SELECT is_offline FROM user_machines
-            WHERE user_id=? AND machine_type='incubator'
-            LIMIT 1
-        """, (user_id,))
-        row = cur.fetchone()
-        is_offline = row[0] if row else 1
-        print(f"  Incubator offline status: {is_offline}")
-        
-        # For testing, let's ignore the incubator online check
-        # Remove this if-statement in production
-        if is_offline == 1:
-            print(f"  Incubator is offline but we'll allow FOMO HIT for testing")
-            # return False  # Comment this out for easier testing
-            
-        print("✅ All FOMO HIT prerequisites met!")
-        return True
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+def run_migrations():
+    """Bring every database (every shard when sharding is on) up to date, once per process."""
+    global _migrated
+    with _init_lock:
+        if _migrated:
+            return
+        started = time.perf_counter()
+        with migration_file_lock():
+            migrated = [path for path in all_paths() if migrate_database(path)]
+        _migrated = True
+    if migrated:
+        log.info(f"Schema checks finished on {len(migrated)} database(s) in {time.perf_counter() - started:.2f}s")
+
+def remember_account(user_id, account_address):
+    """Record a wallet address the player has used, for login prefetching."""
+    if not account_address:
+        return
+    try:
+        conn = get_db_connection(user_id)
+        cur = conn.cursor()
+        AccountRepository(cur).remember(user_id, account_address, int(time.time()))
+        conn.commit()
+        cur.close()
+        conn.close()
     except Exception as e:
-        print(f"Error in can_build_fomo_hit: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+        log.error(f"Error in remember_account: {e}")
 
-def can_build_third_reactor(cur, user_id):
-    """Check if user can build a third reactor (has incubator and fomoHit)."""
+def get_known_accounts(cur, user_id, limit=3):
+    """Most recently used wallet addresses of a player."""
     try:
-        # Check if incubator exists
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='incubator'
-        """, (user_id,))
-        has_incubator = cur.fetchone()[0] > 0
-        
-        # Check if fomoHit exists
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='fomoHit'
-        """, (user_id,))
-        has_fomo_hit = cur.fetchone()[0] > 0
-        
-        # Count current reactors
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='reactor'
-        """, (user_id,))
-        reactor_count = cur.fetchone()[0]
-        
-        # Can build third reactor if:
-        # 1. Has both incubator and fomoHit
-        # 2. Currently has 2 reactors (this would be the third)
-        return has_incubator and has_fomo_hit and reactor_count == 2
-    except Exception as e:
-        print(f"Error in can_build_third_reactor: {e}")
-        traceback.print_exc()
-        return False
+        return AccountRepository(cur).recent(user_id, limit)
+    except sqlite3.Error as e:
+        log.error(f"Error in get_known_accounts: {e}")
+        return []
 
 def create_nft_mint_manifest(account_address):
     """Create the Radix transaction manifest for NFT minting."""
     try:
-        # Generate a random ID for the NFT
-        nft_id = str(uuid.uuid4())[:8]
-        
-        # Simple manifest that calls a component to mint an NFT
-        # The component address should be your actual minting component
-        manifest = f"""
-CALL_METHOD
-    Address("component_rdx1cqpv4nfsgfk9c2r9ymnqyksfkjsg07mfc49m9qw3dpgzrmjmsuuquv")
-    "mint_user_nft"
-;
-CALL_METHOD
-    Address("{account_address}")
-    "try_deposit_batch_or_abort"
-    Expression("ENTIRE_WORKTOP")
-    None
-;
-"""
-        return manifest
-    except Exception as e:
-        print(f"Error creating NFT mint manifest: {e}")
-        traceback.print_exc()
+        return MINT_USER_NFT.render(account=account_address)
+    except ManifestError as e:
+        log.error(f"Error creating NFT mint manifest: {e}")
         return None
 
+# CVX paid for one energy purchase
+ENERGY_PURCHASE_CVX = "200.0"
+
 def create_buy_energy_manifest(account_address):
     """Create the Radix transaction manifest for buying energy with CVX."""
     try:
-        cvx_resource        = "resource_rdx1th04p2c55884yytgj0e8nq79ze9wjnvu4rpg9d7nh3t698cxdt0cr9"
-        destination_account = "account_rdx16ya2ncwya20j2w0k8d49us5ksvzepjhhh7cassx9jp9gz6hw69mhks"
-        cvx_amount          = "200.0"
-
-        manifest = f"""
-CALL_METHOD
-    Address("{account_address}")
-    "withdraw"
-    Address("{cvx_resource}")
-    Decimal("{cvx_amount}")
-;
-CALL_METHOD
-    Address("{destination_account}")
-    "try_deposit_batch_or_abort"
-    Expression("ENTIRE_WORKTOP")
-    None
-;
-"""
-        print(f"Generated manifest:\n{manifest}")
+        manifest = BUY_ENERGY.render(account=account_address, amount=ENERGY_PURCHASE_CVX)
+        log.debug("Generated energy purchase manifest", extra={"payload": manifest})
         return manifest
-
-    except Exception as e:
-        print(f"Error creating energy purchase manifest: {e}")
-        traceback.print_exc()
+    except ManifestError as e:
+        log.error(f"Error creating energy purchase manifest: {e}")
         return None
 
-def get_transaction_status(intent_hash):
-    """Check the status of a transaction using the Gateway API."""
-    try:
-        url = "https://mainnet.radixdlt.com/transaction/status"
-        payload = {"intent_hash": intent_hash}
-        headers = {
-            'Content-Type': 'application/json',
-            'User-Agent': 'CorvaxLab Game/1.0'
-        }
-        
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
-        
-        if response.status_code != 200:
-            print(f"Gateway API error: Status {response.status_code}")
-            return {"status": "Unknown", "error": f"HTTP {response.status_code}"}
-        
-        data = response.json()
-        return {
-            "status": data.get("status", "Unknown"),
-            "intent_status": data.get("intent_status", "Unknown"),
-            "error_message": data.get("error_message", "")
-        }
-    except Exception as e:
-        print(f"Error checking transaction status: {e}")
-        traceback.print_exc()
-        return {"status": "Error", "error": str(e)}
-
 def verify_telegram_login(query_dict, bot_token):
     try:
         their_hash = query_dict.pop("hash", None)
@@ -485,8 +632,7 @@ def verify_telegram_login(query_dict, bot_token):
         calc_hash_bytes = hmac.new(secret_key, data_check_str.encode('utf-8'), hashlib.sha256).hexdigest()
         return calc_hash_bytes == their_hash
     except Exception as e:
-        print(f"Error in verify_telegram_login: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in verify_telegram_login: {e}")
         return False
 
 @app.route('/', defaults={'path': ''})
@@ -498,32 +644,31 @@ def serve(path):
         else:
             return send_from_directory(app.static_folder, 'index.html')
     except Exception as e:
-        print(f"Error serving path {path}: {e}")
-        traceback.print_exc()
+        log.exception(f"Error serving path {path}: {e}")
         return "Server error", 500
 
 @app.route("/callback")
 def telegram_login_callback():
-    print("=== Telegram Callback Called ===")
+    log.debug("Telegram callback request")
     try:
         args = request.args.to_dict()
-        print(f"Args received: {args}")
+        log.debug(f"Args received: {args}")
         
         user_id = args.get("id")
         tg_hash = args.get("hash")
         auth_date = args.get("auth_date")
         
         if not user_id or not tg_hash or not auth_date:
-            print("Missing login data!")
+            log.warning("Missing login data!")
             return "<h3>Missing Telegram login data!</h3>", 400
 
         if not verify_telegram_login(args, BOT_TOKEN):
-            print(f"Invalid hash! Data: {args}")
+            log.warning(f"Invalid hash! Data: {args}")
             return "<h3>Invalid hash - data might be forged!</h3>", 403
 
-        print(f"Login successful for user {user_id}")
+        log.info(f"Login successful for user {user_id}")
         
-        conn = get_db_connection()
+        conn = get_db_connection(user_id)
         cursor = conn.cursor()
 
         try:
@@ -531,62 +676,72 @@ def telegram_login_callback():
         except ValueError:
             user_id_int = user_id
 
-        cursor.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id_int,))
-        row = cursor.fetchone()
-        if row is None:
+        users = UserRepository(cursor)
+        if not users.exists(user_id_int):
             first_name = args.get("first_name", "Unknown")
-            print(f"Creating new user: {first_name}")
-            cursor.execute(
-                "INSERT INTO users (user_id, first_name, corvax_count, seen_room_unlock) VALUES (?, ?, 0, 0)",
-                (user_id_int, first_name)
-            )
-            conn.commit()
-            
-            # Also create initial eggs resource for new user
-            cursor.execute(
-                "INSERT INTO resources (user_id, resource_name, amount) VALUES (?, 'eggs', 0)",
-                (user_id_int,)
-            )
+            log.info(f"Creating new user: {first_name}")
+            users.create(user_id_int, first_name)
             conn.commit()
 
+        # Warm the balance and NFT caches while the page loads
+        enqueue_prefetch(get_known_accounts(cursor, user_id_int))
+
         cursor.close()
         conn.close()
 
         session['telegram_id'] = str(user_id_int)
-        print(f"Session set, redirecting to homepage")
+        session['prefetch_pending'] = True
+        log.debug(f"Session set, redirecting to homepage")
         return redirect("https://cvxlab.net/")
     except Exception as e:
-        print(f"Error in telegram_login_callback: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in telegram_login_callback: {e}")
         return "<h3>Server error</h3>", 500
 
 @app.route("/api/whoami")
 def whoami():
     try:
-        print("=== WHOAMI CALLED ===")
+        log.debug("Whoami request")
         if 'telegram_id' not in session:
-            print("User not logged in")
+            log.debug("User not logged in")
             return jsonify({"loggedIn": False}), 200
 
         user_id = session['telegram_id']
-        print(f"User logged in with ID: {user_id}")
+        log.debug(f"User logged in with ID: {user_id}")
         
-        conn = get_db_connection()
+        conn = get_db_connection(user_id)
         cur = conn.cursor()
-        cur.execute("SELECT first_name FROM users WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
+        user = UserRepository(cur).get(user_id)
         cur.close()
         conn.close()
 
-        if row:
-            return jsonify({"loggedIn": True, "firstName": row[0]})
+        if user:
+            return jsonify({"loggedIn": True, "firstName": user["first_name"]})
         else:
             return jsonify({"loggedIn": True, "firstName": "Unknown"})
     except Exception as e:
-        print(f"Error in whoami: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in whoami: {e}")
         return jsonify({"error": "Server error"}), 500
 
+# Clients pin the catalog with ?v=<hash>; those URLs never change content
+CATALOG_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+CATALOG_MAX_AGE = 3600
+
+@app.route("/api/catalog", methods=["GET"])
+def get_catalog():
+    """Costs, production, upgrade gating and unlock rules (machine_catalog.py)."""
+    etag = f"catalog-{CATALOG_HASH}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(CATALOG_JSON, mimetype="application/json")
+    response.set_etag(etag)
+    if request.args.get("v") == CATALOG_HASH:
+        response.headers['Cache-Control'] = f'public, max-age={CATALOG_IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = f'public, max-age={CATALOG_MAX_AGE}, stale-while-revalidate=86400'
+    response.headers['X-Catalog-Version'] = CATALOG_HASH
+    return response
+
 @app.route("/api/machines", methods=["GET"])
 def get_machines():
     try:
@@ -594,53 +749,10 @@ def get_machines():
             return jsonify({"error": "Not logged in"}), 401
 
         user_id = session['telegram_id']
-        conn = get_db_connection()
+        conn = get_db_connection(user_id)
         cur = conn.cursor()
 
-        try:
-            # Try with provisional_mint and room columns
-            cur.execute("""
-                SELECT id, machine_type, x, y, level, last_activated, is_offline, provisional_mint, room
-                FROM user_machines
-                WHERE user_id=?
-            """, (user_id,))
-            rows = cur.fetchall()
-            
-            machines = []
-            for r in rows:
-                machine = dict(r)
-                machines.append(machine)
-                
-        except sqlite3.OperationalError:
-            try:
-                # Try with provisional_mint only
-                cur.execute("""
-                    SELECT id, machine_type, x, y, level, last_activated, is_offline, provisional_mint
-                    FROM user_machines
-                    WHERE user_id=?
-                """, (user_id,))
-                rows = cur.fetchall()
-                
-                machines = []
-                for r in rows:
-                    machine = dict(r)
-                    machine["room"] = 1  # Default room
-                    machines.append(machine)
-            except sqlite3.OperationalError:
-                # Fall back to old schema without provisional_mint and room
-                cur.execute("""
-                    SELECT id, machine_type, x, y, level, last_activated, is_offline
-                    FROM user_machines
-                    WHERE user_id=?
-                """, (user_id,))
-                rows = cur.fetchall()
-                
-                machines = []
-                for r in rows:
-                    machine = dict(r)
-                    machine["provisionalMint"] = 0  # Default value
-                    machine["room"] = 1  # Default room
-                    machines.append(machine)
+        machines = [dict(row) for row in MachineRepository(cur).list(user_id)]
 
         cur.close()
         conn.close()
@@ -668,8 +780,7 @@ def get_machines():
 
         return jsonify(machine_list)
     except Exception as e:
-        print(f"Error in get_machines: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in get_machines: {e}")
         return jsonify({"error": "Server error"}), 500
 
 @app.route("/api/resources", methods=["GET"])
@@ -679,16 +790,15 @@ def get_resources():
             return jsonify({"error": "Not logged in"}), 401
 
         user_id = session['telegram_id']
-        conn = get_db_connection()
+        conn = get_db_connection(user_id)
         cur = conn.cursor()
 
-        cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        tcorvax = row["corvax_count"] if row else 0
+        tcorvax = UserRepository(cur).corvax(user_id) or 0
 
-        catNips = get_or_create_resource(cur, user_id, 'catNips')
-        energy = get_or_create_resource(cur, user_id, 'energy')
-        eggs = get_or_create_resource(cur, user_id, 'eggs')
+        resources = ResourceRepository(cur)
+        catNips = resources.get_or_create(user_id, 'catNips')
+        energy = resources.get_or_create(user_id, 'energy')
+        eggs = resources.get_or_create(user_id, 'eggs')
 
         cur.close()
         conn.close()
@@ -700,548 +810,424 @@ def get_resources():
             "eggs": float(eggs)
         })
     except Exception as e:
-        print(f"Error in get_resources: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in get_resources: {e}")
         return jsonify({"error": "Server error"}), 500
 
 def get_or_create_resource(cursor, user_id, resource_name):
     try:
-        cursor.execute("SELECT amount FROM resources WHERE user_id=? AND resource_name=?", (user_id, resource_name))
-        row = cursor.fetchone()
-        if row is None:
-            cursor.execute("INSERT INTO resources (user_id, resource_name, amount) VALUES (?, ?, 0)",
-                        (user_id, resource_name))
-            return 0
-        else:
-            return row[0]
+        return ResourceRepository(cursor).get_or_create(user_id, resource_name)
     except Exception as e:
-        print(f"Error in get_or_create_resource: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in get_or_create_resource: {e}")
         return 0
 
 def set_resource_amount(cursor, user_id, resource_name, amount):
     try:
-        cursor.execute("SELECT amount FROM resources WHERE user_id=? AND resource_name=?", (user_id, resource_name))
-        row = cursor.fetchone()
-        if row is None:
-            cursor.execute("INSERT INTO resources (user_id, resource_name, amount) VALUES (?, ?, ?)",
-                        (user_id, resource_name, amount))
-        else:
-            cursor.execute("UPDATE resources SET amount=? WHERE user_id=? AND resource_name=?",
-                        (amount, user_id, resource_name))
+        ResourceRepository(cursor).set(user_id, resource_name, amount)
     except Exception as e:
-        print(f"Error in set_resource_amount: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in set_resource_amount: {e}")
+
+def deduct_resource(cursor, user_id, resource_name, amount):
+    return ResourceRepository(cursor).deduct(user_id, resource_name, amount)
 
 def update_amplifiers_status(user_id, conn, cur):
+    # Views settle upkeep inside their own transaction and carry on if it fails
     try:
-        cur.execute("""
-            SELECT id, level, is_offline, next_cost_time
-            FROM user_machines
-            WHERE user_id=? AND machine_type='amplifier'
-        """, (user_id,))
-        amps = cur.fetchall()
-        if not amps:
-            return
+        with user_locks.hold(user_id):
+            settle_amplifier_upkeep(user_id, conn, cur)
+    except Exception as e:
+        log.exception(f"Error in update_amplifiers_status: {e}")
 
-        now_ms = int(time.time() * 1000)
-        energy_val = get_or_create_resource(cur, user_id, 'energy')
-
-        for amp in amps:
-            amp_id = amp["id"]
-            level = amp["level"]
-            is_offline = amp["is_offline"]
-            next_cost = amp["next_cost_time"]
-
-            if next_cost == 0:
-                next_cost = now_ms + 24*60*60*1000
-                cur.execute("""
-                    UPDATE user_machines
-                    SET next_cost_time=?
-                    WHERE user_id=? AND id=?
-                """, (next_cost, user_id, amp_id))
-                conn.commit()
+def settle_upkeep(user_id, name):
+    """Settle amplifier upkeep for a caller that has no transaction of its
+    own: one unit of work under the player's lock, committed in one go."""
+    with user_locks.hold(user_id), unit_of_work(name, user_id=user_id):
+        conn = get_db_connection(user_id)
+        cur = conn.cursor()
+        try:
+            settle_amplifier_upkeep(user_id, conn, cur)
+        finally:
+            cur.close()
+            conn.close()
 
-            cost = 2 * level
-            if is_offline == 0:
-                while next_cost <= now_ms:
-                    if energy_val >= cost:
-                        energy_val -= cost
-                        set_resource_amount(cur, user_id, 'energy', energy_val)
-                        next_cost += 24*60*60*1000
-                    else:
-                        is_offline = 1
-                        cur.execute("""
-                            UPDATE user_machines
-                            SET is_offline=1
-                            WHERE user_id=? AND id=?
-                        """, (user_id, amp_id))
-                        conn.commit()
-                        break
+def settle_amplifier_upkeep(user_id, conn, cur):
+    """Charge the energy upkeep due on the player's amplifiers, taking
+    those the player can't pay for offline. Errors propagate, so a caller
+    with its own unit of work rolls back a half-settled upkeep."""
+    machines = MachineRepository(cur)
+    amps = machines.amplifiers(user_id)
+    if not amps:
+        return
+
+    now_ms = int(time.time() * 1000)
+    energy_val = get_or_create_resource(cur, user_id, 'energy')
+    # Events and timers wait for the commit, so a rollback leaves no trace
+    changes = []  # (amp_id, online) for amplifiers that switched
+    schedule = []  # (amp_id, next_cost or None to cancel)
+
+    for amp in amps:
+        amp_id = amp["id"]
+        level = amp["level"]
+        is_offline = amp["is_offline"]
+        next_cost = amp["next_cost_time"]
+
+        if next_cost == 0:
+            next_cost = now_ms + AMPLIFIER_UPKEEP_COST["interval_ms"]
+            machines.set_upkeep(user_id, amp_id, next_cost, is_offline)
+            conn.commit()
+
+        cost = AMPLIFIER_UPKEEP_COST["energy_per_level"] * level
+        if is_offline == 0:
+            while next_cost <= now_ms:
+                if energy_val >= cost:
+                    energy_val -= cost
+                    set_resource_amount(cur, user_id, 'energy', energy_val)
+                    next_cost += AMPLIFIER_UPKEEP_COST["interval_ms"]
+                else:
+                    is_offline = 1
+                    machines.set_upkeep(user_id, amp_id, next_cost, is_offline)
+                    summary = load_machine_summary(cur, user_id)
+                    summary.set_amplifier_online(False)
+                    save_machine_summary(cur, user_id, summary)
+                    conn.commit()
+                    changes.append((amp_id, False))
+                    break
+        else:
+            if next_cost <= now_ms:
+                if energy_val >= cost:
+                    energy_val -= cost
+                    set_resource_amount(cur, user_id, 'energy', energy_val)
+                    next_cost = now_ms + AMPLIFIER_UPKEEP_COST["interval_ms"]
+                    is_offline = 0
+                    machines.set_upkeep(user_id, amp_id, next_cost, is_offline)
+                    summary = load_machine_summary(cur, user_id)
+                    summary.set_amplifier_online(True)
+                    save_machine_summary(cur, user_id, summary)
+                    conn.commit()
+                    changes.append((amp_id, True))
+                else:
+                    pass
+
+        machines.set_upkeep(user_id, amp_id, next_cost, is_offline)
+        conn.commit()
+
+        # Offline amplifiers only come back when the player returns
+        schedule.append((amp_id, None if is_offline else next_cost))
+
+    def send():
+        for amp_id, online in changes:
+            publish(user_id, "amplifier", {"machineId": amp_id, "online": online})
+        for amp_id, next_cost in schedule:
+            if next_cost is None:
+                cooldown_scheduler.wheel.cancel(user_id, amp_id, AMPLIFIER_UPKEEP)
             else:
-                if next_cost <= now_ms:
-                    if energy_val >= cost:
-                        energy_val -= cost
-                        set_resource_amount(cur, user_id, 'energy', energy_val)
-                        next_cost = now_ms + 24*60*60*1000
-                        is_offline = 0
-                        cur.execute("""
-                            UPDATE user_machines
-                            SET is_offline=0, next_cost_time=?
-                            WHERE user_id=? AND id=?
-                        """, (next_cost, user_id, amp_id))
-                        conn.commit()
-                    else:
-                        pass
+                cooldown_scheduler.amplifier_upkeep(user_id, amp_id, next_cost)
+    after_commit(send)
 
-            cur.execute("""
-                UPDATE user_machines
-                SET next_cost_time=?, is_offline=?
-                WHERE user_id=? AND id=?
-            """, (next_cost, is_offline, user_id, amp_id))
-            conn.commit()
-    except Exception as e:
-        print(f"Error in update_amplifiers_status: {e}")
-        traceback.print_exc()
+def get_state_version(cur, user_id):
+    """Current users.state_version, or None when versioning is unavailable."""
+    if NEEDS_STATE_VERSIONS:
+        return None
+    try:
+        return UserRepository(cur).state_version(user_id)
+    except sqlite3.Error as e:
+        log.error(f"Error reading state_version: {e}")
+        return None
 
-@app.route("/api/getGameState", methods=["GET"])
-def get_game_state():
+# user_machines / pets columns -> the camelCase keys the client uses
+MACHINE_JSON_RENAMES = {"machine_type": "type"}
+MACHINE_JSON_DEFAULTS = {"provisionalMint": 0, "room": 1}
+
+def game_state_response(payload, etag=None):
+    response = negotiate_response(payload, columnar=("machines", "pets"))
+    if etag:
+        response.set_etag(etag)
+        # Let browsers revalidate every time so unchanged polls get a 304
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def publish_state_change(cur, user_id, resources=None):
+    """Tell the player's open event streams that their state changed.
+
+    Sent once the request's transaction commits, so clients refetching on
+    the event see the new state.
+    """
+    if not may_have_listeners(user_id):
+        return
+    version = get_state_version(cur, user_id)
+    resources = {name: float(amount) for name, amount in (resources or {}).items()}
+
+    def send():
+        publish(user_id, "state", {"version": version})
+        if resources:
+            publish(user_id, "resources", resources)
+    after_commit(send)
+
+def publish_activation(cur, user_id, machine_id, machine_type, now_ms, resources=None):
+    """Announce an activation and schedule the machine's readiness event."""
+    publish_state_change(cur, user_id, resources)
+
+    def send():
+        publish(user_id, "machineCooldown", {"machineId": machine_id, "readyAt": now_ms + ACTIVATION_COOLDOWN_MS})
+        cooldown_scheduler.machine_activated(user_id, machine_id, machine_type, now_ms)
+    after_commit(send)
+
+def warm_scvx_balance():
+    """Fetch the request's sCVX balance before its transaction opens, so the
+    view never makes a gateway call while holding the write lock."""
+    data = request.get_json(silent=True) or {}
+    account_address = data.get("accountAddress")
+    if account_address and 'telegram_id' in session:
+        g.staked_cvx = fetch_scvx_balance(account_address)
+
+def prepared_scvx_balance(account_address):
+    """The balance warm_scvx_balance() fetched for this request (0 without one)."""
+    if not account_address:
+        return 0
+    return g.get("staked_cvx", 0)
+
+# How often an idle event stream sends a comment line to keep proxies from closing it
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_MAX_POLL_SECONDS = 55
+
+# Each open stream or long poll occupies a server thread until it ends
+stream_slots = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+
+@app.route("/api/events", methods=["GET"])
+def events_stream():
+    """Live game events for the logged-in player.
+
+    Streams text/event-stream by default; with ?poll=1 it long-polls instead,
+    waiting up to ?timeout= seconds and returning {"events": [...]}.
+    """
     try:
-        print("=== GET GAME STATE CALLED ===")
         if 'telegram_id' not in session:
-            print("No telegram_id in session")
             return jsonify({"error": "Not logged in"}), 401
 
         user_id = session['telegram_id']
-        print(f"Fetching game state for user: {user_id}")
-        
-        conn = get_db_connection()
+
+        conn = get_db_connection(user_id)
         cur = conn.cursor()
+        state_version = get_state_version(cur, user_id)
+        cur.close()
+        conn.close()
 
-        # Try to update amplifier status
-        try:
-            update_amplifiers_status(user_id, conn, cur)
-        except Exception as e:
-            print(f"Error updating amplifier status: {e}")
-            # Continue anyway
+        if not stream_slots.acquire(blocking=False):
+            # Leave the threads to ordinary requests; the client polls getGameState
+            response = jsonify({"error": "Too many open event streams", "version": state_version})
+            response.status_code = 503
+            response.headers['Retry-After'] = '30'
+            return response
 
-        # Get tcorvax and seen_room_unlock flag
-        has_seen_room_column = True
-        try:
-            cur.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in cur.fetchall()]
-            has_seen_room_column = 'seen_room_unlock' in columns
-        except:
-            has_seen_room_column = False
-        
-        if has_seen_room_column:
-            cur.execute("SELECT corvax_count, seen_room_unlock FROM users WHERE user_id=?", (user_id,))
-        else:
-            cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
-            
-        row = cur.fetchone()
-        tcorvax = row["corvax_count"] if row else 0
-        seen_room_unlock = row["seen_room_unlock"] if (row and has_seen_room_column) else 0
-
-        # Get other resources
-        catNips = get_or_create_resource(cur, user_id, 'catNips')
-        energy = get_or_create_resource(cur, user_id, 'energy')
-        eggs = get_or_create_resource(cur, user_id, 'eggs')
-
-        # Check if provisional_mint and room columns exist
-        has_provisional_mint = True
-        has_room_column = True
-        try:
-            cur.execute("PRAGMA table_info(user_machines)")
-            columns = [column[1] for column in cur.fetchall()]
-            has_provisional_mint = 'provisional_mint' in columns
-            has_room_column = 'room' in columns
-        except:
-            has_provisional_mint = False
-            has_room_column = False
-        
-        # Get machines with appropriate query
-        machines = []
-        try:
-            if has_provisional_mint and has_room_column:
-                print("Querying with provisional_mint and room columns")
-                cur.execute("""
-                    SELECT id, machine_type, x, y, level, last_activated, is_offline, provisional_mint, room
-                    FROM user_machines
-                    WHERE user_id=?
-                """, (user_id,))
-            elif has_provisional_mint:
-                print("Querying with provisional_mint column")
-                cur.execute("""
-                    SELECT id, machine_type, x, y, level, last_activated, is_offline, provisional_mint
-                    FROM user_machines
-                    WHERE user_id=?
-                """, (user_id,))
-            else:
-                print("Querying without provisional_mint column")
-                cur.execute("""
-                    SELECT id, machine_type, x, y, level, last_activated, is_offline
-                    FROM user_machines
-                    WHERE user_id=?
-                """, (user_id,))
-                
-            rows = cur.fetchall()
-            for row in rows:
-                # Convert SQLite row to Python dict
-                machine = dict(row)
-                
-                # Prepare proper JSON object
-                machine_dict = {
-                    "id": machine["id"],
-                    "type": machine["machine_type"],
-                    "x": machine["x"],
-                    "y": machine["y"],
-                    "level": machine["level"],
-                    "lastActivated": machine["last_activated"],
-                    "isOffline": machine["is_offline"]
-                }
-                
-                # Add provisional_mint if available
-                if "provisional_mint" in machine:
-                    machine_dict["provisionalMint"] = machine["provisional_mint"]
-                else:
-                    machine_dict["provisionalMint"] = 0
-                
-                # Add room information if available
-                if "room" in machine:
-                    machine_dict["room"] = machine["room"]
+        sub = bus.subscribe(user_id)
+
+        if request.args.get("poll"):
+            timeout = min(max(request.args.get("timeout", 25, type=int), 0), EVENTS_MAX_POLL_SECONDS)
+            try:
+                first = sub.get(timeout)
+                events = [first] + sub.drain() if first is not None else []
+            finally:
+                bus.unsubscribe(sub)
+                stream_slots.release()
+            return jsonify({"version": state_version, "events": events})
+
+        def generate():
+            yield "retry: 5000\n\n"
+            yield format_sse({"id": 0, "type": "hello", "data": {"version": state_version}})
+            while True:
+                event = sub.get(EVENTS_HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ": ping\n\n"
                 else:
-                    machine_dict["room"] = 1  # Default to room 1
-                    
-                machines.append(machine_dict)
-            
-        except Exception as e:
-            print(f"Error fetching machines: {e}")
-            traceback.print_exc()
+                    yield format_sse(event)
+
+        response = Response(generate(), mimetype="text/event-stream")
+        # Runs when the server closes the response, even if the generator
+        # never started
+        response.call_on_close(stream_slots.release)
+        response.call_on_close(lambda: bus.unsubscribe(sub))
+        response.headers['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    except Exception as e:
+        log.exception(f"Error in events_stream: {e}")
+        return jsonify({"error": "Server error"}), 500
 
-        # Get count of machines by type to determine if second room is unlocked
-        room_unlocked = 1  # Default to 1 room
-        
-        # Check machine counts to determine if room 2 is unlocked
-        cur.execute("""
-            SELECT machine_type, COUNT(*) as count
-            FROM user_machines
-            WHERE user_id=?
-            GROUP BY machine_type
-        """, (user_id,))
-        
-        machine_counts = {}
-        for row in cur.fetchall():
-            machine_counts[row['machine_type']] = row['count']
-        
-        # Room 2 unlocks when player has built 2 cat lairs, 2 reactors, and 1 amplifier
-        cat_lair_count = machine_counts.get('catLair', 0)
-        reactor_count = machine_counts.get('reactor', 0)
-        amplifier_count = machine_counts.get('amplifier', 0)
-        
-        if cat_lair_count >= 2 and reactor_count >= 2 and amplifier_count >= 1:
-            room_unlocked = 2
+# What ?sections= can ask for; a full state has all of them
+GAME_STATE_SECTIONS = frozenset(("resources", "machines", "pets", "rooms"))
 
-        # Get pets (NEW)
-        pets = []
+@app.route("/api/getGameState", methods=["GET"])
+def get_game_state():
+    """The player's game state, or the part of it selected by the query string.
+
+    ?sections=resources,machines,pets,rooms limits the payload (and the
+    queries run) to those sections; ?room=N keeps only that room's machines
+    and pets; ?since=V returns only what changed after version V.
+    """
+    try:
+        log.debug("Get game state request")
+        if 'telegram_id' not in session:
+            log.debug("No telegram_id in session")
+            return jsonify({"error": "Not logged in"}), 401
+
+        user_id = session['telegram_id']
+        since = request.args.get("since", type=int)
+        room_filter = request.args.get("room", type=int)
+        sections = GAME_STATE_SECTIONS
+        if request.args.get("sections"):
+            sections = frozenset(name.strip() for name in request.args["sections"].split(",") if name.strip())
+            unknown = sections - GAME_STATE_SECTIONS
+            if unknown:
+                return jsonify({"error": f"Unknown sections: {', '.join(sorted(unknown))}"}), 400
+        log.debug(f"Fetching game state for user: {user_id} (since={since})")
+
+        # Try to update amplifier status
         try:
-            cur.execute("""
-                SELECT id, x, y, room, type, parent_machine
-                FROM pets
-                WHERE user_id=?
-            """, (user_id,))
-            
-            rows = cur.fetchall()
-            for row in rows:
-                pet = {
-                    "id": row["id"],
-                    "x": row["x"],
-                    "y": row["y"],
-                    "room": row["room"],
-                    "type": row["type"],
-                    "parentMachine": row["parent_machine"]
-                }
-                pets.append(pet)
-                
+            settle_upkeep(user_id, "getGameState.upkeep")
         except Exception as e:
-            print(f"Error fetching pets: {e}")
-            traceback.print_exc()
-        
-        cur.close()
-        conn.close()
-        
-        print(f"Returning game state with {len(machines)} machines, {room_unlocked} rooms unlocked, {len(pets)} pets")
-        
-        # Return with seen_room_unlock and eggs values
-        return jsonify({
-            "tcorvax": float(tcorvax),
-            "catNips": float(catNips),
-            "energy": float(energy),
-            "eggs": float(eggs),
-            "machines": machines,
-            "roomsUnlocked": room_unlocked,
-            "seenRoomUnlock": seen_room_unlock,
-            "pets": pets  # Add pets to the response
-        })
-        
-    except Exception as e:
-        print(f"Error in get_game_state: {e}")
-        traceback.print_exc()
-        return jsonify({"error": f"Server error: {str(e)}"}), 500
+            log.error(f"Error updating amplifier status: {e}")
+            # Continue anyway
 
-def build_cost(machine_type, how_many_already, user_id=None):
-    try:
-        if machine_type == "catLair":
-            if how_many_already == 0:
-                return {"tcorvax": 10}
-            elif how_many_already == 1:
-                return {"tcorvax": 40}
-            else:
-                return None
+        conn = get_db_connection(user_id)
+        cur = conn.cursor()
 
-        elif machine_type == "reactor":
-            if how_many_already == 0:
-                return {"tcorvax": 10, "catNips": 10}
-            elif how_many_already == 1:
-                return {"tcorvax": 40, "catNips": 40}
-            elif how_many_already == 2 and user_id is not None:
-                # Check if user can build third reactor
-                conn = get_db_connection()
-                cur = conn.cursor()
-                can_build = can_build_third_reactor(cur, user_id)
+        # First state load after login: make sure the gateway caches are warming
+        if session.pop('prefetch_pending', False):
+            enqueue_prefetch(get_known_accounts(cur, user_id))
+
+        # Unchanged since the client's copy: skip building the payload entirely
+        state_version = get_state_version(cur, user_id)
+        etag = None
+        if state_version is not None:
+            etag = f"gs-{user_id}-{state_version}" + (f"-since-{since}" if since is not None else "")
+            if sections != GAME_STATE_SECTIONS:
+                etag += "-s-" + ".".join(sorted(sections))
+            if room_filter is not None:
+                etag += f"-room-{room_filter}"
+            if wants_msgpack():
+                etag += "-mp"
+            if request.if_none_match.contains_weak(etag) or (since is not None and since >= state_version):
                 cur.close()
                 conn.close()
-                
-                if can_build:
-                    return {"tcorvax": 640, "catNips": 640}
-                else:
-                    return None
-            else:
-                return None
-
-        elif machine_type == "amplifier":
-            if how_many_already == 0:
-                return {"tcorvax": 10, "catNips": 10, "energy": 10}
-            else:
-                return None
-                
-        elif machine_type == "incubator":
-            if how_many_already == 0:
-                return {"tcorvax": 320, "catNips": 320, "energy": 320}
-            else:
-                return None
-        
-        # Updated FomoHit machine costs
-        elif machine_type == "fomoHit":
-            if how_many_already == 0:
-                return {"tcorvax": 640, "catNips": 640, "energy": 640}  # Updated cost
-            else:
-                return None
+                response = game_state_response({}, etag)
+                response.status_code = 304
+                response.set_data(b"")
+                return response
+        else:
+            since = None  # deltas need the version columns
 
-        return None
-    except Exception as e:
-        print(f"Error in build_cost: {e}")
-        traceback.print_exc()
-        return None
+        if since is not None:
+            payload = build_game_state_delta(cur, user_id, since, sections, room_filter)
+            payload["version"] = state_version
+            cur.close()
+            conn.close()
+            log.debug(f"Returning game state delta since {since}: sections {sorted(sections)}")
+            return game_state_response(payload, etag)
 
-def is_second_machine(cur, user_id, machine_type, machine_id):
-    try:
-        cur.execute("""
-            SELECT id FROM user_machines
-            WHERE user_id=? AND machine_type=?
-            ORDER BY id
-        """, (user_id, machine_type))
-        machine_ids = [row["id"] for row in cur.fetchall()]
-        if machine_id not in machine_ids:
-            return False
-        index = machine_ids.index(machine_id)
-        return (index == 1)
-    except Exception as e:
-        print(f"Error in is_second_machine: {e}")
-        traceback.print_exc()
-        return False
+        payload = {}
 
-def are_first_machine_lvl3(cur, user_id, mtype):
-    try:
-        cur.execute("""
-            SELECT level FROM user_machines
-            WHERE user_id=? AND machine_type=?
-            ORDER BY id
-            LIMIT 1
-        """, (user_id, mtype))
-        r = cur.fetchone()
-        if r and r["level"] >= 3:
-            return True
-        return False
-    except Exception as e:
-        print(f"Error in are_first_machine_lvl3: {e}")
-        traceback.print_exc()
-        return False
+        # Get tcorvax and seen_room_unlock flag
+        if "resources" in sections or "rooms" in sections:
+            user = UserRepository(cur).get(user_id) or {}
+            tcorvax = user.get("corvax_count", 0)
+            seen_room_unlock = user.get("seen_room_unlock", 0)
+
+        if "resources" in sections:
+            payload["tcorvax"] = float(tcorvax)
+            payload["catNips"] = float(get_or_create_resource(cur, user_id, 'catNips'))
+            payload["energy"] = float(get_or_create_resource(cur, user_id, 'energy'))
+            payload["eggs"] = float(get_or_create_resource(cur, user_id, 'eggs'))
+
+        if "machines" in sections:
+            machines = []
+            try:
+                machines = rows_to_json(MachineRepository(cur).list(user_id, room_filter),
+                                        MACHINE_JSON_RENAMES, MACHINE_JSON_DEFAULTS)
+            except Exception as e:
+                log.exception(f"Error fetching machines: {e}")
+            payload["machines"] = machines
 
-def are_two_machines_lvl3(cur, user_id, mtype):
-    try:
-        cur.execute("""
-            SELECT level FROM user_machines
-            WHERE user_id=? AND machine_type=?
-            ORDER BY id
-        """, (user_id, mtype))
-        rows = cur.fetchall()
-        if len(rows) < 2:
-            return False
-        if rows[0]["level"] >=3 and rows[1]["level"] >=3:
-            return True
-        return False
-    except Exception as e:
-        print(f"Error in are_two_machines_lvl3: {e}")
-        traceback.print_exc()
-        return False
+        if "rooms" in sections:
+            # Room 2 unlocks when player has built 2 cat lairs, 2 reactors, and 1 amplifier
+            payload["roomsUnlocked"] = load_machine_summary(cur, user_id).rooms
+            payload["seenRoomUnlock"] = seen_room_unlock
 
-def check_amplifier_gating(cur, user_id, next_level):
-    try:
-        if next_level == 4:
-            if not are_first_machine_lvl3(cur, user_id, "catLair"):
-                return False
-            if not are_first_machine_lvl3(cur, user_id, "reactor"):
-                return False
-            return True
-        elif next_level == 5:
-            if not are_two_machines_lvl3(cur, user_id, "catLair"):
-                return False
-            if not are_two_machines_lvl3(cur, user_id, "reactor"):
-                return False
-            return True
-        return True
-    except Exception as e:
-        print(f"Error in check_amplifier_gating: {e}")
-        traceback.print_exc()
-        return False
+        # Get pets (NEW)
+        if "pets" in sections:
+            pets = []
+            try:
+                pets = rows_to_json(PetRepository(cur).list(user_id, room_filter))
 
-def can_build_incubator(cur, user_id):
-    try:
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='catLair'
-        """, (user_id,))
-        total_cat_lairs = cur.fetchone()[0]
-        if total_cat_lairs == 0:
-            return False
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='catLair' AND level=3
-        """, (user_id,))
-        max_level_cat_lairs = cur.fetchone()[0]
-        if max_level_cat_lairs < total_cat_lairs:
-            return False
+            except Exception as e:
+                log.exception(f"Error fetching pets: {e}")
+            payload["pets"] = pets
 
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='reactor'
-        """, (user_id,))
-        total_reactors = cur.fetchone()[0]
-        if total_reactors == 0:
-            return False
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='reactor' AND level=3
-        """, (user_id,))
-        max_level_reactors = cur.fetchone()[0]
-        if max_level_reactors < total_reactors:
-            return False
+        cur.close()
+        conn.close()
 
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type='amplifier' AND level=5
-        """, (user_id,))
-        max_level_amplifier = cur.fetchone()[0]
-        if max_level_amplifier == 0:
-            return False
+        log.debug(f"Returning game state sections {sorted(sections)}"
+              + (f" for room {room_filter}" if room_filter is not None else ""))
 
-        return True
+        payload["version"] = state_version
+        return game_state_response(payload, etag)
+        
     except Exception as e:
-        print(f"Error in can_build_incubator: {e}")
-        traceback.print_exc()
-        return False
+        log.exception(f"Error in get_game_state: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
 
-def upgrade_cost(cur, user_id, machine_type, current_level, machine_id):
-    try:
-        next_level = current_level + 1
-        if machine_type in ("catLair","reactor"):
-            if next_level > 3:
-                return None
-        elif machine_type == "amplifier":
-            if next_level > 5:
-                return None
-            if not check_amplifier_gating(cur, user_id, next_level):
-                return None
-        # Add support for incubator level 2
-        elif machine_type == "incubator":
-            if next_level > 2:  # Max level 2
-                return None
-        else:
-            return None
+def build_game_state_delta(cur, user_id, since, sections=GAME_STATE_SECTIONS, room=None):
+    """Only the machines, pets and resources whose version is newer than `since`."""
+    payload = {"delta": True, "since": since}
+    urow = UserRepository(cur).get(user_id)
 
-        if machine_type == "amplifier":
-            if not check_amplifier_gating(cur, user_id, next_level):
-                return None
+    if "resources" in sections:
+        resources = {}
+        if urow and urow["corvax_version"] > since:
+            resources["tcorvax"] = float(urow["corvax_count"])
+        resources.update(ResourceRepository(cur).changed_since(user_id, since))
+        payload["resources"] = resources
 
-        if machine_type == "catLair":
-            base_for_level1 = {"tcorvax": 10}
-        elif machine_type == "reactor":
-            base_for_level1 = {"tcorvax": 10, "catNips": 10}
-        elif machine_type == "amplifier":
-            base_for_level1 = {"tcorvax": 10, "catNips": 10, "energy": 10}
-        elif machine_type == "incubator":
-            # Set base cost for incubator upgrade - note that this is double the original build cost of 320
-            # Ensuring frontend and backend match on this value (640)
-            base_for_level1 = {"tcorvax": 640, "catNips": 640, "energy": 640}
-            # Return cost directly for incubator without additional multipliers
-            return base_for_level1
-        else:
-            return None
+    if "machines" in sections:
+        payload["machines"] = rows_to_json(MachineRepository(cur).list(user_id, room, since),
+                                           MACHINE_JSON_RENAMES, MACHINE_JSON_DEFAULTS)
 
-        second = is_second_machine(cur, user_id, machine_type, machine_id)
-        mult = 2 ** (next_level - 1)
-        cost_out = {}
-        for res, val in base_for_level1.items():
-            c = val * mult
-            if second and (machine_type in ["catLair","reactor"]):
-                c *= 4
-            cost_out[res] = c
+    if "pets" in sections:
+        payload["pets"] = rows_to_json(PetRepository(cur).list(user_id, room, since))
 
-        return cost_out
-    except Exception as e:
-        print(f"Error in upgrade_cost: {e}")
-        traceback.print_exc()
-        return None
+    if "rooms" in sections:
+        payload["roomsUnlocked"] = load_machine_summary(cur, user_id).rooms
+        payload["seenRoomUnlock"] = urow["seen_room_unlock"] if urow else 0
+
+    return payload
 
 @app.route("/api/dismissRoomUnlock", methods=["POST"])
+@user_locked
+@transactional
 def dismiss_room_unlock():
     try:
         if 'telegram_id' not in session:
             return jsonify({"error": "Not logged in"}), 401
 
         user_id = session['telegram_id']
-        conn = get_db_connection()
+        conn = get_db_connection(user_id)
         cur = conn.cursor()
 
         # Update the seen_room_unlock flag
-        cur.execute("""
-            UPDATE users
-            SET seen_room_unlock=1
-            WHERE user_id=?
-        """, (user_id,))
+        UserRepository(cur).mark_room_unlock_seen(user_id)
         
         conn.commit()
+        publish_state_change(cur, user_id)
         cur.close()
         conn.close()
 
         return jsonify({"status": "ok"})
     except Exception as e:
-        print(f"Error in dismiss_room_unlock: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in dismiss_room_unlock: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/api/buildMachine", methods=["POST"])
+@user_locked
+@transactional
 def build_machine():
     try:
         if 'telegram_id' not in session:
@@ -1253,182 +1239,88 @@ def build_machine():
         y_coord = data.get("y", 0)
         room = data.get("room", 1)  # Default to room 1 if not specified
         
-        print(f"=== BUILD MACHINE REQUEST ===")
-        print(f"Machine type: {machine_type}")
-        print(f"Coordinates: x={x_coord}, y={y_coord}")
-        print(f"Room: {room}")
+        log.debug("Build machine request",
+                  extra={"machine_type": machine_type, "x": x_coord, "y": y_coord, "room": room})
 
         user_id = session['telegram_id']
-        conn = get_db_connection()
+        conn = get_db_connection(user_id)
         cur = conn.cursor()
 
         update_amplifiers_status(user_id, conn, cur)
 
-        cur.execute("""
-            SELECT COUNT(*) FROM user_machines
-            WHERE user_id=? AND machine_type=?
-        """, (user_id, machine_type))
-        how_many = cur.fetchone()[0]
-        print(f"Existing machines of type {machine_type}: {how_many}")
+        # One query for every count, level and prerequisite check below
+        summary = load_machine_summary(cur, user_id)
+        how_many = summary.count(machine_type)
+        log.debug(f"Existing machines of type {machine_type}: {how_many}")
 
-        cost_dict = build_cost(machine_type, how_many, user_id)
+        cost_dict, build_error = build_cost(summary, machine_type)
         if cost_dict is None:
-            print(f"Cannot build more machines of type {machine_type}")
+            log.warning(f"Cannot build {machine_type}: {build_error}")
             cur.close()
             conn.close()
-            return jsonify({"error": "Cannot build more of this machine type."}), 400
-
-        # Add special prerequisite checks with detailed logging
-        if machine_type == "incubator":
-            can_build = can_build_incubator(cur, user_id)
-            print(f"Can build incubator check: {can_build}")
-            if not can_build:
-                cur.close()
-                conn.close()
-                return jsonify({"error": "All machines must be at max level to build Incubator."}), 400
-        
-        # Add check for fomoHit prerequisites with simplified requirements
-        elif machine_type == "fomoHit":
-            print("Checking FOMO HIT prerequisites...")
-            
-            # Check if user has at least one of each required machine type
-            required_types = ['catLair', 'reactor', 'amplifier', 'incubator']
-            for req_type in required_types:
-                cur.execute("""
-                    SELECT COUNT(*) FROM user_machines
-                    WHERE user_id=? AND machine_type=?
-                """, (user_id, req_type))
-                count = cur.fetchone()[0]
-                print(f"  - Has {req_type}: {count > 0}")
-                if count == 0:
-                    cur.close()
-                    conn.close()
-                    return jsonify({"error": f"Must build {req_type} first."}), 400
-                    
-            print("All FOMO HIT prerequisites satisfied")
-            
-        # Add check for third reactor
-        elif machine_type == "reactor" and how_many == 2:
-            if not can_build_third_reactor(cur, user_id):
-                cur.close()
-                conn.close()
-                return jsonify({"error": "You need to build both Incubator and FOMO HIT before building a third Reactor."}), 400
+            return jsonify({"error": build_error}), 400
 
         # Check resource costs
-        cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        if not row:
+        users = UserRepository(cur)
+        tcorvax_val = users.corvax(user_id)
+        if tcorvax_val is None:
             cur.close()
             conn.close()
             return jsonify({"error": "User not found"}), 404
-            
-        tcorvax_val = float(row["corvax_count"])
+
         catNips_val = float(get_or_create_resource(cur, user_id, 'catNips'))
         energy_val  = float(get_or_create_resource(cur, user_id, 'energy'))
         
-        print(f"Resources - TCorvax: {tcorvax_val}, CatNips: {catNips_val}, Energy: {energy_val}")
-        print(f"Cost - {cost_dict}")
+        log.debug(f"Resources - TCorvax: {tcorvax_val}, CatNips: {catNips_val}, Energy: {energy_val}")
+        log.debug(f"Cost - {cost_dict}")
 
         if (tcorvax_val < cost_dict.get("tcorvax",0) or
             catNips_val < cost_dict.get("catNips",0) or
             energy_val < cost_dict.get("energy",0)):
-            print("Not enough resources")
+            log.warning("Not enough resources")
             cur.close()
             conn.close()
             return jsonify({"error": "Not enough resources"}), 400
 
-        machine_size = 128
-        max_x = 800 - machine_size
-        max_y = 600 - machine_size
-        if x_coord < 0 or x_coord > max_x or y_coord < 0 or y_coord > max_y:
+        if not in_bounds(x_coord, y_coord):
             cur.close()
             conn.close()
             return jsonify({"error": "Cannot build outside map boundaries."}), 400
 
         # Check for collision with other machines IN THE SAME ROOM
-        cur.execute("SELECT x, y, room FROM user_machines WHERE user_id=?", (user_id,))
-        all_m = cur.fetchall()
-        for m in all_m:
-            # Only check collision if in the same room
-            if m["room"] == room:
-                dx = abs(m["x"] - x_coord)
-                dy = abs(m["y"] - y_coord)
-                if dx < machine_size and dy < machine_size:
-                    cur.close()
-                    conn.close()
-                    return jsonify({"error": "Cannot build here!"}), 400
+        layout = load_layout(cur, user_id, get_state_version(cur, user_id))
+        if layout.collisions(room, x_coord, y_coord):
+            cur.close()
+            conn.close()
+            return jsonify({"error": "Cannot build here!"}), 400
 
         tcorvax_val -= cost_dict.get("tcorvax",0)
         catNips_val -= cost_dict.get("catNips",0)
         energy_val  -= cost_dict.get("energy",0)
 
-        cur.execute("""
-            UPDATE users SET corvax_count=?
-            WHERE user_id=?
-        """, (tcorvax_val, user_id))
+        users.set_corvax(user_id, tcorvax_val)
         set_resource_amount(cur, user_id, 'catNips', catNips_val)
         set_resource_amount(cur, user_id, 'energy', energy_val)
 
-        is_offline = 1 if machine_type == "incubator" else 0
-        
-        # Check if both provisional_mint and room columns exist
-        has_provisional_mint = True
-        has_room_column = True
-        try:
-            cur.execute("PRAGMA table_info(user_machines)")
-            columns = [column[1] for column in cursor.fetchall()]
-            has_provisional_mint = 'provisional_mint' in columns
-            has_room_column = 'room' in columns
-        except:
-            has_provisional_mint = False
-            has_room_column = False
-            
-        # Insert with appropriate columns
-        if has_provisional_mint and has_room_column:
-            cur.execute("""
-                INSERT INTO user_machines
-                (user_id, machine_type, x, y, level, last_activated, is_offline, next_cost_time, provisional_mint, room)
-                VALUES (?, ?, ?, ?, 1, 0, ?, 0, 0, ?)
-            """, (user_id, machine_type, x_coord, y_coord, is_offline, room))
-        elif has_provisional_mint:
-            cur.execute("""
-                INSERT INTO user_machines
-                (user_id, machine_type, x, y, level, last_activated, is_offline, next_cost_time, provisional_mint)
-                VALUES (?, ?, ?, ?, 1, 0, ?, 0, 0)
-            """, (user_id, machine_type, x_coord, y_coord, is_offline))
-        else:
-            cur.execute("""
-                INSERT INTO user_machines
-                (user_id, machine_type, x, y, level, last_activated, is_offline, next_cost_time)
-                VALUES (?, ?, ?, ?, 1, 0, ?, 0)
-            """, (user_id, machine_type, x_coord, y_coord, is_offline))
-
+        is_offline = 1 if machine_type == "incubator" else 0
+        new_machine_id = MachineRepository(cur).add(user_id, machine_type, x_coord, y_coord, room, is_offline)
+
+        # Keep the stored summary in step, in the same transaction
+        summary.add_machine(new_machine_id, machine_type, 1, is_offline)
+        save_machine_summary(cur, user_id, summary)
         conn.commit()
+        # The index is changed in place; keep it out of the cache until the
+        # request's transaction has really committed
+        layout_cache.invalidate(str(user_id))
+        layout.add(new_machine_id, x_coord, y_coord, room if not NEEDS_ROOM_COLUMN else 1)
+        version = get_state_version(cur, user_id)
+        after_commit(lambda: store_layout(user_id, version, layout))
+        publish_state_change(cur, user_id, {"tcorvax": tcorvax_val, "catNips": catNips_val, "energy": energy_val})
         
         # Check if room 2 is newly unlocked
-        room_unlocked = 1
-        
-        # Count machines by type
-        cur.execute("""
-            SELECT machine_type, COUNT(*) as count
-            FROM user_machines
-            WHERE user_id=?
-            GROUP BY machine_type
-        """, (user_id,))
-        
-        machine_counts = {}
-        for row in cur.fetchall():
-            machine_counts[row['machine_type']] = row['count']
-        
-        # Room 2 unlocks when player has built 2 cat lairs, 2 reactors, and 1 amplifier
-        cat_lair_count = machine_counts.get('catLair', 0)
-        reactor_count = machine_counts.get('reactor', 0)
-        amplifier_count = machine_counts.get('amplifier', 0)
-        
-        if cat_lair_count >= 2 and reactor_count >= 2 and amplifier_count >= 1:
-            room_unlocked = 2
+        room_unlocked = summary.rooms
             
-        print(f"Machine built successfully, rooms unlocked: {room_unlocked}")
+        log.debug(f"Machine built successfully, rooms unlocked: {room_unlocked}")
         cur.close()
         conn.close()
 
@@ -1443,11 +1335,15 @@ def build_machine():
             "roomsUnlocked": room_unlocked
         })
     except Exception as e:
-        print(f"Error in build_machine: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in build_machine: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+# TCorvax charged per machine that actually moves by moveMachine and "move" mode syncLayout
+MOVE_COST_TCORVAX = MOVE_COST["tcorvax"]
+
 @app.route("/api/moveMachine", methods=["POST"])
+@user_locked
+@transactional
 def move_machine():
     try:
         if 'telegram_id' not in session:
@@ -1463,32 +1359,26 @@ def move_machine():
             return jsonify({"error": "Missing machineId"}), 400
 
         user_id = session['telegram_id']
-        conn = get_db_connection()
+        conn = get_db_connection(user_id)
         cur = conn.cursor()
 
         # Verify the machine exists and belongs to the user
-        cur.execute("""
-            SELECT id, machine_type, room FROM user_machines
-            WHERE user_id=? AND id=?
-        """, (user_id, machine_id))
-        
-        machine = cur.fetchone()
+        machines = MachineRepository(cur)
+        machine = machines.get(user_id, machine_id)
         if not machine:
             cur.close()
             conn.close()
             return jsonify({"error": "Machine not found"}), 404
         
         # Check if user has enough TCorvax (50)
-        movement_cost = 50
+        movement_cost = MOVE_COST_TCORVAX
         
-        cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        if not row:
+        users = UserRepository(cur)
+        tcorvax_val = users.corvax(user_id)
+        if tcorvax_val is None:
             cur.close()
             conn.close()
             return jsonify({"error": "User not found"}), 404
-            
-        tcorvax_val = float(row["corvax_count"])
         
         if tcorvax_val < movement_cost:
             cur.close()
@@ -1496,46 +1386,31 @@ def move_machine():
             return jsonify({"error": "Not enough TCorvax (50 required)"}), 400
 
         # Validate the new position
-        machine_size = 128
-        max_x = 800 - machine_size
-        max_y = 600 - machine_size
-        
-        if new_x < 0 or new_x > max_x or new_y < 0 or new_y > max_y:
+        if not in_bounds(new_x, new_y):
             cur.close()
             conn.close()
             return jsonify({"error": "Cannot move outside map boundaries."}), 400
 
         # Check for collision with other machines IN THE SAME ROOM
-        cur.execute("SELECT id, x, y, room FROM user_machines WHERE user_id=? AND id != ?", 
-                  (user_id, machine_id))
-        
-        other_machines = cur.fetchall()
-        for m in other_machines:
-            # Only check collision if in the same room
-            if m["room"] == new_room:
-                dx = abs(m["x"] - new_x)
-                dy = abs(m["y"] - new_y)
-                if dx < machine_size and dy < machine_size:
-                    cur.close()
-                    conn.close()
-                    return jsonify({"error": "Cannot move here due to collision with another machine!"}), 400
+        layout = load_layout(cur, user_id, get_state_version(cur, user_id))
+        if layout.collisions(new_room, new_x, new_y, exclude=machine["id"]):
+            cur.close()
+            conn.close()
+            return jsonify({"error": "Cannot move here due to collision with another machine!"}), 400
 
         # Deduct TCorvax cost
         tcorvax_val -= movement_cost
-        cur.execute("""
-            UPDATE users
-            SET corvax_count=?
-            WHERE user_id=?
-        """, (tcorvax_val, user_id))
+        users.set_corvax(user_id, tcorvax_val)
 
         # Update machine position and room
-        cur.execute("""
-            UPDATE user_machines
-            SET x=?, y=?, room=?
-            WHERE user_id=? AND id=?
-        """, (new_x, new_y, new_room, user_id, machine_id))
+        machines.move(user_id, machine_id, new_x, new_y, new_room)
 
         conn.commit()
+        layout_cache.invalidate(str(user_id))
+        layout.move(machine["id"], new_x, new_y, new_room)
+        version = get_state_version(cur, user_id)
+        after_commit(lambda: store_layout(user_id, version, layout))
+        publish_state_change(cur, user_id, {"tcorvax": tcorvax_val})
         cur.close()
         conn.close()
 
@@ -1552,11 +1427,12 @@ def move_machine():
             }
         })
     except Exception as e:
-        print(f"Error in move_machine: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in move_machine: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/api/upgradeMachine", methods=["POST"])
+@user_locked
+@transactional
 def upgrade_machine():
     try:
         if 'telegram_id' not in session:
@@ -1568,17 +1444,13 @@ def upgrade_machine():
             return jsonify({"error": "Missing machineId"}), 400
 
         user_id = session['telegram_id']
-        conn = get_db_connection()
+        conn = get_db_connection(user_id)
         cur = conn.cursor()
 
         update_amplifiers_status(user_id, conn, cur)
 
-        cur.execute("""
-            SELECT id, machine_type, level
-            FROM user_machines
-            WHERE user_id=? AND id=?
-        """, (user_id, machine_id))
-        row = cur.fetchone()
+        machines = MachineRepository(cur)
+        row = machines.get(user_id, machine_id)
         if not row:
             cur.close()
             conn.close()
@@ -1587,20 +1459,20 @@ def upgrade_machine():
         machine_type = row["machine_type"]
         current_level = row["level"]
 
-        cost_dict = upgrade_cost(cur, user_id, machine_type, current_level, machine_id)
+        summary = load_machine_summary(cur, user_id)
+        cost_dict = upgrade_cost(summary, machine_type, current_level, machine_id)
         if cost_dict is None:
             cur.close()
             conn.close()
             return jsonify({"error": "Cannot upgrade further or gating not met."}), 400
 
-        cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
-        urow = cur.fetchone()
-        if not urow:
+        users = UserRepository(cur)
+        tcorvax_val = users.corvax(user_id)
+        if tcorvax_val is None:
             cur.close()
             conn.close()
             return jsonify({"error": "User not found"}), 404
 
-        tcorvax_val = float(urow["corvax_count"])
         catNips_val = float(get_or_create_resource(cur, user_id, 'catNips'))
         energy_val  = float(get_or_create_resource(cur, user_id, 'energy'))
 
@@ -1612,25 +1484,20 @@ def upgrade_machine():
             return jsonify({"error": "Not enough resources"}), 400
 
         new_level = current_level + 1
-        cur.execute("""
-            UPDATE user_machines
-            SET level=?
-            WHERE user_id=? AND id=?
-        """, (new_level, user_id, machine_id))
+        machines.set_level(user_id, machine_id, new_level)
+        summary.upgrade_machine(machine_id, machine_type, current_level, new_level)
+        save_machine_summary(cur, user_id, summary)
 
         tcorvax_val -= cost_dict.get("tcorvax",0)
         catNips_val -= cost_dict.get("catNips",0)
         energy_val  -= cost_dict.get("energy",0)
 
-        cur.execute("""
-            UPDATE users
-            SET corvax_count=?
-            WHERE user_id=?
-        """, (tcorvax_val, user_id))
+        users.set_corvax(user_id, tcorvax_val)
         set_resource_amount(cur, user_id, 'catNips', catNips_val)
         set_resource_amount(cur, user_id, 'energy', energy_val)
 
         conn.commit()
+        publish_state_change(cur, user_id, {"tcorvax": tcorvax_val, "catNips": catNips_val, "energy": energy_val})
         cur.close()
         conn.close()
 
@@ -1645,11 +1512,11 @@ def upgrade_machine():
             }
         })
     except Exception as e:
-        print(f"Error in upgrade_machine: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in upgrade_machine: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/api/checkMintStatus", methods=["POST"])
+@user_locked
 def check_mint_status():
     try:
         if 'telegram_id' not in session:
@@ -1664,33 +1531,26 @@ def check_mint_status():
             
         # Get the transaction status
         status_data = get_transaction_status(intent_hash)
+
+        # Push the outcome to the player's event stream once it settles
+        if status_data.get("status") == "Pending":
+            transaction_watcher.watch(session['telegram_id'], intent_hash, "nftMint")
         
         # If the transaction is committed successfully, update the machine
         if status_data.get("status") == "CommittedSuccess":
             user_id = session['telegram_id']
-            conn = get_db_connection()
+            conn = get_db_connection(user_id)
             cur = conn.cursor()
             
-            # Check if provisional_mint column exists
-            has_provisional_mint = True
-            try:
-                cur.execute("PRAGMA table_info(user_machines)")
-                columns = [column[1] for column in cur.fetchall()]
-                has_provisional_mint = 'provisional_mint' in columns
-            except:
-                has_provisional_mint = False
-                
-            if has_provisional_mint:
+            machines = MachineRepository(cur)
+            if "provisional_mint" in machines.columns():
                 try:
                     # Update the machine to show successful mint
-                    cur.execute("""
-                        UPDATE user_machines
-                        SET provisional_mint=0
-                        WHERE user_id=? AND id=?
-                    """, (user_id, machine_id))
+                    machines.set_provisional_mint(user_id, machine_id, False)
                     conn.commit()
+                    publish_state_change(cur, user_id)
                 except Exception as e:
-                    print(f"Error updating provisional_mint: {e}")
+                    log.error(f"Error updating provisional_mint: {e}")
             
             cur.close()
             conn.close()
@@ -1700,93 +1560,63 @@ def check_mint_status():
             "transactionStatus": status_data
         })
     except Exception as e:
-        print(f"Error in check_mint_status: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in check_mint_status: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/api/activateMachine", methods=["POST"])
+@user_locked
+@transactional(prepare=warm_scvx_balance)
 def activate_machine():
     try:
         if 'telegram_id' not in session:
             return jsonify({"error": "Not logged in"}), 401
 
-        # Log the incoming request for debugging
-        print(f"=== ACTIVATE MACHINE REQUEST ===")
         try:
             data = request.get_json(silent=True) or {}
-            print(f"Request data: {json.dumps(data, indent=2)}")
         except Exception as e:
-            print(f"Error parsing request JSON: {e}")
+            log.error(f"Error parsing request JSON: {e}")
             data = request.form or {}
-            print(f"Form data: {data}")
+        log.debug("Activate machine request", extra={"payload": dict(data)})
             
         machine_id = data.get("machineId")
         if machine_id is None:
             return jsonify({"error": "Missing machineId"}), 400
 
         user_id = session['telegram_id']
-        conn = get_db_connection()
+        conn = get_db_connection(user_id)
         cur = conn.cursor()
 
         update_amplifiers_status(user_id, conn, cur)
 
-        # Check if the provisional_mint column exists
-        has_provisional_mint = True
-        try:
-            cur.execute("PRAGMA table_info(user_machines)")
-            columns = [column[1] for column in cur.fetchall()]
-            has_provisional_mint = 'provisional_mint' in columns
-        except:
-            has_provisional_mint = False
-            
-        # Build the query based on column existence
-        if has_provisional_mint:
-            query = """
-                SELECT machine_type, level, last_activated, is_offline, provisional_mint, room
-                FROM user_machines
-                WHERE user_id=? AND id=?
-            """
-        else:
-            query = """
-                SELECT machine_type, level, last_activated, is_offline, room
-                FROM user_machines
-                WHERE user_id=? AND id=?
-            """
-            
-        cur.execute(query, (user_id, machine_id))
-        row = cur.fetchone()
-        if not row:
+        machines = MachineRepository(cur)
+        machine_data = machines.get(user_id, machine_id)
+        if not machine_data:
             cur.close()
             conn.close()
             return jsonify({"error": "Machine not found"}), 404
 
-        # Convert row to dictionary to avoid sqlite3.Row.get() issue
-        machine_data = dict(row)
-        
         machine_type = machine_data["machine_type"]
         machine_level = machine_data["level"]
         last_activated = machine_data["last_activated"] or 0
         is_offline = machine_data["is_offline"]
-        provisional_mint = machine_data.get("provisional_mint", 0) if has_provisional_mint else 0
+        provisional_mint = machine_data.get("provisional_mint", 0)
         room = machine_data.get("room", 1)  # Default to room 1 if not present
 
-        COOL_MS = 3600*1000
         now_ms = int(time.time()*1000)
         elapsed = now_ms - last_activated
-        if elapsed < COOL_MS:
-            remain = COOL_MS - elapsed
+        if elapsed < ACTIVATION_COOLDOWN_MS:
+            remain = ACTIVATION_COOLDOWN_MS - elapsed
             cur.close()
             conn.close()
             return jsonify({"error":"Cooldown not finished","remainingMs":remain}), 400
 
-        cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
-        urow = cur.fetchone()
-        if not urow:
+        users = UserRepository(cur)
+        tcorvax_val = users.corvax(user_id)
+        if tcorvax_val is None:
             cur.close()
             conn.close()
             return jsonify({"error":"User not found"}), 404
 
-        tcorvax_val = float(urow["corvax_count"])
         catNips_val = float(get_or_create_resource(cur, user_id, 'catNips'))
         energy_val = float(get_or_create_resource(cur, user_id, 'energy'))
         eggs_val = float(get_or_create_resource(cur, user_id, 'eggs'))
@@ -1799,63 +1629,46 @@ def activate_machine():
 
         if machine_type == "incubator":
             if last_activated == 0:
-                print("First incubator activation - setting online and checking sCVX rewards")
+                log.debug("First incubator activation - setting online and checking sCVX rewards")
                 
                 # Get account address from request
                 account_address = data.get("accountAddress")
-                print(f"Got account address from request: {account_address}")
+                log.debug(f"Got account address from request: {account_address}")
                 
                 # Ensure we have an account address
                 if not account_address:
-                    print("No account address provided for sCVX lookup")
+                    log.debug("No account address provided for sCVX lookup")
                     staked_cvx = 0
                 else:
-                    print(f"Fetching sCVX for account: {account_address}")
-                    # Use the server-side fetch function
-                    staked_cvx = fetch_scvx_balance(account_address)
+                    log.debug(f"Fetching sCVX for account: {account_address}")
+                    remember_account(user_id, account_address)
+                    # Fetched by warm_scvx_balance() before the transaction opened
+                    staked_cvx = prepared_scvx_balance(account_address)
                     
-                print(f"Final sCVX value: {staked_cvx}")
-                
-                # Calculate rewards based on level
-                machine_level = machine_level or 1
-                
-                # Base reward (level 1): 1 token per 100 sCVX, max 10
-                base_reward = min(10, int(staked_cvx // 100))
-                
-                # Bonus reward (level 2): additional 1 token per 1000 sCVX, no max
-                bonus_reward = 0
-                if machine_level >= 2:
-                    bonus_reward = int(staked_cvx // 1000)
+                log.debug(f"Final sCVX value: {staked_cvx}")
                 
+                # Level 1: 1 token per 100 sCVX (max 10); level 2 adds 1 per 1000 sCVX.
+                # Eggs: 1 per 500 sCVX.
+                base_reward, bonus_reward, eggs_reward = incubator_output(staked_cvx, machine_level)
                 total_reward = base_reward + bonus_reward
                 
-                # Award eggs (1 egg per 500 sCVX)
-                eggs_reward = int(staked_cvx // 500)
-                
                 # Update resources
                 tcorvax_val += total_reward
                 eggs_val += eggs_reward
                 
-                print(f"sCVX rewards calculated: Base {base_reward}, Bonus {bonus_reward}, Eggs {eggs_reward}")
+                log.debug(f"sCVX rewards calculated: Base {base_reward}, Bonus {bonus_reward}, Eggs {eggs_reward}")
 
                 # Update user's resources
-                cur.execute("""
-                    UPDATE users
-                    SET corvax_count=?
-                    WHERE user_id=?
-                """, (tcorvax_val, user_id))
+                users.set_corvax(user_id, tcorvax_val)
                 
                 # Update eggs resource
                 set_resource_amount(cur, user_id, 'eggs', eggs_val)
 
                 # Set incubator to online and update activation time
-                cur.execute("""
-                    UPDATE user_machines
-                    SET is_offline=0, last_activated=?
-                    WHERE user_id=? AND id=?
-                """, (now_ms, user_id, machine_id))
+                machines.activate(user_id, machine_id, now_ms, is_offline=0)
 
                 conn.commit()
+                publish_activation(cur, user_id, machine_id, machine_type, now_ms, {"tcorvax": tcorvax_val, "eggs": eggs_val})
                 cur.close()
                 conn.close()
 
@@ -1879,57 +1692,40 @@ def activate_machine():
             else:
                 # Get account address from request
                 account_address = data.get("accountAddress")
-                print(f"Got account address from request: {account_address}")
+                log.debug(f"Got account address from request: {account_address}")
                 
                 # Ensure we have an account address
                 if not account_address:
-                    print("No account address provided for sCVX lookup")
+                    log.debug("No account address provided for sCVX lookup")
                     staked_cvx = 0
                 else:
-                    print(f"Fetching sCVX for account: {account_address}")
-                    # Use the server-side fetch function
-                    staked_cvx = fetch_scvx_balance(account_address)
+                    log.debug(f"Fetching sCVX for account: {account_address}")
+                    remember_account(user_id, account_address)
+                    # Fetched by warm_scvx_balance() before the transaction opened
+                    staked_cvx = prepared_scvx_balance(account_address)
                     
-                print(f"Final sCVX value: {staked_cvx}")
-                
-                # Calculate rewards based on level
-                machine_level = machine_level or 1
-                
-                # Base reward (level 1): 1 token per 100 sCVX, max 10
-                base_reward = min(10, int(staked_cvx // 100))
-                
-                # Bonus reward (level 2): additional 1 token per 1000 sCVX, no max
-                bonus_reward = 0
-                if machine_level >= 2:
-                    bonus_reward = int(staked_cvx // 1000)
+                log.debug(f"Final sCVX value: {staked_cvx}")
                 
+                # Level 1: 1 token per 100 sCVX (max 10); level 2 adds 1 per 1000 sCVX.
+                # Eggs: 1 per 500 sCVX.
+                base_reward, bonus_reward, eggs_reward = incubator_output(staked_cvx, machine_level)
                 total_reward = base_reward + bonus_reward
                 
-                # Award eggs (1 egg per 500 sCVX)
-                eggs_reward = int(staked_cvx // 500)
-                
                 # Update resources
                 tcorvax_val += total_reward
                 eggs_val += eggs_reward
                 
-                print(f"sCVX rewards calculated: Base {base_reward}, Bonus {bonus_reward}, Eggs {eggs_reward}")
+                log.debug(f"sCVX rewards calculated: Base {base_reward}, Bonus {bonus_reward}, Eggs {eggs_reward}")
 
-                cur.execute("""
-                    UPDATE users
-                    SET corvax_count=?
-                    WHERE user_id=?
-                """, (tcorvax_val, user_id))
+                users.set_corvax(user_id, tcorvax_val)
                 
                 # Update eggs resource
                 set_resource_amount(cur, user_id, 'eggs', eggs_val)
 
-                cur.execute("""
-                    UPDATE user_machines
-                    SET last_activated=?
-                    WHERE user_id=? AND id=?
-                """, (now_ms, user_id, machine_id))
+                machines.activate(user_id, machine_id, now_ms)
 
                 conn.commit()
+                publish_activation(cur, user_id, machine_id, machine_type, now_ms, {"tcorvax": tcorvax_val, "eggs": eggs_val})
                 cur.close()
                 conn.close()
 
@@ -1951,44 +1747,33 @@ def activate_machine():
                 })
         
         elif machine_type == "fomoHit":
-            print(f"Handling FOMO HIT activation for machine ID: {machine_id}")
+            log.debug(f"Handling FOMO HIT activation for machine ID: {machine_id}")
             
             # First activation - mint NFT
             if last_activated == 0:
                 # Get account address from request
                 account_address = data.get("accountAddress")
-                print(f"Got account address for NFT mint: {account_address}")
+                log.debug(f"Got account address for NFT mint: {account_address}")
                 
                 # Ensure we have an account address
                 if not account_address:
-                    print("No account address provided for NFT mint")
+                    log.debug("No account address provided for NFT mint")
                     cur.close()
                     conn.close()
                     return jsonify({"error": "No wallet address provided"}), 400
                     
                 # Create the mint manifest
                 mint_manifest = create_nft_mint_manifest(account_address)
-                print(f"Created mint manifest")
+                log.debug(f"Created mint manifest")
                 
                 # Set provisional mint status if the column exists
-                if has_provisional_mint:
-                    try:
-                        cur.execute("""
-                            UPDATE user_machines
-                            SET provisional_mint=1
-                            WHERE user_id=? AND id=?
-                        """, (user_id, machine_id))
-                    except sqlite3.OperationalError:
-                        print("Could not update provisional_mint (column missing)")
+                machines.set_provisional_mint(user_id, machine_id, True)
                 
                 # Store current time as activation time
-                cur.execute("""
-                    UPDATE user_machines
-                    SET last_activated=?
-                    WHERE user_id=? AND id=?
-                """, (now_ms, user_id, machine_id))
+                machines.activate(user_id, machine_id, now_ms)
                 
                 conn.commit()
+                publish_activation(cur, user_id, machine_id, machine_type, now_ms)
                 
                 # Return the mint manifest for the frontend to process
                 cur.close()
@@ -2003,24 +1788,17 @@ def activate_machine():
                 })
             else:
                 # Subsequent activations - produce TCorvax
-                reward = 5  # Produces 5 TCorvax on subsequent activations
+                reward = MACHINE_PRODUCTION["fomoHit"]["tcorvax"]
                 tcorvax_val += reward
                 
                 # Update resources
-                cur.execute("""
-                    UPDATE users
-                    SET corvax_count=?
-                    WHERE user_id=?
-                """, (tcorvax_val, user_id))
+                users.set_corvax(user_id, tcorvax_val)
                 
                 # Update activation time
-                cur.execute("""
-                    UPDATE user_machines
-                    SET last_activated=?
-                    WHERE user_id=? AND id=?
-                """, (now_ms, user_id, machine_id))
+                machines.activate(user_id, machine_id, now_ms)
                 
                 conn.commit()
+                publish_activation(cur, user_id, machine_id, machine_type, now_ms, {"tcorvax": tcorvax_val})
                 cur.close()
                 conn.close()
                 
@@ -2039,52 +1817,25 @@ def activate_machine():
                 })
 
         if machine_type == "catLair":
-            gained = 5 + (machine_level - 1)
-            catNips_val += gained
+            catNips_val += cat_lair_output(machine_level)
         elif machine_type == "reactor":
-            if catNips_val < 3:
+            catnip_cost, base_t, base_e = reactor_output(machine_level, load_machine_summary(cur, user_id))
+            if catNips_val < catnip_cost:
                 cur.close()
                 conn.close()
                 return jsonify({"error":"Not enough Cat Nips to run the Reactor!"}), 400
-            catNips_val -= 3
-            if machine_level == 1:
-                base_t = 1.0
-            elif machine_level == 2:
-                base_t = 1.5
-            elif machine_level == 3:
-                base_t = 2.0
-            else:
-                base_t = 1.0
-
-            cur.execute("""
-                SELECT level, is_offline
-                FROM user_machines
-                WHERE user_id=? AND machine_type='amplifier'
-            """,(user_id,))
-            amp = cur.fetchone()
-            if amp and amp["is_offline"] == 0:
-                amp_level = amp["level"]
-                base_t += 0.5 * amp_level
-
-            base_e = 2
+            catNips_val -= catnip_cost
             tcorvax_val += base_t
             energy_val  += base_e
 
-        cur.execute("""
-            UPDATE user_machines
-            SET last_activated=?
-            WHERE user_id=? AND id=?
-        """,(now_ms,user_id,machine_id))
-
-        cur.execute("""
-            UPDATE users
-            SET corvax_count=?
-            WHERE user_id=?
-        """,(tcorvax_val,user_id))
+        machines.activate(user_id, machine_id, now_ms)
+
+        users.set_corvax(user_id, tcorvax_val)
         set_resource_amount(cur, user_id,'catNips',catNips_val)
         set_resource_amount(cur, user_id,'energy', energy_val)
 
         conn.commit()
+        publish_activation(cur, user_id, machine_id, machine_type, now_ms, {"tcorvax": tcorvax_val, "catNips": catNips_val, "energy": energy_val})
         cur.close()
         conn.close()
 
@@ -2101,8 +1852,158 @@ def activate_machine():
             }
         })
     except Exception as e:
-        print(f"Error in activate_machine: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in activate_machine: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+# Activation order for activateAll: producers before consumers, so Cat Lair
+# catNips are available to the Reactors activated in the same batch
+ACTIVATE_ALL_ORDER = ["catLair", "reactor", "fomoHit", "incubator"]
+
+@app.route("/api/activateAll", methods=["POST"])
+@user_locked
+@transactional(prepare=warm_scvx_balance)
+def activate_all():
+    try:
+        if 'telegram_id' not in session:
+            return jsonify({"error": "Not logged in"}), 401
+
+        data = request.get_json(silent=True) or {}
+        room_filter = data.get("room")
+        id_filter = data.get("machineIds")
+        account_address = data.get("accountAddress")
+        if id_filter is not None and (
+                not isinstance(id_filter, list)
+                or any(isinstance(i, bool) or not isinstance(i, int) for i in id_filter)):
+            return jsonify({"error": "machineIds must be a list of machine ids"}), 400
+
+        user_id = session['telegram_id']
+        log.debug("Activate all request", extra={"room": room_filter, "ids": id_filter})
+
+        # The incubator reward needs the sCVX balance, fetched by
+        # warm_scvx_balance() before the transaction opened
+        staked_cvx = prepared_scvx_balance(account_address)
+        if account_address:
+            remember_account(user_id, account_address)
+
+        conn = get_db_connection(user_id)
+        cur = conn.cursor()
+
+        update_amplifiers_status(user_id, conn, cur)
+
+        machine_repo = MachineRepository(cur)
+        machines = [dict(row) for row in machine_repo.list(user_id)]
+
+        if room_filter is not None:
+            machines = [m for m in machines if m["room"] == room_filter]
+        if id_filter is not None:
+            wanted = set(id_filter)
+            machines = [m for m in machines if m["id"] in wanted]
+
+        users = UserRepository(cur)
+        tcorvax_val = users.corvax(user_id)
+        if tcorvax_val is None:
+            cur.close()
+            conn.close()
+            return jsonify({"error": "User not found"}), 404
+
+        start = {
+            "tcorvax": tcorvax_val,
+            "catNips": float(get_or_create_resource(cur, user_id, 'catNips')),
+            "energy": float(get_or_create_resource(cur, user_id, 'energy')),
+            "eggs": float(get_or_create_resource(cur, user_id, 'eggs'))
+        }
+        res = dict(start)
+
+        summary = load_machine_summary(cur, user_id)
+        now_ms = int(time.time() * 1000)
+        activated = []
+        skipped = []
+        touched = []  # (id, now_ms, is_offline) activations to store
+
+        machines.sort(key=lambda m: (ACTIVATE_ALL_ORDER.index(m["machine_type"])
+                                     if m["machine_type"] in ACTIVATE_ALL_ORDER else len(ACTIVATE_ALL_ORDER),
+                                     m["id"]))
+
+        for m in machines:
+            machine_id = m["id"]
+            machine_type = m["machine_type"]
+            level = m["level"]
+            last_activated = m["last_activated"] or 0
+
+            if machine_type not in ACTIVATE_ALL_ORDER:
+                # Amplifiers have nothing to activate
+                continue
+
+            elapsed = now_ms - last_activated
+            if elapsed < ACTIVATION_COOLDOWN_MS:
+                skipped.append({"machineId": machine_id, "machineType": machine_type,
+                                "reason": "cooldown", "remainingMs": ACTIVATION_COOLDOWN_MS - elapsed})
+                continue
+
+            gained = {}
+            is_offline = m["is_offline"]
+            if machine_type == "catLair":
+                gained["catNips"] = cat_lair_output(level)
+            elif machine_type == "reactor":
+                catnip_cost, tcorvax_gain, energy_gain = reactor_output(level, summary)
+                if res["catNips"] < catnip_cost:
+                    skipped.append({"machineId": machine_id, "machineType": machine_type,
+                                    "reason": "Not enough Cat Nips to run the Reactor!"})
+                    continue
+                gained = {"catNips": -catnip_cost, "tcorvax": tcorvax_gain, "energy": energy_gain}
+            elif machine_type == "fomoHit":
+                if last_activated == 0:
+                    # The first activation mints an NFT and needs a wallet signature
+                    skipped.append({"machineId": machine_id, "machineType": machine_type,
+                                    "reason": "requiresMint"})
+                    continue
+                gained["tcorvax"] = MACHINE_PRODUCTION["fomoHit"]["tcorvax"]
+            elif machine_type == "incubator":
+                if not account_address:
+                    skipped.append({"machineId": machine_id, "machineType": machine_type,
+                                    "reason": "No wallet address provided"})
+                    continue
+                base_reward, bonus_reward, eggs_reward = incubator_output(staked_cvx, level)
+                gained = {"tcorvax": base_reward + bonus_reward, "eggs": eggs_reward}
+                is_offline = 0
+
+            for name, amount in gained.items():
+                res[name] += amount
+            touched.append((machine_id, now_ms, is_offline))
+            activated.append({"machineId": machine_id, "machineType": machine_type, "gained": gained})
+
+        if touched:
+            machine_repo.activate_many(user_id, touched)
+            users.set_corvax(user_id, res["tcorvax"])
+            for name in ("catNips", "energy", "eggs"):
+                if res[name] != start[name]:
+                    set_resource_amount(cur, user_id, name, res[name])
+            conn.commit()
+            publish_state_change(cur, user_id, res)
+
+            def send():
+                for machine in activated:
+                    publish(user_id, "machineCooldown", {"machineId": machine["machineId"],
+                                                         "readyAt": now_ms + ACTIVATION_COOLDOWN_MS})
+                    cooldown_scheduler.machine_activated(user_id, machine["machineId"], machine["machineType"],
+                                                         now_ms)
+            after_commit(send)
+
+        cur.close()
+        conn.close()
+
+        log.debug(f"Activated {len(activated)} machines, skipped {len(skipped)}")
+
+        return jsonify({
+            "status": "ok",
+            "newLastActivated": now_ms,
+            "activated": activated,
+            "skipped": skipped,
+            "deltas": {name: res[name] - start[name] for name in res},
+            "updatedResources": res
+        })
+    except Exception as e:
+        log.exception(f"Error in activate_all: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/api/getPets", methods=["GET"])
@@ -2112,39 +2013,22 @@ def get_pets():
             return jsonify({"error": "Not logged in"}), 401
 
         user_id = session['telegram_id']
-        conn = get_db_connection()
+        conn = get_db_connection(user_id)
         cur = conn.cursor()
 
-        cur.execute("""
-            SELECT id, x, y, room, type, parent_machine
-            FROM pets
-            WHERE user_id=?
-        """, (user_id,))
-        
-        rows = cur.fetchall()
-        pets = []
-        
-        for row in rows:
-            pet = {
-                "id": row["id"],
-                "x": row["x"],
-                "y": row["y"],
-                "room": row["room"],
-                "type": row["type"],
-                "parentMachine": row["parent_machine"]
-            }
-            pets.append(pet)
+        pets = rows_to_json(PetRepository(cur).list(user_id))
 
         cur.close()
         conn.close()
 
-        return jsonify(pets)
+        return negotiate_response(pets)
     except Exception as e:
-        print(f"Error in get_pets: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in get_pets: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/api/buyPet", methods=["POST"])
+@user_locked
+@transactional
 def buy_pet():
     try:
         if 'telegram_id' not in session:
@@ -2158,43 +2042,33 @@ def buy_pet():
         parent_machine = data.get("parentMachine")
         
         user_id = session['telegram_id']
-        conn = get_db_connection()
+        conn = get_db_connection(user_id)
         cur = conn.cursor()
 
-        # Check if user already has a pet of this type
-        cur.execute("""
-            SELECT COUNT(*) FROM pets
-            WHERE user_id=? AND type=?
-        """, (user_id, pet_type))
-        
-        pet_count = cur.fetchone()[0]
-        
         # Currently only allow one pet per type
-        if pet_count > 0:
+        pets = PetRepository(cur)
+        if pets.count_of_type(user_id, pet_type) > 0:
             cur.close()
             conn.close()
             return jsonify({"error": "You already have this type of pet"}), 400
 
         # Check if user has enough catnips
+        pet_cost = PET_CATALOG.get(pet_type, PET_CATALOG["cat"])["cost"]["catNips"]
         catNips_val = float(get_or_create_resource(cur, user_id, 'catNips'))
         
-        if catNips_val < 1500:
+        if catNips_val < pet_cost:
             cur.close()
             conn.close()
-            return jsonify({"error": "Not enough Cat Nips (1500 required)"}), 400
+            return jsonify({"error": f"Not enough Cat Nips ({pet_cost} required)"}), 400
 
         # Deduct catnips
-        catNips_val -= 1500
+        catNips_val -= pet_cost
         set_resource_amount(cur, user_id, 'catNips', catNips_val)
 
         # Create the pet
-        cur.execute("""
-            INSERT INTO pets (user_id, x, y, room, type, parent_machine)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (user_id, x_coord, y_coord, room, pet_type, parent_machine))
-
-        pet_id = cur.lastrowid
+        pet_id = pets.add(user_id, pet_type, x_coord, y_coord, room, parent_machine)
         conn.commit()
+        publish_state_change(cur, user_id, {"catNips": catNips_val})
 
         cur.close()
         conn.close()
@@ -2213,11 +2087,12 @@ def buy_pet():
             }
         })
     except Exception as e:
-        print(f"Error in buy_pet: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in buy_pet: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/api/movePet", methods=["POST"])
+@user_locked
+@transactional
 def move_pet():
     try:
         if 'telegram_id' not in session:
@@ -2233,29 +2108,21 @@ def move_pet():
             return jsonify({"error": "Missing petId"}), 400
 
         user_id = session['telegram_id']
-        conn = get_db_connection()
+        conn = get_db_connection(user_id)
         cur = conn.cursor()
 
         # Verify the pet exists and belongs to the user
-        cur.execute("""
-            SELECT id FROM pets
-            WHERE user_id=? AND id=?
-        """, (user_id, pet_id))
-        
-        pet = cur.fetchone()
-        if not pet:
+        pets = PetRepository(cur)
+        if not pets.exists(user_id, pet_id):
             cur.close()
             conn.close()
             return jsonify({"error": "Pet not found"}), 404
 
         # Update pet position
-        cur.execute("""
-            UPDATE pets
-            SET x=?, y=?, room=?
-            WHERE user_id=? AND id=?
-        """, (new_x, new_y, new_room, user_id, pet_id))
+        pets.move(user_id, pet_id, new_x, new_y, new_room)
 
         conn.commit()
+        publish_state_change(cur, user_id)
         cur.close()
         conn.close()
 
@@ -2269,11 +2136,12 @@ def move_pet():
             }
         })
     except Exception as e:
-        print(f"Error in move_pet: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in move_pet: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/api/buyEnergy", methods=["POST"])
+@user_locked
+@transactional
 def buy_energy():
     try:
         if 'telegram_id' not in session:
@@ -2284,15 +2152,17 @@ def buy_energy():
         
         if not account_address:
             return jsonify({"error": "No account address provided"}), 400
+
+        remember_account(session['telegram_id'], account_address)
         
-        print(f"Generating energy purchase manifest for account: {account_address}")    
+        log.debug(f"Generating energy purchase manifest for account: {account_address}")
         # Create transaction manifest for buying energy
         manifest = create_buy_energy_manifest(account_address)
         
         if manifest is None:
             return jsonify({"error": "Failed to create transaction manifest"}), 500
         
-        print(f"Returning manifest: {manifest}")    
+        log.debug("Returning energy purchase manifest", extra={"payload": manifest})
         return jsonify({
             "status": "ok",
             "manifest": manifest,
@@ -2301,11 +2171,11 @@ def buy_energy():
             "message": "Please ensure you have at least 200.0 CVX plus transaction fees in your wallet"
         })
     except Exception as e:
-        print(f"Error in buy_energy: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in buy_energy: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/api/confirmEnergyPurchase", methods=["POST"])
+@user_locked
 def confirm_energy_purchase():
     try:
         if 'telegram_id' not in session:
@@ -2320,10 +2190,14 @@ def confirm_energy_purchase():
             
         # Get transaction status
         status_data = get_transaction_status(intent_hash)
+
+        # Push the outcome to the player's event stream once it settles
+        if status_data.get("status") == "Pending":
+            transaction_watcher.watch(session['telegram_id'], intent_hash, "energy")
         
         # If transaction is committed successfully, add energy
         if status_data.get("status") == "CommittedSuccess":
-            conn = get_db_connection()
+            conn = get_db_connection(user_id)
             cur = conn.cursor()
             
             # Get current energy
@@ -2336,6 +2210,7 @@ def confirm_energy_purchase():
             set_resource_amount(cur, user_id, 'energy', energy_val)
             
             conn.commit()
+            publish_state_change(cur, user_id, {"energy": energy_val})
             cur.close()
             conn.close()
             
@@ -2351,61 +2226,107 @@ def confirm_energy_purchase():
             "transactionStatus": status_data
         })
     except Exception as e:
-        print(f"Error in confirm_energy_purchase: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in confirm_energy_purchase: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/api/syncLayout", methods=["POST"])
+@user_locked
+@transactional
 def sync_layout():
+    """Save machine positions.
+
+    Only machines whose position or room differ from the stored layout are
+    validated and written. With "mode": "move" each of those moves costs
+    MOVE_COST_TCORVAX, deducted in the same transaction (like moveMachine,
+    but for several machines at once).
+    """
     try:
         if 'telegram_id' not in session:
             return jsonify({"error":"Not logged in"}), 401
 
         data = request.json or {}
         machine_list = data.get("machines", [])
+        mode = data.get("mode", "sync")
+        if mode not in ("sync", "move"):
+            return jsonify({"error": "Invalid mode"}), 400
+        if not isinstance(machine_list, list):
+            return jsonify({"error": "machines must be a list"}), 400
+        for m in machine_list:
+            if (not isinstance(m, dict) or "id" not in m
+                    or any(isinstance(m.get(key, 0), bool) or not isinstance(m.get(key, 0), int)
+                           for key in ("id", "x", "y", "room"))):
+                return jsonify({"error": "Invalid machine entry", "machine": m}), 400
 
         user_id = session['telegram_id']
-        conn = get_db_connection()
+        conn = get_db_connection(user_id)
         cur = conn.cursor()
 
-        # Check if room column exists
-        has_room_column = True
-        try:
-            cur.execute("PRAGMA table_info(user_machines)")
-            columns = [column[1] for column in cur.fetchall()]
-            has_room_column = 'room' in columns
-        except:
-            has_room_column = False
+        has_room_column = not NEEDS_ROOM_COLUMN
 
+        # Diff against the stored layout; unchanged machines are neither
+        # validated (an overlap already stored can't block saving) nor written
+        layout = load_layout(cur, user_id, get_state_version(cur, user_id))
+        moves = []
         for m in machine_list:
             mid = m.get("id")
-            mx = m.get("x", 0)
-            my = m.get("y", 0)
-            mroom = m.get("room", 1)  # Default to room 1
-            
-            if has_room_column:
-                cur.execute("""
-                    UPDATE user_machines
-                    SET x=?, y=?, room=?
-                    WHERE user_id=? AND id=?
-                """, (mx, my, mroom, user_id, mid))
-            else:
-                cur.execute("""
-                    UPDATE user_machines
-                    SET x=?, y=?
-                    WHERE user_id=? AND id=?
-                """, (mx, my, user_id, mid))
+            if mid not in layout.positions:
+                continue
+            target = (m.get("x", 0), m.get("y", 0), m.get("room", 1) if has_room_column else 1)
+            if layout.positions[mid] != target:
+                moves.append((mid,) + target)
+
+        if not moves:
+            cur.close()
+            conn.close()
+            return jsonify({"status": "ok", "message": "Layout unchanged", "changed": 0})
+
+        tcorvax_val = None
+        move_cost = MOVE_COST_TCORVAX * len(moves) if mode == "move" else 0
+        if move_cost:
+            tcorvax_val = UserRepository(cur).corvax(user_id)
+            if tcorvax_val is None:
+                cur.close()
+                conn.close()
+                return jsonify({"error": "User not found"}), 404
+            if tcorvax_val < move_cost:
+                cur.close()
+                conn.close()
+                return jsonify({"error": f"Not enough TCorvax ({move_cost} required)"}), 400
+
+        # The index is about to change; don't leave it cached if we fail
+        layout_cache.invalidate(str(user_id))
+        problems = layout.apply_moves(moves)
+        if problems:
+            cur.close()
+            conn.close()
+            return jsonify({"error": "Invalid layout: machines overlap or leave the map",
+                            "conflicts": problems}), 400
+
+        changed = MachineRepository(cur).move_many(user_id, moves)
+
+        if move_cost:
+            tcorvax_val -= move_cost
+            UserRepository(cur).set_corvax(user_id, tcorvax_val)
 
         conn.commit()
+        version = get_state_version(cur, user_id)
+        after_commit(lambda: store_layout(user_id, version, layout))
+        publish_state_change(cur, user_id, {"tcorvax": tcorvax_val} if move_cost else None)
         cur.close()
         conn.close()
 
-        return jsonify({"status":"ok","message":"Layout updated"})
+        result = {"status": "ok", "message": "Layout updated", "changed": changed}
+        if move_cost:
+            result["moveCost"] = move_cost
+            result["newResources"] = {"tcorvax": tcorvax_val}
+        return jsonify(result)
     except Exception as e:
-        print(f"Error in sync_layout: {e}")
-        traceback.print_exc() 
+        log.exception(f"Error in sync_layout: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+# XRD paid on-chain per egg
+EGG_MINT_XRD = 300
+
 @app.route("/api/getMintEggManifest", methods=["POST"])
 def get_mint_egg_manifest():
     try:
@@ -2416,111 +2337,72 @@ def get_mint_egg_manifest():
         data = request.json or {}
         account_address = data.get("accountAddress")
         payment_method = data.get("paymentMethod", "xrd")  # 'xrd' or 'eggs'
+        quantity = data.get("quantity", 1)
         
         if not account_address:
             return jsonify({"error": "No account address provided"}), 400
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or not 1 <= quantity <= MAX_EGGS_PER_MINT:
+            return jsonify({"error": f"quantity must be between 1 and {MAX_EGGS_PER_MINT}"}), 400
+
+        remember_account(session['telegram_id'], account_address)
         
-        print(f"=== MINT EGG REQUEST ===")
-        print(f"User ID: {user_id}")
-        print(f"Account Address: {account_address}")
-        print(f"Payment Method: {payment_method}")
-        
-        # For production, use the actual XRD resource address
-        XRD_RESOURCE = "resource_rdx1tknxxxxxxxxxradxrdxxxxxxxxx009923554798xxxxxxxxxradxrd"
-        BACKEND_BADGE = "resource_rdx1tkfpjtakrtv96e4l38djre4pxdwaa49sa7djhfwt3egqm42ztt0ddw"
-        DAPP_DEFINITION_ADDRESS = "account_rdx12yszc3rh4yq3h9syvg5uv4ennzg8ujkmtaptc4r3a9npe6wgzwn7ar"
-        COMPONENT_ADDRESS = "component_rdx1crz6pcapzglrv68tydmuq226ydtsu0x2vlx3793g4qe72450m3f86t"
+        log.debug("Mint egg request",
+                  extra={"account": account_address, "payment_method": payment_method, "quantity": quantity})
         
         # Check if using eggs payment method
         if payment_method == "eggs":
             # Check if user has enough eggs
-            conn = get_db_connection()
+            conn = get_db_connection(user_id)
             cur = conn.cursor()
             
             eggs_val = float(get_or_create_resource(cur, user_id, 'eggs'))
-            print(f"User's egg balance: {eggs_val}")
+            log.debug(f"User's egg balance: {eggs_val}")
+            cur.close()
+            conn.close()
             
-            if eggs_val < 150:
-                cur.close()
-                conn.close()
-                return jsonify({"error": "Not enough eggs. 150 eggs required."}), 400
+            eggs_cost = EGG_MINT_COST["eggs"] * quantity
+            if eggs_val < eggs_cost:
+                return jsonify({"error": f"Not enough eggs. {eggs_cost} eggs required."}), 400
+            
+            # The backend badge proof pays for the eggs; no explicit parameters
+            manifest = mint_eggs_manifest(account_address, quantity)
+            log.debug("Generated backend mint manifest")
             
             # Store user_id and payment method in session for later validation
             # Don't deduct resources yet - only after transaction succeeds
             session['pending_egg_mint'] = {
                 'user_id': user_id,
+                'account_address': account_address,
                 'payment_method': 'eggs',
-                'eggs_cost': 150,
+                'quantity': quantity,
+                'eggs_cost': eggs_cost,
                 'timestamp': int(time.time())
             }
             
-            # Create the backend mint manifest using the DApp Toolkit pattern
-            # The key change is removing the explicit parameters to backend_mint_egg
-            manifest = f"""
-CALL_METHOD
-    Address("{DAPP_DEFINITION_ADDRESS}")
-    "create_proof_of_amount"
-    Address("{BACKEND_BADGE}")
-    Decimal("1");
-CREATE_PROOF_FROM_AUTH_ZONE_OF_ALL
-    Address("{BACKEND_BADGE}")
-    Proof("backend_proof");
-CALL_METHOD
-    Address("{COMPONENT_ADDRESS}")
-    "backend_mint_egg"
-    Proof("backend_proof")
-    None;
-DROP_ALL_PROOFS;
-CALL_METHOD
-    Address("{account_address}")
-    "try_deposit_batch_or_abort"
-    Expression("ENTIRE_WORKTOP")
-    None;
-"""
-            print("Generated backend mint manifest")
-            cur.close()
-            conn.close()
-            
         else:  # XRD payment
-            # Create the mint_egg manifest for XRD payment
-            manifest = f"""
-CALL_METHOD
-    Address("{account_address}")
-    "withdraw"
-    Address("{XRD_RESOURCE}")
-    Decimal("300");
-TAKE_FROM_WORKTOP
-    Address("{XRD_RESOURCE}")
-    Decimal("300")
-    Bucket("payment");
-CALL_METHOD
-    Address("{COMPONENT_ADDRESS}")
-    "mint_egg"
-    Bucket("payment");
-CALL_METHOD
-    Address("{account_address}")
-    "try_deposit_batch_or_abort"
-    Expression("ENTIRE_WORKTOP")
-    None;
-"""
-            print("Generated XRD mint manifest")
+            manifest = mint_eggs_manifest(account_address, quantity, EGG_MINT_XRD)
+            log.debug("Generated XRD mint manifest")
             
             # Store transaction type in session
             session['pending_egg_mint'] = {
                 'user_id': user_id,
+                'account_address': account_address,
                 'payment_method': 'xrd',
+                'quantity': quantity,
                 'timestamp': int(time.time())
             }
         
         return jsonify({
             "status": "ok",
             "manifest": manifest,
-            "paymentMethod": payment_method
+            "paymentMethod": payment_method,
+            "quantity": quantity
         })
         
+    except ManifestError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"Error in get_mint_egg_manifest: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in get_mint_egg_manifest: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 # Add these functions to app.py to retrieve NFT data
@@ -2536,132 +2418,37 @@ def get_user_nfts():
         
         if not account_address:
             return jsonify({"error": "No account address provided"}), 400
+
+        remember_account(session['telegram_id'], account_address)
         
-        print(f"=== GET USER NFTS REQUEST ===")
-        print(f"Account Address: {account_address}")
-        
-        # NFT resource address for Evolving Creatures
-        CREATURE_NFT_RESOURCE = "resource_rdx1n2rt6ygucac2me5jada3mluyf5f58ezhx06k6qlvasav0q0ece5svd"
-        
-        # Call the Radix Gateway API to get NFT vaults
-        url = "https://mainnet.radixdlt.com/state/entity/page/non-fungible-vaults"
-        payload = {
-            "address": account_address,
-            "resource_address": CREATURE_NFT_RESOURCE
-        }
-        
-        headers = {
-            'Content-Type': 'application/json',
-            'User-Agent': 'CorvaxLab Game/1.0'
-        }
+        log.debug("Get user NFTs request", extra={"account": account_address})
         
-        print(f"Calling Gateway API to fetch NFT vaults")
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
-        
-        if response.status_code != 200:
-            print(f"Gateway API error: Status {response.status_code}")
-            print(f"Response: {response.text[:200]}...")
-            return jsonify({"error": f"Failed to fetch NFT vaults: HTTP {response.status_code}"}), 500
-        
-        vaults_data = response.json()
-        
-        # Extract non-fungible IDs from the vaults
-        nft_ids = []
-        for item in vaults_data.get('items', []):
-            if 'vault_address' in item:
-                # Now fetch the IDs for this vault
-                vault_url = "https://mainnet.radixdlt.com/state/entity/page/non-fungible-vault/ids"
-                vault_payload = {
-                    "address": account_address,
-                    "resource_address": CREATURE_NFT_RESOURCE,
-                    "vault_address": item.get('vault_address')
-                }
+        try:
+            nft_ids = fetch_nft_ids(account_address)
+            log.debug("Fetched NFT ids", extra={"count": len(nft_ids), "payload": nft_ids})
                 
-                vault_response = requests.post(vault_url, json=vault_payload, headers=headers, timeout=15)
+            if not nft_ids:
+                return negotiate_response({
+                    "status": "ok",
+                    "nfts": [],
+                    "total_count": 0
+                }, columnar=("nfts",))
                 
-                if vault_response.status_code == 200:
-                    ids_data = vault_response.json()
-                    nft_ids.extend(ids_data.get('items', []))
-        
-        print(f"Found {len(nft_ids)} NFT IDs")
-        
-        if not nft_ids:
-            return jsonify({
-                "status": "ok",
-                "nfts": [],
-                "total_count": 0
-            })
-        
-        # Fetch NFT data for each ID
-        url = "https://mainnet.radixdlt.com/state/non-fungible/data"
-        payload = {
-            "resource_address": CREATURE_NFT_RESOURCE,
-            "non_fungible_ids": nft_ids
-        }
-        
-        print(f"Calling Gateway API to fetch NFT data")
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
-        
-        if response.status_code != 200:
-            print(f"Gateway API error: Status {response.status_code}")
-            print(f"Response: {response.text[:200]}...")
-            return jsonify({"error": f"Failed to fetch NFT data: HTTP {response.status_code}"}), 500
-        
-        nft_data = response.json()
-        
-        # Log the full API response to see the structure
-        print("Full NFT data response structure:")
-        print(json.dumps(nft_data, indent=2)[:1000] + "...")  # Limit output size
+            nfts = fetch_nft_data(nft_ids)
+        except GatewayError as e:
+            return jsonify({"error": str(e)}), 500
         
         # Process NFT data for frontend display
-        processed_nfts = []
-        for nft in nft_data.get('non_fungible_ids', []):
-            nft_id = nft.get('non_fungible_id')
-            # The data field contains the actual NFT metadata
-            raw_data = nft.get('data', {})
-            
-            # Check if raw_data is a string (JSON) and parse it if needed
-            if isinstance(raw_data, str):
-                try:
-                    parsed_data = json.loads(raw_data)
-                    data = parsed_data
-                except:
-                    data = raw_data
-            else:
-                data = raw_data
-            
-            # Debug log the extracted data
-            print(f"NFT ID: {nft_id}")
-            print(f"Raw data type: {type(data)}")
-            print(f"Raw data: {json.dumps(data, indent=2)[:500]}...")
-            
-            # Process the data according to NFT schema
-            processed_nft = {
-                "id": nft_id,
-                "species_id": data.get('species_id'),
-                "species_name": data.get('species_name'),
-                "form": data.get('form'),
-                "image_url": data.get('image_url'),
-                "key_image_url": data.get('key_image_url'),
-                "rarity": data.get('rarity'),
-                "stats": data.get('stats', {}),
-                "evolution_progress": data.get('evolution_progress', {}),
-                "display_form": data.get('display_form', "Egg"),
-                "display_stats": data.get('display_stats', ""),
-                "combination_level": data.get('combination_level', 0)
-            }
-            
-            processed_nfts.append(processed_nft)
+        processed_nfts = [summarize_nft(nft) for nft in nfts]
         
-        return jsonify({
+        return negotiate_response({
             "status": "ok",
             "nfts": processed_nfts,
             "total_count": len(processed_nfts)
-        })
+        }, columnar=("nfts",))
         
     except Exception as e:
-        print(f"Error in get_user_nfts: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in get_user_nfts: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/api/getNFTDetails", methods=["POST"])
@@ -2677,75 +2464,18 @@ def get_nft_details():
         if not resource_address or not nft_id:
             return jsonify({"error": "Missing resourceAddress or nftId"}), 400
         
-        print(f"=== GET NFT DETAILS REQUEST ===")
-        print(f"Resource Address: {resource_address}")
-        print(f"NFT ID: {nft_id}")
-        
-        # Call the Radix Gateway API to get NFT data
-        url = "https://mainnet.radixdlt.com/state/non-fungible/data"
-        payload = {
-            "resource_address": resource_address,
-            "non_fungible_ids": [nft_id]
-        }
-        
-        headers = {
-            'Content-Type': 'application/json',
-            'User-Agent': 'CorvaxLab Game/1.0'
-        }
-        
-        print(f"Calling Gateway API to fetch NFT details")
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
-        
-        if response.status_code != 200:
-            print(f"Gateway API error: Status {response.status_code}")
-            print(f"Response: {response.text[:200]}...")
-            return jsonify({"error": f"Failed to fetch NFT details: HTTP {response.status_code}"}), 500
-        
-        nft_data = response.json()
+        log.debug("Get NFT details request", extra={"resource": resource_address, "nft_id": nft_id})
         
-        # Log the entire response for debugging
-        print("Full NFT details response:")
-        print(json.dumps(nft_data, indent=2)[:1000] + "...")
+        try:
+            nfts = fetch_nft_data([nft_id], resource_address)
+        except GatewayError as e:
+            return jsonify({"error": f"Failed to fetch NFT details: HTTP {e.status_code}"}), 500
         
-        if not nft_data.get('non_fungible_ids'):
+        if not nfts:
             return jsonify({"error": "NFT not found"}), 404
         
         # Get the first (and only) NFT from the response
-        nft = nft_data.get('non_fungible_ids', [])[0]
-        raw_data = nft.get('data', {})
-        
-        # Check if raw_data is a string (JSON) and parse it if needed
-        if isinstance(raw_data, str):
-            try:
-                parsed_data = json.loads(raw_data)
-                data = parsed_data
-            except:
-                data = raw_data
-        else:
-            data = raw_data
-            
-        print(f"Parsed NFT data type: {type(data)}")
-        print(f"Parsed NFT data: {json.dumps(data, indent=2)[:500]}...")
-        
-        # Extract all fields from the NFT data
-        nft_details = {
-            "id": nft.get('non_fungible_id'),
-            "species_id": data.get('species_id'),
-            "species_name": data.get('species_name'),
-            "form": data.get('form'),
-            "key_image_url": data.get('key_image_url'),
-            "image_url": data.get('image_url'),
-            "rarity": data.get('rarity'),
-            "stats": data.get('stats', {}),
-            "evolution_progress": data.get('evolution_progress', {}),
-            "final_form_upgrades": data.get('final_form_upgrades', 0),
-            "version": data.get('version', 1),
-            "combination_level": data.get('combination_level', 0),
-            "bonus_stats": data.get('bonus_stats', {}),
-            "display_form": data.get('display_form', "Egg"),
-            "display_stats": data.get('display_stats', ""),
-            "display_combination": data.get('display_combination', "")
-        }
+        nft_details = detail_nft(nfts[0])
         
         return jsonify({
             "status": "ok",
@@ -2753,11 +2483,11 @@ def get_nft_details():
         })
         
     except Exception as e:
-        print(f"Error in get_nft_details: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in get_nft_details: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route("/api/checkEggMintStatus", methods=["POST"])
+@user_locked
 def check_egg_mint_status():
     try:
         if 'telegram_id' not in session:
@@ -2770,39 +2500,45 @@ def check_egg_mint_status():
         if not intent_hash:
             return jsonify({"error": "Missing intentHash"}), 400
             
-        print(f"=== CHECKING EGG MINT STATUS ===")
-        print(f"Intent Hash: {intent_hash}")
+        log.debug("Checking egg mint status", extra={"intent_hash": intent_hash})
         
         # Get the transaction status
         status_data = get_transaction_status(intent_hash)
-        print(f"Transaction status: {status_data}")
+
+        account_address = session.get('pending_egg_mint', {}).get('account_address')
+
+        # Push the outcome to the player's event stream once it settles
+        if status_data.get("status") == "Pending":
+            transaction_watcher.watch(session['telegram_id'], intent_hash, "eggMint",
+                                      on_commit=lambda _: invalidate_nfts(account_address))
+        log.debug("Egg mint transaction status", extra={"payload": status_data})
         
         # Check if transaction was successful and we have pending egg mint info
         if status_data.get("status") == "CommittedSuccess" and 'pending_egg_mint' in session:
             pending_mint = session.get('pending_egg_mint', {})
             payment_method = pending_mint.get('payment_method')
+
+            # The new egg isn't in the cached id list yet
+            invalidate_nfts(account_address)
             
             # Only deduct eggs if payment method was 'eggs' and the transaction succeeded
             if payment_method == 'eggs':
                 # Validate that the user_id matches
                 if pending_mint.get('user_id') == user_id:
-                    eggs_cost = pending_mint.get('eggs_cost', 150)
+                    eggs_cost = pending_mint.get('eggs_cost', EGG_MINT_COST["eggs"])
                     
-                    # Now deduct the eggs resource
-                    conn = get_db_connection()
+                    # Now deduct the eggs for the whole batch in one statement
+                    conn = get_db_connection(user_id)
                     cur = conn.cursor()
                     
-                    eggs_val = float(get_or_create_resource(cur, user_id, 'eggs'))
-                    
-                    # Double check user still has enough eggs
-                    if eggs_val >= eggs_cost:
-                        # Deduct eggs from user's resources
-                        eggs_val -= eggs_cost
-                        set_resource_amount(cur, user_id, 'eggs', eggs_val)
+                    eggs_val = deduct_resource(cur, user_id, 'eggs', eggs_cost)
+                    if eggs_val is not None:
                         conn.commit()
-                        print(f"Deducted {eggs_cost} eggs from user {user_id}. New balance: {eggs_val}")
+                        publish_state_change(cur, user_id, {"eggs": eggs_val})
+                        log.info(f"Deducted {eggs_cost} eggs from user {user_id} for "
+                              f"{pending_mint.get('quantity', 1)} egg(s). New balance: {eggs_val}")
                     else:
-                        print(f"Warning: User doesn't have enough eggs anymore. Current: {eggs_val}, Required: {eggs_cost}")
+                        log.warning(f"Warning: User doesn't have enough eggs anymore. Required: {eggs_cost}")
                     
                     cur.close()
                     conn.close()
@@ -2815,9 +2551,427 @@ def check_egg_mint_status():
             "transactionStatus": status_data
         })
     except Exception as e:
-        print(f"Error in check_egg_mint_status: {e}")
-        traceback.print_exc()
+        log.exception(f"Error in check_egg_mint_status: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+# Creature NFT actions (upgrade stats, evolve, combine). The manifest
+# endpoints record each action in the session under an actionId; once its
+# transaction commits, checkNFTTransactionStatus deducts any eggs owed and
+# drops the cached NFT data the action changed.
+CREATURE_STATS = ("energy", "strength", "magic", "stamina", "speed")
+MAX_PENDING_NFT_ACTIONS = 10
+MAX_STATUS_BATCH = 25
+
+def load_creatures(account_address, nft_ids):
+    """{nft_id: metadata} for the ids the account owns; others are left out."""
+    owned = set(fetch_nft_ids(account_address))
+    nfts = fetch_nft_data([nft_id for nft_id in nft_ids if nft_id in owned])
+    return {nft.get('non_fungible_id'): parse_nft_data(nft) for nft in nfts}
+
+def eggs_shortfall(user_id, eggs_cost):
+    """Error response if the player can't cover eggs_cost, else None."""
+    conn = get_db_connection(user_id)
+    cur = conn.cursor()
+    eggs_val = float(get_or_create_resource(cur, user_id, 'eggs'))
+    cur.close()
+    conn.close()
+    if eggs_val < eggs_cost:
+        return jsonify({"error": f"Not enough eggs. {eggs_cost} eggs required."}), 400
+    return None
+
+def remember_nft_action(user_id, kind, account_address, nft_ids, eggs_cost=0):
+    """Keep a creature action in the session until its transaction settles."""
+    action_id = uuid.uuid4().hex[:12]
+    actions = dict(session.get('pending_nft_actions', {}))
+    actions[action_id] = {
+        'user_id': user_id,
+        'kind': kind,
+        'account_address': account_address,
+        'nft_ids': list(nft_ids),
+        'eggs_cost': eggs_cost,
+        'timestamp': int(time.time())
+    }
+    # Abandoned actions never settle; keep only the newest few
+    for old_id in sorted(actions, key=lambda k: actions[k]['timestamp'])[:-MAX_PENDING_NFT_ACTIONS]:
+        del actions[old_id]
+    session['pending_nft_actions'] = actions
+    return action_id
+
+def nft_action_response(user_id, kind, account_address, nft_ids, payment_method, cost, manifest):
+    action_id = remember_nft_action(user_id, kind, account_address, nft_ids,
+                                    cost if payment_method == "eggs" else 0)
+    result = {
+        "status": "ok",
+        "manifest": manifest,
+        "actionId": action_id
+    }
+    if payment_method:
+        result["paymentMethod"] = payment_method
+        result["cost"] = {payment_method: cost}
+    return jsonify(result)
+
+def settle_nft_action(user_id, action):
+    """Apply a committed creature action: charge its eggs and drop stale NFT caches."""
+    invalidate_nfts(action['account_address'], action['nft_ids'])
+    eggs_cost = action.get('eggs_cost', 0)
+    if not eggs_cost or action.get('user_id') != user_id:
+        return None
+
+    conn = get_db_connection(user_id)
+    cur = conn.cursor()
+    try:
+        eggs_val = deduct_resource(cur, user_id, 'eggs', eggs_cost)
+        if eggs_val is None:
+            log.warning(f"Warning: User doesn't have enough eggs anymore. Required: {eggs_cost}")
+            return None
+        conn.commit()
+        publish_state_change(cur, user_id, {"eggs": eggs_val})
+        log.info(f"Deducted {eggs_cost} eggs from user {user_id} for {action['kind']}. New balance: {eggs_val}")
+        return eggs_val
+    finally:
+        cur.close()
+        conn.close()
+
+def parse_payment_method(data):
+    payment_method = data.get("paymentMethod", "xrd")
+    return payment_method if payment_method in ("xrd", "eggs") else None
+
+@app.route("/api/getUpgradeStatsManifest", methods=["POST"])
+def get_upgrade_stats_manifest():
+    try:
+        if 'telegram_id' not in session:
+            return jsonify({"error": "Not logged in"}), 401
+
+        user_id = session['telegram_id']
+        data = request.json or {}
+        account_address = data.get("accountAddress")
+        nft_id = data.get("nftId")
+        stat_upgrades = data.get("statUpgrades") or {}
+        payment_method = parse_payment_method(data)
+
+        if not account_address or not nft_id:
+            return jsonify({"error": "Missing accountAddress or nftId"}), 400
+        if payment_method is None:
+            return jsonify({"error": "paymentMethod must be 'xrd' or 'eggs'"}), 400
+        if not isinstance(stat_upgrades, dict) or set(stat_upgrades) - set(CREATURE_STATS):
+            return jsonify({"error": f"statUpgrades keys must be among {', '.join(CREATURE_STATS)}"}), 400
+
+        points = {stat: stat_upgrades.get(stat, 0) for stat in CREATURE_STATS}
+        if any(isinstance(v, bool) or not isinstance(v, int) or v < 0 for v in points.values()):
+            return jsonify({"error": "Stat upgrades must be non-negative integers"}), 400
+        total = sum(points.values())
+        pricing = CREATURE_ACTION_COSTS["upgradeStats"]
+        if not 1 <= total <= pricing["maxPoints"]:
+            return jsonify({"error": f"Upgrade between 1 and {pricing['maxPoints']} stat points at a time"}), 400
+
+        remember_account(user_id, account_address)
+
+        try:
+            creatures = load_creatures(account_address, [nft_id])
+        except GatewayError as e:
+            return jsonify({"error": str(e)}), 500
+        if nft_id not in creatures:
+            return jsonify({"error": "Creature not found in this account"}), 404
+
+        cost = pricing[payment_method] * total
+        if payment_method == "eggs":
+            shortfall = eggs_shortfall(user_id, cost)
+            if shortfall:
+                return shortfall
+            manifest = UPGRADE_STATS_EGGS.render(account=account_address, nft_ids=[nft_id], **points)
+        else:
+            manifest = UPGRADE_STATS_XRD.render(account=account_address, nft_ids=[nft_id],
+                                                payment=cost, **points)
+
+        return nft_action_response(user_id, "upgradeStats", account_address, [nft_id],
+                                   payment_method, cost, manifest)
+
+    except ManifestError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.exception(f"Error in get_upgrade_stats_manifest: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@app.route("/api/getEvolveCreatureManifest", methods=["POST"])
+def get_evolve_creature_manifest():
+    try:
+        if 'telegram_id' not in session:
+            return jsonify({"error": "Not logged in"}), 401
+
+        user_id = session['telegram_id']
+        data = request.json or {}
+        account_address = data.get("accountAddress")
+        nft_id = data.get("nftId")
+        payment_method = parse_payment_method(data)
+
+        if not account_address or not nft_id:
+            return jsonify({"error": "Missing accountAddress or nftId"}), 400
+        if payment_method is None:
+            return jsonify({"error": "paymentMethod must be 'xrd' or 'eggs'"}), 400
+
+        remember_account(user_id, account_address)
+
+        try:
+            creatures = load_creatures(account_address, [nft_id])
+        except GatewayError as e:
+            return jsonify({"error": str(e)}), 500
+        if nft_id not in creatures:
+            return jsonify({"error": "Creature not found in this account"}), 404
+
+        pricing = CREATURE_ACTION_COSTS["evolve"]
+        if (creatures[nft_id].get("form") or 0) >= pricing["maxForm"]:
+            return jsonify({"error": "Creature is already in its final form"}), 400
+
+        cost = pricing[payment_method]
+        if payment_method == "eggs":
+            shortfall = eggs_shortfall(user_id, cost)
+            if shortfall:
+                return shortfall
+            manifest = EVOLVE_EGGS.render(account=account_address, nft_ids=[nft_id])
+        else:
+            manifest = EVOLVE_XRD.render(account=account_address, nft_ids=[nft_id], payment=cost)
+
+        return nft_action_response(user_id, "evolve", account_address, [nft_id],
+                                   payment_method, cost, manifest)
+
+    except ManifestError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.exception(f"Error in get_evolve_creature_manifest: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@app.route("/api/getCombineCreaturesManifest", methods=["POST"])
+def get_combine_creatures_manifest():
+    try:
+        if 'telegram_id' not in session:
+            return jsonify({"error": "Not logged in"}), 401
+
+        user_id = session['telegram_id']
+        data = request.json or {}
+        account_address = data.get("accountAddress")
+        primary_id = data.get("primaryNftId")
+        secondary_id = data.get("secondaryNftId")
+
+        if not account_address or not primary_id or not secondary_id:
+            return jsonify({"error": "Missing accountAddress, primaryNftId or secondaryNftId"}), 400
+        if primary_id == secondary_id:
+            return jsonify({"error": "Choose two different creatures"}), 400
+
+        remember_account(user_id, account_address)
+
+        try:
+            creatures = load_creatures(account_address, [primary_id, secondary_id])
+        except GatewayError as e:
+            return jsonify({"error": str(e)}), 500
+        if primary_id not in creatures or secondary_id not in creatures:
+            return jsonify({"error": "Creature not found in this account"}), 404
+        if creatures[primary_id].get("species_id") != creatures[secondary_id].get("species_id"):
+            return jsonify({"error": "Only creatures of the same species can be combined"}), 400
+
+        manifest = COMBINE_CREATURES.render(account=account_address, nft_ids=[primary_id, secondary_id],
+                                            primary=primary_id, secondary=secondary_id)
+
+        return nft_action_response(user_id, "combine", account_address, [primary_id, secondary_id],
+                                   None, 0, manifest)
+
+    except ManifestError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.exception(f"Error in get_combine_creatures_manifest: {e}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@app.route("/api/checkNFTTransactionStatus", methods=["POST"])
+@user_locked
+def check_nft_transaction_status():
+    """Status of one transaction ({intentHash, actionId}) or of many at once
+    ({intentHashes, actionIds: {intentHash: actionId}})."""
+    try:
+        if 'telegram_id' not in session:
+            return jsonify({"error": "Not logged in"}), 401
+
+        user_id = session['telegram_id']
+        data = request.json or {}
+        single = "intentHashes" not in data
+        if single:
+            intent_hashes = [data.get("intentHash")]
+            action_ids = {data.get("intentHash"): data.get("actionId")}
+        else:
+            intent_hashes = data.get("intentHashes")
+            action_ids = data.get("actionIds") or {}
+
+        if (not isinstance(intent_hashes, list) or not intent_hashes
+                or not all(isinstance(h, str) and h for h in intent_hashes)):
+            return jsonify({"error": "Missing intentHash"}), 400
+        if len(intent_hashes) > MAX_STATUS_BATCH:
+            return jsonify({"error": f"At most {MAX_STATUS_BATCH} intent hashes per request"}), 400
+        if not isinstance(action_ids, dict):
+            return jsonify({"error": "actionIds must map intent hashes to action ids"}), 400
+
+        statuses = get_transaction_statuses(intent_hashes)
+
+        actions = dict(session.get('pending_nft_actions', {}))
+        new_eggs = None
+        for intent_hash, status_data in statuses.items():
+            action_id = action_ids.get(intent_hash)
+            # Single checks without an actionId settle the newest pending action
+            if action_id is None and single and actions:
+                action_id = max(actions, key=lambda k: actions[k]['timestamp'])
+            action = actions.get(action_id)
+
+            status = status_data.get("status")
+            if status == "Pending":
+                if action:
+                    transaction_watcher.watch(
+                        user_id, intent_hash, "nftAction",
+                        on_commit=lambda _, a=action: invalidate_nfts(a['account_address'], a['nft_ids']))
+                else:
+                    transaction_watcher.watch(user_id, intent_hash, "nftAction")
+            elif action and status == "CommittedSuccess":
+                eggs_val = settle_nft_action(user_id, action)
+                if eggs_val is not None:
+                    new_eggs = eggs_val
+                actions.pop(action_id, None)
+            elif action and status in ("CommittedFailure", "Rejected"):
+                actions.pop(action_id, None)
+
+        session['pending_nft_actions'] = actions
+
+        if single:
+            result = {"status": "ok", "transactionStatus": statuses[intent_hashes[0]]}
+        else:
+            result = {"status": "ok", "transactions": statuses}
+        if new_eggs is not None:
+            result["newResources"] = {"eggs": new_eggs}
+        return jsonify(result)
+
+    except Exception as e:
+        log.exception(f"Error in check_nft_transaction_status: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@app.route("/api/nextEvents", methods=["GET"])
+def next_events():
+    """Upcoming machine readiness and amplifier upkeep times, soonest first."""
+    try:
+        if 'telegram_id' not in session:
+            return jsonify({"error": "Not logged in"}), 401
+
+        user_id = session['telegram_id']
+        limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+        now_ms = int(time.time() * 1000)
+
+        if SCHEDULER_ENABLED:
+            events = cooldown_scheduler.wheel.upcoming(user_id, limit)
+        else:
+            conn = get_db_connection(user_id)
+            cur = conn.cursor()
+            events = []
+            for m in MachineRepository(cur).timers(user_id):
+                ready_at = (m["last_activated"] or 0) + ACTIVATION_COOLDOWN_MS
+                if m["machine_type"] != 'amplifier' and ready_at > now_ms:
+                    events.append({"machineId": m["id"], "type": MACHINE_READY, "at": ready_at,
+                                   "data": {"machineType": m["machine_type"]}})
+                if m["machine_type"] == 'amplifier' and not m["is_offline"] and m["next_cost_time"]:
+                    events.append({"machineId": m["id"], "type": AMPLIFIER_UPKEEP, "at": m["next_cost_time"],
+                                   "data": None})
+            cur.close()
+            conn.close()
+            events.sort(key=lambda e: e["at"])
+            events = events[:limit]
+
+        return jsonify({"now": now_ms, "events": events})
+    except Exception as e:
+        log.exception(f"Error in next_events: {e}")
+        return jsonify({"error": "Server error"}), 500
+
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    """Internal counters, when enabled with METRICS_ENABLED=1."""
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Not found"}), 404
+    counters = {"userLocks": user_locks.stats(), "transactions": transaction_stats.snapshot(),
+                "events": event_stats()}
+    if group_commit.group_writer is not None:
+        counters["groupCommit"] = group_commit.group_writer.stats()
+    return jsonify(counters)
+
+def on_machine_ready(timer):
+    publish(timer["userId"], "machineReady", {"machineId": timer["machineId"], **(timer["data"] or {})})
+
+def on_amplifier_upkeep(timer):
+    # Settle upkeep now rather than on the player's next request;
+    # settle_amplifier_upkeep reschedules the next payment.
+    settle_upkeep(timer["userId"], "scheduler.amplifierUpkeep")
+
+def rebuild_scheduler():
+    try:
+        for db_path in all_paths():
+            with pinned(db_path):
+                conn = get_db_connection()
+                cooldown_scheduler.rebuild(conn)
+                conn.close()
+    except Exception as e:
+        log.exception(f"Error rebuilding scheduler: {e}")
+
+def lead_scheduler():
+    """Rebuild the timers once this process holds the scheduler lock.
+
+    With the event relay on, a timer's event reaches every worker, so the
+    timers pending in the database are loaded by one worker only. The
+    others wait on the lock and take over when that worker exits.
+    """
+    fd = os.open(os.path.join(EVENTS_RELAY_DIR, "scheduler.lock"), os.O_CREAT | os.O_RDWR, 0o600)
+    fcntl.flock(fd, fcntl.LOCK_EX)  # held until the process exits
+    log.info("Leading the scheduler")
+    rebuild_scheduler()
+
+def start_scheduler():
+    cooldown_scheduler.on(MACHINE_READY, on_machine_ready)
+    cooldown_scheduler.on(AMPLIFIER_UPKEEP, on_amplifier_upkeep)
+    if enable_relay() is not None and fcntl is not None:
+        threading.Thread(target=lead_scheduler, name="scheduler-leader", daemon=True).start()
+    else:
+        rebuild_scheduler()
+    cooldown_scheduler.start()
+
+_services_started = False
+
+def start_background_services():
+    """Threads of this process; after a fork each worker starts its own."""
+    global _services_started
+    with _init_lock:
+        if _services_started:
+            return
+        _services_started = True
+    enable_relay()
+    if SCHEDULER_ENABLED:
+        start_scheduler()
+    if GROUP_COMMIT_ENABLED:
+        group_commit.enable_group_commit()
+
+@app.before_request
+def initialize_once():
+    # Importing the module only registers routes; the first request pays
+    # for the schema checks (unless already run) and starts the threads
+    if not _services_started:
+        run_migrations()
+        start_background_services()
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Run the schema checks on every database and exit."""
+    run_migrations()
+
+def create_app(migrate=False):
+    """The app, for gunicorn ("app:create_app()") and scripts.
+
+    Routes are registered at import. With `migrate` the schema checks run
+    now, e.g. in a --preload master so forked workers find them done;
+    otherwise the first request runs them. Background threads always start
+    on the first request, in the process that serves it.
+    """
+    if migrate:
+        run_migrations()
+    return app
+
 if __name__ == "__main__":
-    app.run(host="127.0.0.1", port=5000, debug=False)
+    create_app(migrate=True).run(host="127.0.0.1", port=5000, debug=False)
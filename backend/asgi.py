@@ -0,0 +1,242 @@
+# asgi.py
+#
+# ASGI entry point for the backend:
+#
+#   cd backend && WEB_ASGI=1 gunicorn -c gunicorn.conf.py
+#   (or: uvicorn "asgi:create_application" --factory)
+#
+# Requests run on a pool of ASGI_THREADS threads as the Flask app, except
+# that for the gateway-bound routes in GATEWAY_ROUTES the gateway calls are
+# made first, here on the event loop, with httpx.AsyncClient. The view then
+# finds their results through gateway.prefetched instead of calling out, so
+# a slow gateway keeps thousands of requests waiting without holding a
+# thread for each, and the threads stay free for everything else.
+import asyncio
+import contextvars
+import json
+import logging
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import gateway
+from app import app, create_app, MAX_STATUS_BATCH
+from config import ASGI_THREADS
+
+log = logging.getLogger(__name__)
+
+_threads = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi")
+
+
+# ---------------------------------------------------------------------------
+# Gateway lookups made before each route's view
+# ---------------------------------------------------------------------------
+
+async def prefetch_scvx_balance(gw, data):
+    # activateMachine/activateAll read it in warm_scvx_balance()
+    await gw.fetch_scvx_balance(data.get("accountAddress"))
+
+async def prefetch_transaction_status(gw, data):
+    intent_hash = data.get("intentHash")
+    if isinstance(intent_hash, str) and intent_hash:
+        await gw.get_transaction_status(intent_hash)
+
+async def prefetch_transaction_statuses(gw, data):
+    intent_hashes = data.get("intentHashes", [data.get("intentHash")])
+    if (isinstance(intent_hashes, list) and len(intent_hashes) <= MAX_STATUS_BATCH
+            and all(isinstance(h, str) and h for h in intent_hashes)):
+        await gw.get_transaction_statuses(intent_hashes)
+
+async def prefetch_user_nfts(gw, data):
+    account_address = data.get("accountAddress")
+    if account_address:
+        await gw.fetch_nft_data(await gw.fetch_nft_ids(account_address))
+
+async def prefetch_nft_details(gw, data):
+    resource_address = data.get("resourceAddress")
+    nft_id = data.get("nftId")
+    if resource_address and nft_id:
+        await gw.fetch_nft_data([nft_id], resource_address)
+
+async def prefetch_creatures(gw, data):
+    # Same lookups as app.load_creatures()
+    account_address = data.get("accountAddress")
+    nft_ids = [data.get(key) for key in ("nftId", "primaryNftId", "secondaryNftId") if data.get(key)]
+    if account_address and nft_ids:
+        owned = set(await gw.fetch_nft_ids(account_address))
+        await gw.fetch_nft_data([nft_id for nft_id in nft_ids if nft_id in owned])
+
+GATEWAY_ROUTES = {
+    "/api/activateMachine": prefetch_scvx_balance,
+    "/api/activateAll": prefetch_scvx_balance,
+    "/api/checkMintStatus": prefetch_transaction_status,
+    "/api/confirmEnergyPurchase": prefetch_transaction_status,
+    "/api/checkEggMintStatus": prefetch_transaction_status,
+    "/api/checkNFTTransactionStatus": prefetch_transaction_statuses,
+    "/api/getUserNFTs": prefetch_user_nfts,
+    "/api/getNFTDetails": prefetch_nft_details,
+    "/api/getUpgradeStatsManifest": prefetch_creatures,
+    "/api/getEvolveCreatureManifest": prefetch_creatures,
+    "/api/getCombineCreaturesManifest": prefetch_creatures,
+}
+
+async def prefetch(lookups, environ, body):
+    """Run a route's gateway lookups; their results, or None to skip them."""
+    # Nothing is fetched for requests the view will refuse anyway
+    session = app.session_interface.open_session(app, app.request_class(environ))
+    if not session or 'telegram_id' not in session:
+        return None
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    gw = gateway.AsyncGateway()
+    try:
+        await lookups(gw, data)
+    except Exception as e:
+        # Recorded in gw.results; the view reports it as it would its own
+        log.debug("Gateway prefetch failed", extra={"path": environ["PATH_INFO"], "payload": e})
+    return gw.results
+
+
+# ---------------------------------------------------------------------------
+# WSGI bridge
+# ---------------------------------------------------------------------------
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI http scope and its request body."""
+    script_name = scope.get("root_path", "").encode("utf8").decode("latin1")
+    path_info = scope["path"].encode("utf8").decode("latin1")
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": script_name,
+        "PATH_INFO": path_info,
+        "QUERY_STRING": scope["query_string"].decode("ascii"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1")
+        if name == "content-length":
+            key = "CONTENT_LENGTH"
+        elif name == "content-type":
+            key = "CONTENT_TYPE"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+        value = value.decode("latin1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+async def read_body(receive):
+    """The whole request body, or None if the client went away first."""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+async def run_wsgi(environ, receive, send):
+    """Run the Flask app on a pool thread, streaming its response back.
+
+    The thread gets this task's context (gateway.prefetched). It stops
+    reading a streamed response (an event stream) once the client
+    disconnects, and always closes it so call_on_close handlers run.
+    """
+    loop = asyncio.get_running_loop()
+    disconnected = threading.Event()
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    def send_from_thread(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def call():
+        start = {}
+
+        def start_response(status, headers, exc_info=None):
+            start["message"] = {
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(name.lower().encode("latin1"), value.encode("latin1"))
+                            for name, value in headers],
+            }
+
+        result = app(environ, start_response)
+        try:
+            started = False
+            for chunk in result:
+                if disconnected.is_set():
+                    return
+                if not started:
+                    send_from_thread(start["message"])
+                    started = True
+                if chunk:
+                    send_from_thread({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not started:
+                send_from_thread(start["message"])
+            send_from_thread({"type": "http.response.body"})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    watcher = loop.create_task(watch_disconnect())
+    try:
+        await loop.run_in_executor(_threads, contextvars.copy_context().run, call)
+    finally:
+        watcher.cancel()
+
+
+# ---------------------------------------------------------------------------
+# Application
+# ---------------------------------------------------------------------------
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await gateway.close_async_client()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    body = await read_body(receive)
+    if body is None:
+        return
+    environ = build_environ(scope, body)
+
+    lookups = GATEWAY_ROUTES.get(environ["PATH_INFO"]) if scope["method"] == "POST" else None
+    if lookups is not None:
+        gateway.prefetched.set(await prefetch(lookups, environ, body))
+    await run_wsgi(environ, receive, send)
+
+def create_application(migrate=False):
+    """The ASGI app, for gunicorn ("asgi:create_application()") and uvicorn --factory."""
+    create_app(migrate=migrate)
+    return application
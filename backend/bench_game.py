@@ -0,0 +1,91 @@
+# bench_game.py
+#
+# Times game requests through the Flask test client on either storage
+# backend, to separate the cost of the game logic from database I/O:
+#
+#   python bench_game.py --backend memory --players 20 --rounds 50
+#   python bench_game.py --backend sqlite --database /tmp/bench.db
+#
+# Needs no server or network; the scheduler is turned off.
+import argparse
+import os
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark game requests per storage backend")
+    parser.add_argument("--backend", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--database", default="/tmp/bench_game.db", help="file used by --backend sqlite")
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=50)
+    return parser.parse_args()
+
+
+def seed(players):
+    """Rich players, each with one machine; returns {user_id: machine_id}."""
+    from storage import connect, database_path, UserRepository, ResourceRepository, MachineRepository
+    machines = {}
+    for user_id in players:
+        conn = connect(database_path(user_id))
+        cur = conn.cursor()
+        users = UserRepository(cur)
+        if not users.exists(user_id):
+            users.create(user_id, f"Bench {user_id}")
+        users.set_corvax(user_id, 10**9)
+        resources = ResourceRepository(cur)
+        for name in ("catNips", "energy"):
+            resources.set(user_id, name, 10**9)
+        machines[user_id] = MachineRepository(cur).add(user_id, "catLair", 0, 0)
+        conn.commit()
+        conn.close()
+    return machines
+
+
+def main():
+    args = parse_args()
+    # Settings are read when config is first imported
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ["DATABASE_PATH"] = args.database
+    os.environ["SCHEDULER_ENABLED"] = "0"
+    if args.backend == "sqlite" and os.path.exists(args.database):
+        os.remove(args.database)
+
+    if args.backend == "sqlite":
+        # The app's startup checks expect the bot's tables to exist
+        import sqlite3
+        from storage import BASE_SCHEMA
+        conn = sqlite3.connect(args.database)
+        conn.executescript(BASE_SCHEMA)
+        conn.close()
+    import app as appmod
+    appmod.create_app(migrate=True)
+
+    players = [str(1000 + i) for i in range(args.players)]
+    clients = []
+    for user_id, machine_id in seed(players).items():
+        client = appmod.app.test_client()
+        with client.session_transaction() as sess:
+            sess["telegram_id"] = user_id
+        clients.append((client, machine_id))
+
+    timings = {"moveMachine": [], "getGameState": []}
+    for round_no in range(args.rounds):
+        for client, machine_id in clients:
+            started = time.perf_counter()
+            client.post("/api/moveMachine", json={"machineId": machine_id, "x": round_no % 2, "y": 0})
+            timings["moveMachine"].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            client.get("/api/getGameState")
+            timings["getGameState"].append(time.perf_counter() - started)
+
+    print(f"backend: {args.backend}, {args.players} players x {args.rounds} rounds")
+    for name, samples in timings.items():
+        samples.sort()
+        mean = sum(samples) / len(samples)
+        p95 = samples[int(len(samples) * 0.95) - 1]
+        print(f"{name:<14} {len(samples) / sum(samples):>8.0f} req/s  mean {mean * 1e3:6.2f} ms  "
+              f"p95 {p95 * 1e3:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
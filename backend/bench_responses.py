@@ -0,0 +1,146 @@
+# bench_responses.py
+#
+# Measures what responses.py saves on the two largest payloads: a full
+# getGameState and a getUserNFTs list. Builds the payloads from an in-memory
+# database and synthetic gateway entries, so it needs no server or network.
+#
+#   python bench_responses.py [--machines 60] [--pets 20] [--nfts 50]
+import argparse
+import gzip
+import json
+import random
+import sqlite3
+import timeit
+
+from gateway import summarize_nft
+from responses import rows_to_json, to_columns, orjson, brotli, msgpack, GZIP_LEVEL, BROTLI_QUALITY
+
+MACHINE_TYPES = ["catLair", "reactor", "amplifier", "incubator", "fomoHit"]
+
+
+def make_db(machines, pets):
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+        CREATE TABLE user_machines (id INTEGER PRIMARY KEY, user_id TEXT, machine_type TEXT, x INT, y INT,
+            level INT, last_activated INT, is_offline INT, provisional_mint INT, room INT)
+    """)
+    conn.execute("""
+        CREATE TABLE pets (id INTEGER PRIMARY KEY, user_id TEXT, x INT, y INT, room INT, type TEXT,
+            parent_machine INT)
+    """)
+    rng = random.Random(1)
+    conn.executemany(
+        "INSERT INTO user_machines VALUES (NULL, '1', ?, ?, ?, ?, ?, 0, 0, ?)",
+        [(rng.choice(MACHINE_TYPES), rng.randrange(672), rng.randrange(472), rng.randint(1, 5),
+          1700000000000 + rng.randrange(10**9), rng.randrange(2)) for _ in range(machines)])
+    conn.executemany(
+        "INSERT INTO pets VALUES (NULL, '1', ?, ?, 1, 'cat', ?)",
+        [(rng.randrange(672), rng.randrange(472), rng.randrange(1, machines + 1)) for _ in range(pets)])
+    return conn
+
+
+def game_state_before(conn):
+    """The per-row path used before responses.py: Row -> dict -> camelCase dict."""
+    cur = conn.execute("SELECT id, machine_type, x, y, level, last_activated, is_offline, provisional_mint, room "
+                       "FROM user_machines WHERE user_id='1'")
+    machines = []
+    for row in cur.fetchall():
+        m = dict(row)
+        machines.append({"id": m["id"], "type": m["machine_type"], "x": m["x"], "y": m["y"],
+                         "level": m["level"], "lastActivated": m["last_activated"],
+                         "isOffline": m["is_offline"], "provisionalMint": m.get("provisional_mint", 0),
+                         "room": m.get("room", 1)})
+    cur = conn.execute("SELECT id, x, y, room, type, parent_machine FROM pets WHERE user_id='1'")
+    pets = [{"id": r["id"], "x": r["x"], "y": r["y"], "room": r["room"], "type": r["type"],
+             "parentMachine": r["parent_machine"]} for r in cur.fetchall()]
+    return {"tcorvax": 1234.5, "catNips": 99.0, "energy": 42.0, "eggs": 3.0, "machines": machines,
+            "roomsUnlocked": 2, "seenRoomUnlock": 1, "pets": pets, "version": 77}
+
+
+def game_state_after(conn):
+    cur = conn.execute("SELECT id, machine_type, x, y, level, last_activated, is_offline, provisional_mint, room "
+                       "FROM user_machines WHERE user_id='1'")
+    machines = rows_to_json(cur, {"machine_type": "type"}, {"provisionalMint": 0, "room": 1})
+    cur = conn.execute("SELECT id, x, y, room, type, parent_machine FROM pets WHERE user_id='1'")
+    pets = rows_to_json(cur)
+    return {"tcorvax": 1234.5, "catNips": 99.0, "energy": 42.0, "eggs": 3.0, "machines": machines,
+            "roomsUnlocked": 2, "seenRoomUnlock": 1, "pets": pets, "version": 77}
+
+
+def make_nfts(count):
+    rng = random.Random(2)
+    nfts = []
+    for i in range(count):
+        data = {
+            "species_id": rng.randint(1, 40), "species_name": f"Species {i % 40}", "form": rng.randint(0, 3),
+            "image_url": f"https://cvxlab.net/assets/creatures/{i % 40}_{i % 4}.png",
+            "key_image_url": f"https://cvxlab.net/assets/creatures/{i % 40}_{i % 4}.png",
+            "rarity": rng.choice(["Common", "Rare", "Epic", "Legendary"]),
+            "stats": {k: rng.randint(1, 20) for k in ("energy", "strength", "magic", "stamina", "speed")},
+            "evolution_progress": {"stat_upgrades_used": rng.randint(0, 3), "energy_upgrades": rng.randint(0, 2),
+                                   "strength_upgrades": 0, "magic_upgrades": 1, "stamina_upgrades": 0,
+                                   "speed_upgrades": 2},
+            "display_form": "Form 1", "display_stats": "Energy: 5, Strength: 7, Magic: 3, Stamina: 9, Speed: 4",
+            "combination_level": rng.randint(0, 3)
+        }
+        nfts.append({"non_fungible_id": f"#{i}#", "data": data})
+    return {"nfts": [summarize_nft(nft) for nft in nfts]}
+
+
+def packed(payload, columnar):
+    body = dict(payload)
+    for key in columnar:
+        body[key] = to_columns(body[key])
+    return msgpack.packb(body, use_bin_type=True)
+
+
+def measure(label, build, number, columnar=()):
+    stdlib = lambda: json.dumps(build(), sort_keys=True, separators=(",", ":")).encode()
+    rows = [(label, "stdlib json", stdlib)]
+    if orjson is not None:
+        rows.append((label, "orjson", lambda: orjson.dumps(build(), option=orjson.OPT_SORT_KEYS)))
+    if msgpack is not None and columnar:
+        rows.append((label, "msgpack cols", lambda: packed(build(), columnar)))
+
+    for name, encoding, fn in rows:
+        seconds = timeit.timeit(fn, number=number) / number
+        print(f"{name:<14} {encoding:<12} {len(fn()):>8} B  {seconds * 1e6:>9.1f} us")
+
+
+def measure_compression(label, body, number):
+    codecs = [("identity", lambda: body), ("gzip", lambda: gzip.compress(body, compresslevel=GZIP_LEVEL))]
+    if brotli is not None:
+        codecs.append(("br", lambda: brotli.compress(body, quality=BROTLI_QUALITY)))
+    for name, fn in codecs:
+        seconds = timeit.timeit(fn, number=number) / number
+        print(f"{label:<14} {name:<12} {len(fn()):>8} B  {seconds * 1e6:>9.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API response encoding")
+    parser.add_argument("--machines", type=int, default=60)
+    parser.add_argument("--pets", type=int, default=20)
+    parser.add_argument("--nfts", type=int, default=50)
+    parser.add_argument("--number", type=int, default=500)
+    args = parser.parse_args()
+
+    conn = make_db(args.machines, args.pets)
+    nfts = make_nfts(args.nfts)
+
+    print(f"{'payload':<14} {'path':<12} {'size':>10}  {'per call':>12}")
+    print("-- build + serialize --")
+    measure("gameState old", lambda: game_state_before(conn), args.number)
+    measure("gameState new", lambda: game_state_after(conn), args.number, ("machines", "pets"))
+    measure("userNFTs", lambda: nfts, args.number, ("nfts",))
+
+    print("-- compression of the serialized body --")
+    measure_compression("gameState", json.dumps(game_state_after(conn), separators=(",", ":")).encode(), args.number)
+    measure_compression("userNFTs", json.dumps(nfts, separators=(",", ":")).encode(), args.number)
+    if msgpack is not None:
+        measure_compression("gameState mp", packed(game_state_after(conn), ("machines", "pets")), args.number)
+        measure_compression("userNFTs mp", packed(nfts, ("nfts",)), args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,4 +13,86 @@ SECRET_KEY  = os.getenv("SECRET_KEY", "YOUR_FALLBACK_SECRET_KEY")
 GROUP_ID    = os.getenv("GROUP_ID", "YOUR_OPTIONAL_GROUP_ID")
 FLASK_ENV   = os.getenv("FLASK_ENV", "development")
 
-DATABASE_PATH = "/root/telegram_bot/bot.db"
+DATABASE_PATH = os.getenv("DATABASE_PATH", "/root/telegram_bot/bot.db")
+
+# Storage backend (storage.py): "sqlite" for DATABASE_PATH/shard files, or
+# "memory" for a throwaway in-memory database (tests, benchmarks)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+
+# Radix Gateway API base URL. Point this at gateway_stub.py for offline runs,
+# e.g. GATEWAY_URL=http://127.0.0.1:5099
+GATEWAY_URL = os.getenv("GATEWAY_URL", "https://mainnet.radixdlt.com").rstrip("/")
+
+# Gateway response caches (seconds), background prefetch pool size, and the
+# number of pooled keep-alive connections to the gateway per process
+BALANCE_CACHE_TTL = int(os.getenv("BALANCE_CACHE_TTL", "60"))
+NFT_CACHE_TTL     = int(os.getenv("NFT_CACHE_TTL", "300"))
+PREFETCH_WORKERS  = int(os.getenv("PREFETCH_WORKERS", "4"))
+GATEWAY_POOL_SIZE = int(os.getenv("GATEWAY_POOL_SIZE", "16"))
+
+# Served through asgi.py, gateway calls wait on the event loop over at most
+# GATEWAY_ASYNC_CONNECTIONS connections per process, and views run on a pool
+# of ASGI_THREADS threads (also holding the open event streams)
+GATEWAY_ASYNC_CONNECTIONS = int(os.getenv("GATEWAY_ASYNC_CONNECTIONS", "100"))
+ASGI_THREADS              = int(os.getenv("ASGI_THREADS", "16"))
+
+# In-process cooldown/upkeep scheduler (scheduler.py); set to 0 to rely on
+# the lazy per-request checks only
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+
+# API responses smaller than this (bytes) are sent uncompressed
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+
+# Per-player request locks (locks.py). USER_LOCK_DIR enables lock files so
+# one player's requests also serialize across worker processes.
+USER_LOCK_DIR     = os.getenv("USER_LOCK_DIR", "")
+USER_LOCK_STRIPES = int(os.getenv("USER_LOCK_STRIPES", "256"))
+USER_LOCK_TIMEOUT = float(os.getenv("USER_LOCK_TIMEOUT", "10"))
+
+# Live events (events.py). EVENTS_RELAY_DIR enables the socket relay that
+# delivers events across worker processes on one host. Each open stream
+# holds a server thread, so a process serves at most EVENTS_MAX_STREAMS
+# at once; further clients get a 503 and poll instead.
+EVENTS_RELAY_DIR   = os.getenv("EVENTS_RELAY_DIR", "")
+EVENTS_MAX_STREAMS = int(os.getenv("EVENTS_MAX_STREAMS", "8"))
+
+# Expose internal counters at /api/metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+
+# Mutating requests run as one BEGIN IMMEDIATE transaction (unit_of_work.py).
+# Each attempt waits DB_BUSY_TIMEOUT seconds for the write lock, then backs
+# off (DB_BUSY_BACKOFF_MS, doubling) up to DB_BUSY_RETRIES times.
+DB_BUSY_TIMEOUT    = float(os.getenv("DB_BUSY_TIMEOUT", "1.0"))
+DB_BUSY_RETRIES    = int(os.getenv("DB_BUSY_RETRIES", "5"))
+DB_BUSY_BACKOFF_MS = float(os.getenv("DB_BUSY_BACKOFF_MS", "20"))
+
+# SQLite settings for several worker processes on one file. The journal
+# mode is set once by the schema checks and persists in the file; every
+# connection waits up to DB_LOCK_TIMEOUT seconds for a lock and uses
+# DB_SYNCHRONOUS (NORMAL is safe with WAL but may lose the last commits on
+# power loss; FULL syncs every commit).
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS  = os.getenv("DB_SYNCHRONOUS", "FULL")
+DB_LOCK_TIMEOUT = float(os.getenv("DB_LOCK_TIMEOUT", "5"))
+
+# Group commit (group_commit.py): a single writer thread runs the mutating
+# requests that arrive within GROUP_COMMIT_WINDOW_MS of each other, up to
+# GROUP_COMMIT_MAX_BATCH, as one transaction.
+GROUP_COMMIT_ENABLED   = os.getenv("GROUP_COMMIT_ENABLED", "0") == "1"
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "64"))
+
+# Per-player sharding (shards.py). With SHARD_COUNT > 0 the player tables
+# live in SHARD_COUNT files under SHARD_DIR, picked by a hash of the user id.
+# Split an existing database with shard_migrate.py before turning it on.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_DIR   = os.getenv("SHARD_DIR", "/root/telegram_bot/shards")
+
+# Logging (logs.py). LOG_LEVELS overrides the level per module, e.g.
+# "gateway=DEBUG,app=WARNING". Debug records carrying a payload dump
+# (gateway responses, manifests, request bodies) are kept at the rate
+# LOG_PAYLOAD_SAMPLE. LOG_FORMAT is "json" or "text".
+LOG_LEVEL          = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS         = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT         = os.getenv("LOG_FORMAT", "json")
+LOG_PAYLOAD_SAMPLE = float(os.getenv("LOG_PAYLOAD_SAMPLE", "0.01"))
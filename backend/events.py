@@ -0,0 +1,286 @@
+# events.py
+#
+# In-process pub/sub for live game events, consumed by the /api/events
+# Server-Sent Events stream (and its long-poll fallback) in app.py.
+#
+# Mutating endpoints and background workers call publish(); each open
+# stream holds a bounded queue for its player. With EVENTS_RELAY_DIR set,
+# the worker processes of a host forward every event to each other over
+# Unix datagram sockets in that directory, so a stream sees events
+# published by any worker, not just the one serving it.
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+from config import EVENTS_RELAY_DIR
+from gateway import get_transaction_statuses
+
+log = logging.getLogger(__name__)
+
+# How many undelivered events a slow client may accumulate before we drop the oldest
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class Subscription:
+    def __init__(self, user_id):
+        self.user_id = str(user_id)
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def get(self, timeout):
+        """Next event, or None if nothing arrived within `timeout` seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+
+class EventBus:
+    def __init__(self):
+        self._subscribers = {}  # user_id -> set of Subscription
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, user_id):
+        sub = Subscription(user_id)
+        with self._lock:
+            self._subscribers.setdefault(sub.user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.user_id)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.user_id]
+
+    def has_subscribers(self, user_id):
+        return str(user_id) in self._subscribers
+
+    def publish(self, user_id, event_type, data):
+        """Deliver an event to every stream the player has open. Never blocks."""
+        with self._lock:
+            subs = list(self._subscribers.get(str(user_id), ()))
+        if not subs:
+            return
+
+        event = {"id": next(self._ids), "type": event_type, "data": data, "ts": int(time.time() * 1000)}
+        for sub in subs:
+            try:
+                sub.queue.put_nowait(event)
+            except queue.Full:
+                # Slow consumer: drop the oldest event rather than stall the publisher
+                try:
+                    sub.queue.get_nowait()
+                    sub.queue.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+
+bus = EventBus()
+
+
+class EventRelay:
+    """Forwards events between the processes that share `directory`.
+
+    Each process binds <pid>.sock there; send() writes an event to every
+    other socket without blocking, and a thread publishes what arrives on
+    this process's bus. Sockets of dead processes are removed when a send
+    to them is refused.
+    """
+
+    # Seconds between rescans of the directory for other processes
+    PEER_REFRESH = 1.0
+    MAX_DATAGRAM = 1 << 16
+
+    def __init__(self, bus, directory):
+        self.bus = bus
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}.sock")
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+        self._receiver = None
+        self._peers = []
+        self._peers_at = 0.0
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left by an earlier process with our pid
+        self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._receiver.bind(self.path)
+        atexit.register(self.close)
+        threading.Thread(target=self._run, name="event-relay", daemon=True).start()
+
+    def close(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def peers(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._peers_at > self.PEER_REFRESH:
+                try:
+                    names = os.listdir(self.directory)
+                except OSError:
+                    names = []
+                self._peers = [os.path.join(self.directory, name) for name in names
+                               if name.endswith(".sock") and os.path.join(self.directory, name) != self.path]
+                self._peers_at = now
+            return list(self._peers)
+
+    def send(self, user_id, event_type, data):
+        message = json.dumps({"u": str(user_id), "t": event_type, "d": data}).encode()
+        if len(message) > self.MAX_DATAGRAM:
+            log.warning(f"Event {event_type} too large to relay ({len(message)} bytes)")
+            return
+        for peer in self.peers():
+            try:
+                self._sender.sendto(message, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The process is gone; forget its socket
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+                with self._lock:
+                    self._peers_at = 0.0
+            except BlockingIOError:
+                # The peer isn't keeping up; drop rather than stall the publisher
+                self.dropped += 1
+            except OSError as e:
+                log.warning(f"Error relaying {event_type} event: {e}")
+
+    def _run(self):
+        while True:
+            try:
+                message = json.loads(self._receiver.recv(self.MAX_DATAGRAM))
+                self.bus.publish(message["u"], message["t"], message["d"])
+            except Exception as e:
+                log.error(f"Error receiving relayed event: {e}")
+
+
+relay = None
+
+
+def enable_relay(directory=EVENTS_RELAY_DIR):
+    """Start forwarding events to the other processes; call once per process
+    (after forking). Returns the relay, or None when no directory is set."""
+    global relay
+    if directory and relay is None:
+        relay = EventRelay(bus, directory)
+        relay.start()
+    return relay
+
+
+def publish(user_id, event_type, data):
+    bus.publish(user_id, event_type, data)
+    if relay is not None:
+        relay.send(user_id, event_type, data)
+
+
+def may_have_listeners(user_id):
+    """Whether publishing for the player could reach a stream. With the relay
+    on, their streams may be open in another process, which this one can't see."""
+    return relay is not None or bus.has_subscribers(user_id)
+
+
+def event_stats():
+    stats = {"subscribers": bus.subscriber_count()}
+    if relay is not None:
+        stats["relayPeers"] = len(relay.peers())
+        stats["relayDropped"] = relay.dropped
+    return stats
+
+
+def format_sse(event):
+    """Serialize an event in text/event-stream framing."""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+class TransactionWatcher:
+    """Polls pending transactions in the background and publishes their outcome.
+
+    Lets clients wait for a 'transaction' event instead of polling the
+    check*Status endpoints every few seconds.
+    """
+
+    def __init__(self, interval=3.0, max_age=600):
+        self.interval = interval
+        self.max_age = max_age
+        self._pending = {}  # intent_hash -> (user_id, kind, started, on_commit)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, user_id, intent_hash, kind, on_commit=None):
+        """Follow a transaction; `on_commit(status_data)` runs if it commits successfully."""
+        with self._lock:
+            if intent_hash in self._pending:
+                return
+            self._pending[intent_hash] = (str(user_id), kind, time.time(), on_commit)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="tx-watcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                pending = list(self._pending.items())
+            if not pending:
+                with self._lock:
+                    if not self._pending:
+                        self._thread = None
+                        return
+                continue
+
+            try:
+                statuses = get_transaction_statuses([intent_hash for intent_hash, _ in pending])
+            except Exception as e:
+                log.exception(f"Error watching transactions: {e}")
+                continue
+
+            for intent_hash, (user_id, kind, started, on_commit) in pending:
+                status_data = statuses.get(intent_hash, {})
+                status = status_data.get("status")
+                settled = status not in ("Pending", "Unknown", "Error", None)
+                expired = time.time() - started > self.max_age
+                if settled or expired:
+                    with self._lock:
+                        self._pending.pop(intent_hash, None)
+                    if status == "CommittedSuccess" and on_commit is not None:
+                        try:
+                            on_commit(status_data)
+                        except Exception as e:
+                            log.exception(f"Error in commit callback for {intent_hash}: {e}")
+                    publish(user_id, "transaction", {
+                        "intentHash": intent_hash,
+                        "kind": kind,
+                        "transactionStatus": status_data,
+                        "expired": expired and not settled
+                    })
+
+
+transaction_watcher = TransactionWatcher()
@@ -0,0 +1,553 @@
+# gateway.py
+#
+# Radix Gateway API access. Every blocking caller (request threads, the
+# prefetch pool, the transaction watcher) shares one requests.Session, so
+# connections to the gateway are pooled and kept alive across requests.
+# Lookups that need several calls (one per vault, one per pending
+# transaction) make them concurrently on a small shared thread pool.
+#
+# AsyncGateway makes the same lookups with httpx.AsyncClient for asgi.py,
+# which runs them on the event loop before handing the request to a thread.
+# Their outcomes reach the blocking lookups through `prefetched`, so the
+# view finds them without calling the gateway again.
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (GATEWAY_URL, BALANCE_CACHE_TTL, NFT_CACHE_TTL, GATEWAY_POOL_SIZE,
+                    GATEWAY_ASYNC_CONNECTIONS)
+
+try:
+    import httpx
+except ImportError:  # AsyncGateway then waits on the blocking client in a thread
+    httpx = None
+
+log = logging.getLogger(__name__)
+
+SCVX_RESOURCE = "resource_rdx1t5q4aa74uxcgzehk0u3hjy6kng9rqyr4uvktnud8ehdqaaez50n693"
+CREATURE_NFT_RESOURCE = "resource_rdx1n2rt6ygucac2me5jada3mluyf5f58ezhx06k6qlvasav0q0ece5svd"
+
+GATEWAY_HEADERS = {
+    'Content-Type': 'application/json',
+    'User-Agent': 'CorvaxLab Game/1.0'
+}
+GATEWAY_TIMEOUT = 15
+
+
+class TTLCache:
+    """Small thread-safe dict with per-entry expiry."""
+
+    def __init__(self, ttl_seconds, max_entries=50000):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._data) >= self.max_entries:
+                # Drop the oldest insertions; good enough for a warm cache
+                for old_key in list(self._data)[:self.max_entries // 10 or 1]:
+                    del self._data[old_key]
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+# account address -> sCVX balance
+scvx_balance_cache = TTLCache(BALANCE_CACHE_TTL)
+# (account address, resource address) -> list of owned NFT ids
+nft_ids_cache = TTLCache(NFT_CACHE_TTL)
+# (resource address, NFT id) -> raw /state/non-fungible/data entry
+nft_data_cache = TTLCache(NFT_CACHE_TTL)
+# intent hash -> status, kept only once settled since it can't change after that
+tx_status_cache = TTLCache(3600)
+
+SETTLED_STATUSES = ("CommittedSuccess", "CommittedFailure", "Rejected")
+
+
+class GatewayError(Exception):
+    """Raised when the gateway answers with a non-200 status."""
+
+    def __init__(self, what, status_code, body=""):
+        super().__init__(f"Failed to fetch {what}: HTTP {status_code}")
+        self.status_code = status_code
+        self.body = body
+
+
+# ---------------------------------------------------------------------------
+# Response parsing
+# ---------------------------------------------------------------------------
+
+def extract_scvx_amount(data):
+    """Pick the sCVX amount out of a fungibles page."""
+    items = data.get('items', [])
+    log.debug(f"Found {len(items)} resources in the account")
+
+    for item in items:
+        if item.get('resource_address', '') == SCVX_RESOURCE:
+            amount_value = float(item.get('amount', '0'))
+            log.debug(f"FOUND sCVX RESOURCE: {amount_value}")
+            return amount_value
+
+    # If we get here, we didn't find the resource - look for partial matches
+    for item in items:
+        resource_addr = item.get('resource_address', '')
+        if SCVX_RESOURCE[-8:] in resource_addr:  # Match on last few chars
+            amount = float(item.get('amount', '0'))
+            log.debug(f"Found potential sCVX match with amount: {amount}")
+            return amount
+
+    return 0
+
+
+def parse_transaction_status(data):
+    return {
+        "status": data.get("status", "Unknown"),
+        "intent_status": data.get("intent_status", "Unknown"),
+        "error_message": data.get("error_message", "")
+    }
+
+
+def parse_nft_data(nft):
+    """Return the metadata dict of one entry of /state/non-fungible/data."""
+    raw_data = nft.get('data', {})
+
+    # Check if raw_data is a string (JSON) and parse it if needed
+    if isinstance(raw_data, str):
+        try:
+            return json.loads(raw_data)
+        except ValueError:
+            return raw_data
+    return raw_data
+
+
+def summarize_nft(nft):
+    """Fields the MyCreatures list needs for one NFT."""
+    data = parse_nft_data(nft)
+    return {
+        "id": nft.get('non_fungible_id'),
+        "species_id": data.get('species_id'),
+        "species_name": data.get('species_name'),
+        "form": data.get('form'),
+        "image_url": data.get('image_url'),
+        "key_image_url": data.get('key_image_url'),
+        "rarity": data.get('rarity'),
+        "stats": data.get('stats', {}),
+        "evolution_progress": data.get('evolution_progress', {}),
+        "display_form": data.get('display_form', "Egg"),
+        "display_stats": data.get('display_stats', ""),
+        "combination_level": data.get('combination_level', 0)
+    }
+
+
+def detail_nft(nft):
+    """Every field of one NFT, for the details view."""
+    data = parse_nft_data(nft)
+    return {
+        "id": nft.get('non_fungible_id'),
+        "species_id": data.get('species_id'),
+        "species_name": data.get('species_name'),
+        "form": data.get('form'),
+        "key_image_url": data.get('key_image_url'),
+        "image_url": data.get('image_url'),
+        "rarity": data.get('rarity'),
+        "stats": data.get('stats', {}),
+        "evolution_progress": data.get('evolution_progress', {}),
+        "final_form_upgrades": data.get('final_form_upgrades', 0),
+        "version": data.get('version', 1),
+        "combination_level": data.get('combination_level', 0),
+        "bonus_stats": data.get('bonus_stats', {}),
+        "display_form": data.get('display_form', "Egg"),
+        "display_stats": data.get('display_stats', ""),
+        "display_combination": data.get('display_combination', "")
+    }
+
+
+def invalidate_nfts(account_address, nft_ids=(), resource_address=CREATURE_NFT_RESOURCE):
+    """Forget cached NFT ids and metadata a committed transaction changed."""
+    if account_address:
+        nft_ids_cache.invalidate((account_address, resource_address))
+    for nft_id in nft_ids:
+        nft_data_cache.invalidate((resource_address, nft_id))
+
+
+# ---------------------------------------------------------------------------
+# Results fetched ahead of the view
+# ---------------------------------------------------------------------------
+
+# {key: result or exception} an AsyncGateway gathered for the current
+# request; keys are ("scvx", account), ("tx", intent hash),
+# ("nft_ids", account, resource) and ("nft", resource, NFT id)
+prefetched = contextvars.ContextVar("gateway_prefetched", default=None)
+
+_NOT_FETCHED = object()
+
+
+def recall(key):
+    """What the request's AsyncGateway got for key (re-raising its error),
+    or _NOT_FETCHED."""
+    results = prefetched.get()
+    if results is None or key not in results:
+        return _NOT_FETCHED
+    outcome = results[key]
+    if isinstance(outcome, Exception):
+        raise outcome
+    return outcome
+
+
+# ---------------------------------------------------------------------------
+# Blocking client
+# ---------------------------------------------------------------------------
+
+session = requests.Session()
+session.headers.update(GATEWAY_HEADERS)
+session.mount(GATEWAY_URL, HTTPAdapter(pool_connections=1, pool_maxsize=GATEWAY_POOL_SIZE))
+
+# Concurrent calls within one lookup; they wait on the network, not the CPU
+_fanout = ThreadPoolExecutor(max_workers=GATEWAY_POOL_SIZE, thread_name_prefix="gateway")
+
+
+def gateway_post(path, payload, what="gateway data"):
+    response = session.post(f"{GATEWAY_URL}{path}", json=payload, timeout=GATEWAY_TIMEOUT)
+    if response.status_code != 200:
+        log.warning(f"Gateway API error: Status {response.status_code}")
+        log.debug("Gateway error response", extra={"payload": response.text})
+        raise GatewayError(what, response.status_code, response.text[:200])
+    return response.json()
+
+
+def fetch_scvx_balance(account_address):
+    """Fetch sCVX balance for a Radix account using the Gateway API."""
+    if not account_address:
+        log.debug("No account address provided")
+        return 0
+
+    recalled = recall(("scvx", account_address))
+    if recalled is not _NOT_FETCHED:
+        return recalled
+
+    cached = scvx_balance_cache.get(account_address)
+    if cached is not None:
+        return cached
+
+    try:
+        log.debug(f"Fetching sCVX for {account_address} using Gateway API")
+        data = gateway_post("/state/entity/page/fungibles/",
+                            {"address": account_address, "limit_per_page": 100},
+                            "fungibles")
+        amount = extract_scvx_amount(data)
+        scvx_balance_cache.set(account_address, amount)
+        return amount
+    except GatewayError:
+        return 0
+    except Exception as e:
+        log.exception(f"Error fetching sCVX with Gateway API: {e}")
+        return 0
+
+
+def get_transaction_status(intent_hash):
+    """Check the status of a transaction using the Gateway API."""
+    recalled = recall(("tx", intent_hash))
+    if recalled is not _NOT_FETCHED:
+        return recalled
+
+    try:
+        data = gateway_post("/transaction/status", {"intent_hash": intent_hash}, "transaction status")
+        return parse_transaction_status(data)
+    except GatewayError as e:
+        return {"status": "Unknown", "error": f"HTTP {e.status_code}"}
+    except Exception as e:
+        log.exception(f"Error checking transaction status: {e}")
+        return {"status": "Error", "error": str(e)}
+
+
+def get_transaction_statuses(intent_hashes):
+    """{intent hash: status} for many transactions in one call.
+
+    Settled statuses come from tx_status_cache; the rest are looked up
+    concurrently.
+    """
+    statuses = {}
+    missing = []
+    for intent_hash in dict.fromkeys(intent_hashes):
+        cached = tx_status_cache.get(intent_hash)
+        if cached is None:
+            cached = recall(("tx", intent_hash))
+        if cached is None or cached is _NOT_FETCHED:
+            missing.append(intent_hash)
+        else:
+            statuses[intent_hash] = cached
+
+    for intent_hash, status_data in zip(missing, _fanout.map(get_transaction_status, missing)):
+        if status_data.get("status") in SETTLED_STATUSES:
+            tx_status_cache.set(intent_hash, status_data)
+        statuses[intent_hash] = status_data
+    return statuses
+
+
+def fetch_nft_ids(account_address, resource_address=CREATURE_NFT_RESOURCE):
+    recalled = recall(("nft_ids", account_address, resource_address))
+    if recalled is not _NOT_FETCHED:
+        return recalled
+
+    cached = nft_ids_cache.get((account_address, resource_address))
+    if cached is not None:
+        return cached
+
+    vaults_data = gateway_post("/state/entity/page/non-fungible-vaults", {
+        "address": account_address,
+        "resource_address": resource_address
+    }, "NFT vaults")
+
+    # Fetch the ids of every vault concurrently
+    vault_requests = [
+        _fanout.submit(gateway_post, "/state/entity/page/non-fungible-vault/ids", {
+            "address": account_address,
+            "resource_address": resource_address,
+            "vault_address": item.get('vault_address')
+        }, "NFT vault ids")
+        for item in vaults_data.get('items', [])
+        if 'vault_address' in item
+    ]
+
+    nft_ids = []
+    complete = True
+    for request in vault_requests:
+        try:
+            result = request.result()
+        except Exception as e:
+            log.debug("Skipping vault", extra={"payload": e})
+            complete = False
+            continue
+        nft_ids.extend(result.get('items', []))
+
+    # A partial list is still returned, but not cached, so the next call
+    # retries the vaults that failed
+    if complete:
+        nft_ids_cache.set((account_address, resource_address), nft_ids)
+    return nft_ids
+
+
+def fetch_nft_data(nft_ids, resource_address=CREATURE_NFT_RESOURCE):
+    if not nft_ids:
+        return []
+
+    found = {}
+    missing = []
+    for nft_id in nft_ids:
+        # None: the AsyncGateway asked and the gateway doesn't know the id
+        recalled = recall(("nft", resource_address, nft_id))
+        if recalled is None:
+            continue
+        cached = nft_data_cache.get((resource_address, nft_id)) if recalled is _NOT_FETCHED else recalled
+        if cached is None:
+            missing.append(nft_id)
+        else:
+            found[nft_id] = cached
+
+    if missing:
+        nft_data = gateway_post("/state/non-fungible/data", {
+            "resource_address": resource_address,
+            "non_fungible_ids": missing
+        }, "NFT data")
+        for nft in nft_data.get('non_fungible_ids', []):
+            nft_id = nft.get('non_fungible_id')
+            nft_data_cache.set((resource_address, nft_id), nft)
+            found[nft_id] = nft
+
+    # Keep the order the caller asked for
+    return [found[nft_id] for nft_id in nft_ids if nft_id in found]
+
+
+# ---------------------------------------------------------------------------
+# Non-blocking client
+# ---------------------------------------------------------------------------
+
+# One httpx.AsyncClient per event loop (an ASGI worker runs one loop)
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(base_url=GATEWAY_URL, headers=GATEWAY_HEADERS, timeout=GATEWAY_TIMEOUT,
+                                   limits=httpx.Limits(max_connections=GATEWAY_ASYNC_CONNECTIONS))
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_client():
+    """Close the running event loop's client, e.g. at ASGI lifespan shutdown."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+class AsyncGateway:
+    """The lookups above, made without blocking, for one request.
+
+    They share the blocking client's caches and record each outcome (errors
+    included) in `results`, under the keys `prefetched` documents.
+    """
+
+    def __init__(self):
+        self.results = {}
+
+    async def post(self, path, payload, what="gateway data"):
+        if httpx is None:
+            return await asyncio.to_thread(gateway_post, path, payload, what)
+
+        response = await _async_client().post(path, json=payload)
+        if response.status_code != 200:
+            log.warning(f"Gateway API error: Status {response.status_code}")
+            log.debug("Gateway error response", extra={"payload": response.text})
+            raise GatewayError(what, response.status_code, response.text[:200])
+        return response.json()
+
+    async def fetch_scvx_balance(self, account_address):
+        if not account_address:
+            return 0
+
+        amount = scvx_balance_cache.get(account_address)
+        if amount is None:
+            try:
+                data = await self.post("/state/entity/page/fungibles/",
+                                       {"address": account_address, "limit_per_page": 100},
+                                       "fungibles")
+                amount = extract_scvx_amount(data)
+                scvx_balance_cache.set(account_address, amount)
+            except GatewayError:
+                amount = 0
+            except Exception as e:
+                log.exception(f"Error fetching sCVX with Gateway API: {e}")
+                amount = 0
+        self.results[("scvx", account_address)] = amount
+        return amount
+
+    async def get_transaction_status(self, intent_hash):
+        try:
+            data = await self.post("/transaction/status", {"intent_hash": intent_hash},
+                                   "transaction status")
+            status_data = parse_transaction_status(data)
+        except GatewayError as e:
+            status_data = {"status": "Unknown", "error": f"HTTP {e.status_code}"}
+        except Exception as e:
+            log.exception(f"Error checking transaction status: {e}")
+            status_data = {"status": "Error", "error": str(e)}
+        self.results[("tx", intent_hash)] = status_data
+        return status_data
+
+    async def get_transaction_statuses(self, intent_hashes):
+        statuses = {}
+        missing = []
+        for intent_hash in dict.fromkeys(intent_hashes):
+            cached = tx_status_cache.get(intent_hash)
+            if cached is None:
+                missing.append(intent_hash)
+            else:
+                statuses[intent_hash] = self.results[("tx", intent_hash)] = cached
+
+        results = await asyncio.gather(*(self.get_transaction_status(h) for h in missing))
+        for intent_hash, status_data in zip(missing, results):
+            if status_data.get("status") in SETTLED_STATUSES:
+                tx_status_cache.set(intent_hash, status_data)
+            statuses[intent_hash] = status_data
+        return statuses
+
+    async def fetch_nft_ids(self, account_address, resource_address=CREATURE_NFT_RESOURCE):
+        key = ("nft_ids", account_address, resource_address)
+        try:
+            nft_ids = await self._fetch_nft_ids(account_address, resource_address)
+        except Exception as e:
+            self.results[key] = e
+            raise
+        self.results[key] = nft_ids
+        return nft_ids
+
+    async def _fetch_nft_ids(self, account_address, resource_address):
+        cached = nft_ids_cache.get((account_address, resource_address))
+        if cached is not None:
+            return cached
+
+        vaults_data = await self.post("/state/entity/page/non-fungible-vaults", {
+            "address": account_address,
+            "resource_address": resource_address
+        }, "NFT vaults")
+
+        results = await asyncio.gather(*(
+            self.post("/state/entity/page/non-fungible-vault/ids", {
+                "address": account_address,
+                "resource_address": resource_address,
+                "vault_address": item.get('vault_address')
+            }, "NFT vault ids")
+            for item in vaults_data.get('items', [])
+            if 'vault_address' in item
+        ), return_exceptions=True)
+
+        nft_ids = []
+        complete = True
+        for result in results:
+            if isinstance(result, Exception):
+                log.debug("Skipping vault", extra={"payload": result})
+                complete = False
+                continue
+            nft_ids.extend(result.get('items', []))
+
+        if complete:
+            nft_ids_cache.set((account_address, resource_address), nft_ids)
+        return nft_ids
+
+    async def fetch_nft_data(self, nft_ids, resource_address=CREATURE_NFT_RESOURCE):
+        if not nft_ids:
+            return []
+
+        found = {}
+        missing = []
+        for nft_id in nft_ids:
+            cached = nft_data_cache.get((resource_address, nft_id))
+            if cached is None:
+                missing.append(nft_id)
+            else:
+                found[nft_id] = cached
+
+        if missing:
+            try:
+                nft_data = await self.post("/state/non-fungible/data", {
+                    "resource_address": resource_address,
+                    "non_fungible_ids": missing
+                }, "NFT data")
+            except Exception as e:
+                for nft_id in missing:
+                    self.results[("nft", resource_address, nft_id)] = e
+                raise
+            for nft in nft_data.get('non_fungible_ids', []):
+                nft_id = nft.get('non_fungible_id')
+                nft_data_cache.set((resource_address, nft_id), nft)
+                found[nft_id] = nft
+
+        for nft_id in nft_ids:
+            self.results[("nft", resource_address, nft_id)] = found.get(nft_id)
+        return [found[nft_id] for nft_id in nft_ids if nft_id in found]
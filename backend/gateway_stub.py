@@ -0,0 +1,248 @@
+# gateway_stub.py
+#
+# Offline stand-in for the parts of the Radix Gateway API used by app.py.
+# Serves recorded fixtures (if provided) or synthetic responses, with
+# configurable latency, error rate and transaction status progression.
+#
+# Usage:
+#   python gateway_stub.py --port 5099 --latency-ms 150 --jitter-ms 50 \
+#       --error-rate 0.01 --pending-polls 2 --fixtures fixtures/gateway.json
+#
+# Then start the game backend with GATEWAY_URL=http://127.0.0.1:5099
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+from flask import Flask, request, jsonify
+
+SCVX_RESOURCE = "resource_rdx1t5q4aa74uxcgzehk0u3hjy6kng9rqyr4uvktnud8ehdqaaez50n693"
+CREATURE_NFT_RESOURCE = "resource_rdx1n2rt6ygucac2me5jada3mluyf5f58ezhx06k6qlvasav0q0ece5svd"
+
+SPECIES = ["Bullx", "Cudoge", "Cvxling", "Hugox", "Oceanix"]
+RARITIES = ["Common", "Common", "Common", "Rare", "Epic", "Legendary"]
+
+# Runtime settings, overridable from the command line or environment
+STUB_CONFIG = {
+    "latency_ms": int(os.getenv("STUB_LATENCY_MS", "0")),
+    "jitter_ms": int(os.getenv("STUB_JITTER_MS", "0")),
+    "error_rate": float(os.getenv("STUB_ERROR_RATE", "0")),
+    "pending_polls": int(os.getenv("STUB_PENDING_POLLS", "2")),
+    "failure_rate": float(os.getenv("STUB_FAILURE_RATE", "0")),
+    "nfts_per_account": int(os.getenv("STUB_NFTS_PER_ACCOUNT", "3")),
+}
+
+# Recorded responses: {"<endpoint path>": {"<key>": response, "default": response}}
+FIXTURES = {}
+
+# intent_hash -> number of times its status has been polled
+_tx_polls = {}
+_tx_lock = threading.Lock()
+
+stub_app = Flask(__name__)
+
+
+def load_fixtures(path):
+    """Load recorded gateway responses from a JSON file."""
+    global FIXTURES
+    with open(path) as f:
+        FIXTURES = json.load(f)
+    print(f"Loaded fixtures for {len(FIXTURES)} endpoints from {path}")
+
+
+def _seed_for(value):
+    """Stable integer seed so synthetic data is the same on every run."""
+    return int(hashlib.sha256(str(value).encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _fixture(endpoint, key):
+    entries = FIXTURES.get(endpoint)
+    if not entries:
+        return None
+    return entries.get(key, entries.get("default"))
+
+
+@stub_app.before_request
+def inject_latency_and_errors():
+    delay = STUB_CONFIG["latency_ms"]
+    if STUB_CONFIG["jitter_ms"]:
+        delay += random.randint(0, STUB_CONFIG["jitter_ms"])
+    if delay > 0:
+        time.sleep(delay / 1000.0)
+
+    if STUB_CONFIG["error_rate"] and random.random() < STUB_CONFIG["error_rate"]:
+        return jsonify({"message": "Injected gateway error", "code": 503}), 503
+
+
+@stub_app.route("/state/entity/page/fungibles/", methods=["POST"])
+def fungibles():
+    data = request.json or {}
+    address = data.get("address", "")
+
+    recorded = _fixture("/state/entity/page/fungibles/", address)
+    if recorded is not None:
+        return jsonify(recorded)
+
+    rng = random.Random(_seed_for(address))
+    scvx_amount = rng.choice([0, 50, 250, 1200, 5400, 15000])
+    items = [
+        {"aggregation_level": "Global", "resource_address": SCVX_RESOURCE, "amount": str(scvx_amount)},
+        {"aggregation_level": "Global",
+         "resource_address": "resource_rdx1tknxxxxxxxxxradxrdxxxxxxxxx009923554798xxxxxxxxxradxrd",
+         "amount": str(rng.randint(10, 5000))},
+    ]
+    return jsonify({"total_count": len(items), "items": items, "address": address})
+
+
+@stub_app.route("/transaction/status", methods=["POST"])
+def transaction_status():
+    data = request.json or {}
+    intent_hash = data.get("intent_hash", "")
+
+    recorded = _fixture("/transaction/status", intent_hash)
+    if recorded is not None:
+        return jsonify(recorded)
+
+    # Each intent hash is Pending for `pending_polls` polls, then settles.
+    with _tx_lock:
+        polls = _tx_polls.get(intent_hash, 0)
+        _tx_polls[intent_hash] = polls + 1
+
+    if polls < STUB_CONFIG["pending_polls"]:
+        return jsonify({"status": "Pending", "intent_status": "Pending", "error_message": None})
+
+    rng = random.Random(_seed_for(intent_hash))
+    if rng.random() < STUB_CONFIG["failure_rate"]:
+        return jsonify({
+            "status": "CommittedFailure",
+            "intent_status": "CommittedFailure",
+            "error_message": "Injected transaction failure"
+        })
+    return jsonify({"status": "CommittedSuccess", "intent_status": "CommittedSuccess", "error_message": None})
+
+
+@stub_app.route("/state/entity/page/non-fungible-vaults", methods=["POST"])
+def non_fungible_vaults():
+    data = request.json or {}
+    address = data.get("address", "")
+
+    recorded = _fixture("/state/entity/page/non-fungible-vaults", address)
+    if recorded is not None:
+        return jsonify(recorded)
+
+    if STUB_CONFIG["nfts_per_account"] <= 0:
+        return jsonify({"total_count": 0, "items": []})
+
+    vault_address = "internal_vault_rdx1stub" + hashlib.sha256(address.encode('utf-8')).hexdigest()[:40]
+    return jsonify({
+        "total_count": 1,
+        "items": [{"vault_address": vault_address, "total_count": STUB_CONFIG["nfts_per_account"]}]
+    })
+
+
+@stub_app.route("/state/entity/page/non-fungible-vault/ids", methods=["POST"])
+def non_fungible_vault_ids():
+    data = request.json or {}
+    address = data.get("address", "")
+
+    recorded = _fixture("/state/entity/page/non-fungible-vault/ids", address)
+    if recorded is not None:
+        return jsonify(recorded)
+
+    base = _seed_for(address) % 100000
+    ids = [f"#{base + i}#" for i in range(STUB_CONFIG["nfts_per_account"])]
+    return jsonify({"total_count": len(ids), "items": ids})
+
+
+def synthetic_nft(nft_id):
+    rng = random.Random(_seed_for(nft_id))
+    species_id = rng.randint(1, len(SPECIES))
+    form = rng.randint(0, 3)
+    return {
+        "species_id": species_id,
+        "species_name": SPECIES[species_id - 1],
+        "form": form,
+        "image_url": f"https://cvxlab.net/assets/creatures/{species_id}_{form}.png",
+        "key_image_url": f"https://cvxlab.net/assets/creatures/{species_id}_{form}.png",
+        "rarity": rng.choice(RARITIES),
+        "stats": {
+            "energy": rng.randint(1, 10),
+            "strength": rng.randint(1, 10),
+            "magic": rng.randint(1, 10),
+            "stamina": rng.randint(1, 10),
+            "speed": rng.randint(1, 10),
+        },
+        "evolution_progress": {"stat_upgrades_completed": rng.randint(0, 3)},
+        "final_form_upgrades": 0,
+        "version": 1,
+        "combination_level": 0,
+        "bonus_stats": {},
+        "display_form": ["Egg", "Form 1", "Form 2", "Form 3"][form],
+        "display_stats": "",
+        "display_combination": ""
+    }
+
+
+@stub_app.route("/state/non-fungible/data", methods=["POST"])
+def non_fungible_data():
+    data = request.json or {}
+    resource_address = data.get("resource_address", CREATURE_NFT_RESOURCE)
+    nft_ids = data.get("non_fungible_ids", [])
+
+    items = []
+    for nft_id in nft_ids:
+        recorded = _fixture("/state/non-fungible/data", nft_id)
+        items.append({
+            "non_fungible_id": nft_id,
+            "is_burned": False,
+            "data": recorded if recorded is not None else synthetic_nft(nft_id)
+        })
+
+    return jsonify({"resource_address": resource_address, "non_fungible_ids": items})
+
+
+@stub_app.route("/stub/config", methods=["GET", "POST"])
+def stub_config():
+    """Inspect or change latency/error settings while a load test runs."""
+    if request.method == "POST":
+        for key, value in (request.json or {}).items():
+            if key in STUB_CONFIG:
+                STUB_CONFIG[key] = type(STUB_CONFIG[key])(value)
+        with _tx_lock:
+            _tx_polls.clear()
+    return jsonify(STUB_CONFIG)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Radix Gateway stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--fixtures", help="JSON file with recorded gateway responses")
+    parser.add_argument("--latency-ms", type=int, default=STUB_CONFIG["latency_ms"])
+    parser.add_argument("--jitter-ms", type=int, default=STUB_CONFIG["jitter_ms"])
+    parser.add_argument("--error-rate", type=float, default=STUB_CONFIG["error_rate"])
+    parser.add_argument("--failure-rate", type=float, default=STUB_CONFIG["failure_rate"])
+    parser.add_argument("--pending-polls", type=int, default=STUB_CONFIG["pending_polls"])
+    parser.add_argument("--nfts-per-account", type=int, default=STUB_CONFIG["nfts_per_account"])
+    args = parser.parse_args()
+
+    STUB_CONFIG.update({
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "error_rate": args.error_rate,
+        "failure_rate": args.failure_rate,
+        "pending_polls": args.pending_polls,
+        "nfts_per_account": args.nfts_per_account,
+    })
+    if args.fixtures:
+        load_fixtures(args.fixtures)
+
+    print(f"Gateway stub listening on http://{args.host}:{args.port} with {STUB_CONFIG}")
+    stub_app.run(host=args.host, port=args.port, threaded=True, debug=False)
+
+
+if __name__ == "__main__":
+    main()
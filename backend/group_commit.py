@@ -0,0 +1,175 @@
+# group_commit.py
+#
+# Optional group commit for @transactional requests (GROUP_COMMIT_ENABLED=1).
+# Request threads hand their handler to a single writer thread, which runs
+# whatever has queued up within a few milliseconds as one batch: one BEGIN
+# IMMEDIATE, each request inside its own savepoint, then one COMMIT for the
+# lot. Each request's future resolves only after that COMMIT, so a response
+# never reports a write that could still be lost. Under load, writes per
+# second then scale with batch size rather than with fsync latency.
+#
+# Handlers run one at a time on the writer, so they must not block on slow
+# I/O; transactional(prepare=...) exists to do such lookups beforehand. With
+# sharding on, a batch becomes one transaction per shard file it touches.
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from config import GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_BATCH
+from storage import database_path
+from unit_of_work import unit_of_work, connect, retry_busy, run_hooks, set_group_writer
+
+log = logging.getLogger(__name__)
+
+
+class _Job:
+    __slots__ = ("name", "user_id", "path", "fn", "args", "kwargs", "context", "future", "enqueued")
+
+    def __init__(self, name, user_id, fn, args, kwargs):
+        self.name = name
+        self.user_id = user_id
+        self.path = database_path(user_id)
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        # The request's context (Flask request/session, held user locks)
+        self.context = contextvars.copy_context()
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class GroupCommitWriter:
+    def __init__(self, window_ms=2.0, max_batch=64):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._conns = {}  # database path -> connection
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {"batches": 0, "jobs": 0, "maxBatch": 0, "failedBatches": 0,
+                       "queueWaitMsTotal": 0.0, "queueWaitMsMax": 0.0, "commitMsTotal": 0.0}
+        self._batch_sizes = {}  # size -> number of batches
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+            self._thread.start()
+
+    def submit(self, name, user_id, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) for the next batch; returns a Future of its result."""
+        job = _Job(name, user_id, fn, args, kwargs)
+        self._queue.put(job)
+        return job.future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.perf_counter(), 0)))
+                except queue.Empty:
+                    break
+            by_path = {}
+            for job in batch:
+                by_path.setdefault(job.path, []).append(job)
+            for path, jobs in by_path.items():
+                try:
+                    self._apply(path, jobs)
+                except Exception as e:  # never let the writer die
+                    log.error(f"Error in group commit: {e}")
+                    for job in jobs:
+                        if not job.future.done():
+                            job.future.set_exception(e)
+
+    def _apply(self, path, batch):
+        started = time.perf_counter()
+        conn = self._conns.get(path)
+        if conn is None:
+            conn = self._conns[path] = connect(path)
+
+        try:
+            retry_busy(conn, "BEGIN IMMEDIATE", "groupCommit")
+        except Exception as e:
+            self._record(batch, started, None, failed=True)
+            for job in batch:
+                job.future.set_exception(e)
+            return
+
+        outcomes = []
+        hooks = []
+        for job in batch:
+            try:
+                result, unit = job.context.run(self._run_job, job, conn)
+                outcomes.append((job, result, None))
+                if unit.checkpoints:
+                    hooks.extend(unit.hooks)
+            except BaseException as e:
+                outcomes.append((job, None, e))
+
+        commit_started = time.perf_counter()
+        try:
+            retry_busy(conn, "COMMIT", "groupCommit")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self._record(batch, started, None, failed=True)
+            for job in batch:
+                job.future.set_exception(e)
+            return
+        self._record(batch, started, time.perf_counter() - commit_started)
+
+        for job, result, error in outcomes:
+            if error is None:
+                job.future.set_result(result)
+            else:
+                job.future.set_exception(error)
+        run_hooks(hooks, "groupCommit")
+
+    @staticmethod
+    def _run_job(job, conn):
+        with unit_of_work(job.name, shared=conn, user_id=job.user_id) as unit:
+            result = job.fn(*job.args, **job.kwargs)
+        return result, unit
+
+    def _record(self, batch, started, commit_seconds, failed=False):
+        waits = [(started - job.enqueued) * 1000 for job in batch]
+        with self._stats_lock:
+            stats = self._stats
+            stats["batches"] += 1
+            stats["jobs"] += len(batch)
+            stats["maxBatch"] = max(stats["maxBatch"], len(batch))
+            stats["queueWaitMsTotal"] += sum(waits)
+            stats["queueWaitMsMax"] = max(stats["queueWaitMsMax"], max(waits))
+            if failed:
+                stats["failedBatches"] += 1
+            else:
+                stats["commitMsTotal"] += commit_seconds * 1000
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["batchSizes"] = {str(size): count for size, count in sorted(self._batch_sizes.items())}
+        batches, jobs = stats["batches"], stats["jobs"]
+        stats["avgBatch"] = jobs / batches if batches else 0.0
+        stats["queueWaitMsAvg"] = stats["queueWaitMsTotal"] / jobs if jobs else 0.0
+        stats["commitMsAvg"] = stats["commitMsTotal"] / batches if batches else 0.0
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+
+group_writer = None
+
+
+def enable_group_commit():
+    """Start the writer thread and route @transactional views through it."""
+    global group_writer
+    if group_writer is None:
+        group_writer = GroupCommitWriter(GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_BATCH)
+        group_writer.start()
+        set_group_writer(group_writer)
+    return group_writer
@@ -0,0 +1,60 @@
+# gunicorn.conf.py
+#
+# Production server for the backend, replacing app.run()'s development
+# server:
+#
+#   cd backend && gunicorn -c gunicorn.conf.py
+#
+# The master imports the app and runs the schema checks once (preload), then
+# forks WEB_WORKERS processes with WEB_THREADS threads each. Each worker
+# starts its own scheduler and writer threads on its first request.
+#
+#   kill -HUP <master>   restart workers with new settings (same code: preloaded)
+#   kill -USR2 <master>  start a new master on new code; then QUIT the old one
+#
+# Workers forward live events to each other through sockets in
+# EVENTS_RELAY_DIR, so a player's event stream sees what any worker
+# publishes, and one worker loads the scheduler's timers. Each stream holds
+# a thread, so a worker keeps at most EVENTS_MAX_STREAMS of its WEB_THREADS
+# for them; a refused client (503) polls getGameState and retries later
+# (EventService.js). Players' writes are serialized across workers with
+# lock files (USER_LOCK_DIR). All three are defaulted below.
+#
+# WEB_ASGI=1 serves asgi.py on uvicorn workers instead: gateway-bound routes
+# then wait on the gateway on each worker's event loop rather than holding
+# one of its WEB_THREADS threads for the whole round trip.
+import multiprocessing
+import os
+
+wsgi_app = "app:create_app(migrate=True)"
+bind = os.getenv("WEB_BIND", "127.0.0.1:5000")
+
+# Threads serve the long-lived /api/events streams and wait on the gateway;
+# processes spread the Python work across cores.
+worker_class = "gthread"
+workers = int(os.getenv("WEB_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.getenv("WEB_THREADS", "16"))
+preload_app = True
+
+if os.getenv("WEB_ASGI") == "1":
+    wsgi_app = "asgi:create_application(migrate=True)"
+    worker_class = "uvicorn.workers.UvicornWorker"
+    os.environ.setdefault("ASGI_THREADS", str(threads))
+
+# Event streams ping every EVENTS_HEARTBEAT_SECONDS, well inside the timeout
+timeout = int(os.getenv("WEB_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# Recycle workers now and then so slow leaks can't accumulate
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "5000"))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.getenv("WEB_ACCESS_LOG", None)
+errorlog = "-"
+
+# Workers must see each other's per-player locks and events; set before
+# the app (and config.py) is imported by the preloading master
+os.environ.setdefault("USER_LOCK_DIR", "/tmp/cvx-user-locks")
+os.environ.setdefault("EVENTS_RELAY_DIR", "/tmp/cvx-events")
+os.environ.setdefault("EVENTS_MAX_STREAMS", str(max(1, threads // 4)))
@@ -0,0 +1,129 @@
+# layout.py
+#
+# Per-room spatial grid of a player's machines, used for the bounds and
+# collision checks in buildMachine, moveMachine and syncLayout. Machines are
+# MACHINE_SIZE squares, so with cells of the same size a machine can only
+# overlap machines in its own cell or the eight around it.
+#
+# Indexes are cached per player together with the users.state_version they
+# were built at; any write from anywhere bumps the version, so a stale index
+# is simply rebuilt from one query.
+from gateway import TTLCache
+from storage import MachineRepository
+
+MAP_WIDTH = 800
+MAP_HEIGHT = 600
+MACHINE_SIZE = 128
+
+LAYOUT_CACHE_TTL = 600
+
+# user_id -> (state_version, LayoutIndex)
+layout_cache = TTLCache(LAYOUT_CACHE_TTL)
+
+
+def in_bounds(x, y):
+    return 0 <= x <= MAP_WIDTH - MACHINE_SIZE and 0 <= y <= MAP_HEIGHT - MACHINE_SIZE
+
+
+class LayoutIndex:
+    def __init__(self, cell_size=MACHINE_SIZE):
+        self.cell_size = cell_size
+        self.positions = {}  # machine id -> (x, y, room)
+        self._cells = {}  # (room, cell x, cell y) -> set of machine ids
+
+    @classmethod
+    def from_rows(cls, rows):
+        index = cls()
+        for row in rows:
+            index.add(row["id"], row["x"], row["y"], row["room"] or 1)
+        return index
+
+    def _cell(self, room, x, y):
+        return (room, int(x // self.cell_size), int(y // self.cell_size))
+
+    def add(self, machine_id, x, y, room):
+        self.positions[machine_id] = (x, y, room)
+        self._cells.setdefault(self._cell(room, x, y), set()).add(machine_id)
+
+    def remove(self, machine_id):
+        pos = self.positions.pop(machine_id, None)
+        if pos is None:
+            return None
+        x, y, room = pos
+        cell = self._cell(room, x, y)
+        ids = self._cells.get(cell)
+        if ids is not None:
+            ids.discard(machine_id)
+            if not ids:
+                del self._cells[cell]
+        return pos
+
+    def move(self, machine_id, x, y, room):
+        self.remove(machine_id)
+        self.add(machine_id, x, y, room)
+
+    def collisions(self, room, x, y, exclude=None):
+        """Ids of machines in `room` overlapping a machine placed at (x, y)."""
+        _, cx, cy = self._cell(room, x, y)
+        hits = []
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                for other_id in self._cells.get((room, gx, gy), ()):
+                    if other_id == exclude:
+                        continue
+                    ox, oy, _ = self.positions[other_id]
+                    if abs(ox - x) < MACHINE_SIZE and abs(oy - y) < MACHINE_SIZE:
+                        hits.append(other_id)
+        return hits
+
+    def apply_moves(self, moves):
+        """Place a batch of (id, x, y, room) moves, all or nothing.
+
+        Returns a list of {"machineId", "reason", ...} problems; when it is
+        non-empty the index is left exactly as it was.
+        """
+        problems = []
+        for machine_id, x, y, room in moves:
+            if not in_bounds(x, y):
+                problems.append({"machineId": machine_id, "reason": "outOfBounds"})
+        if problems:
+            return problems
+
+        # Lift every moved machine first so swaps and chains of moves work
+        original = {machine_id: self.remove(machine_id) for machine_id, _, _, _ in moves}
+        placed = []
+        for machine_id, x, y, room in moves:
+            hits = self.collisions(room, x, y, exclude=machine_id)
+            if hits:
+                problems.append({"machineId": machine_id, "reason": "collision", "with": hits})
+            self.add(machine_id, x, y, room)
+            placed.append(machine_id)
+
+        if problems:
+            for machine_id in placed:
+                self.remove(machine_id)
+            for machine_id, pos in original.items():
+                if pos is not None:
+                    self.add(machine_id, *pos)
+        return problems
+
+
+def load_layout(cur, user_id, state_version):
+    """The player's LayoutIndex, from the cache when it is still current."""
+    if state_version is not None:
+        cached = layout_cache.get(str(user_id))
+        if cached is not None and cached[0] == state_version:
+            return cached[1]
+
+    index = LayoutIndex.from_rows(MachineRepository(cur).positions(user_id))
+    if state_version is not None:
+        layout_cache.set(str(user_id), (state_version, index))
+    return index
+
+
+def store_layout(user_id, state_version, index):
+    """Re-cache an index after the caller committed the changes it reflects."""
+    if state_version is None:
+        layout_cache.invalidate(str(user_id))
+    else:
+        layout_cache.set(str(user_id), (state_version, index))
@@ -0,0 +1,164 @@
+# load_test.py
+#
+# Drives a running backend with many concurrent players. Each player
+# alternates getGameState reads with moveMachine writes; the report gives
+# throughput, latency percentiles and status codes. Run it against the
+# gunicorn setup with different WEB_WORKERS to see how it scales with cores:
+#
+#   WEB_WORKERS=1 gunicorn -c gunicorn.conf.py &
+#   python load_test.py --players 50 --concurrency 64 --duration 20
+#   (repeat with WEB_WORKERS=4)
+#
+# Real clients also hold an /api/events stream each, which ties up a server
+# thread; --streams keeps that many open during the run (spread over the
+# players) and reports how many were accepted and the events they received.
+#
+# The players (rich, one machine each) are created or topped up straight in
+# the database the server uses, so run it on the server host with the same
+# DATABASE_PATH/SHARD_* settings, after the server has started and run its
+# schema checks. SECRET_KEY must match too: session cookies are signed here.
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+
+from config import SECRET_KEY
+from storage import connect, database_path, UserRepository, ResourceRepository, MachineRepository
+
+
+def seed(players):
+    """Create (or top up) the players; returns {user_id: machine_id}."""
+    machines = {}
+    for user_id in players:
+        conn = connect(database_path(user_id))
+        cur = conn.cursor()
+        users = UserRepository(cur)
+        if not users.exists(user_id):
+            users.create(user_id, f"Load {user_id}")
+        users.set_corvax(user_id, 10**9)
+        resources = ResourceRepository(cur)
+        for name in ("catNips", "energy"):
+            resources.set(user_id, name, 10**9)
+        cur.execute("SELECT id FROM user_machines WHERE user_id=? ORDER BY id LIMIT 1", (user_id,))
+        row = cur.fetchone()
+        machines[user_id] = row[0] if row else MachineRepository(cur).add(user_id, "catLair", 0, 0)
+        conn.commit()
+        conn.close()
+    return machines
+
+
+def session_cookie(user_id):
+    """A session cookie for user_id, signed like the server's."""
+    signer = Flask("load_test")
+    signer.secret_key = SECRET_KEY
+    serializer = SecureCookieSessionInterface().get_signing_serializer(signer)
+    return serializer.dumps({"telegram_id": user_id})
+
+
+async def player(client, user_id, machine_id, deadline, write_ratio, results):
+    headers = {"Cookie": f"session={session_cookie(user_id)}"}
+    rng = random.Random(user_id)
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        if rng.random() < write_ratio:
+            name = "moveMachine"
+            request = client.post("/api/moveMachine", headers=headers,
+                                  json={"machineId": machine_id, "x": rng.randrange(2), "y": 0})
+        else:
+            name = "getGameState"
+            request = client.get("/api/getGameState", headers=headers)
+        try:
+            status = (await request).status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        results.append((name, status, time.perf_counter() - started))
+
+
+async def stream(client, user_id, deadline, streams):
+    """Hold an event stream open until the deadline; records (status, events)."""
+    headers = {"Cookie": f"session={session_cookie(user_id)}"}
+    status, events = None, 0
+    try:
+        async with client.stream("GET", "/api/events", headers=headers) as response:
+            status = response.status_code
+            if status == 200:
+                async with asyncio.timeout(max(deadline - time.perf_counter(), 0)):
+                    async for line in response.aiter_lines():
+                        if line.startswith("event:"):
+                            events += 1
+    except TimeoutError:
+        pass
+    except httpx.HTTPError as e:
+        status = status or type(e).__name__
+    streams.append((status, events))
+
+
+async def run(args, machines):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    stream_limits = httpx.Limits(max_connections=max(args.streams, 1))
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client, \
+            httpx.AsyncClient(base_url=args.url, limits=stream_limits, timeout=None) as stream_client:
+        players = list(machines.items())
+        streams = []
+        stream_deadline = time.perf_counter() + args.duration + 1
+        holders = [asyncio.create_task(stream(stream_client, players[i % len(players)][0], stream_deadline,
+                                              streams))
+                   for i in range(args.streams)]
+        # Let the streams connect before the load starts
+        await asyncio.sleep(1 if args.streams else 0)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        results = []
+        await asyncio.gather(*(
+            player(client, *players[i % len(players)], deadline, args.write_ratio, results)
+            for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        await asyncio.gather(*holders)
+    return results, streams, elapsed
+
+
+def report(results, streams, duration):
+    print(f"{len(results)} requests in {duration:.1f}s: {len(results) / duration:.0f} req/s")
+    for name in sorted({name for name, _, _ in results}):
+        latencies = sorted(seconds for n, _, seconds in results if n == name)
+        statuses = {}
+        for n, status, _ in results:
+            if n == name:
+                statuses[status] = statuses.get(status, 0) + 1
+
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1e3
+
+        print(f"  {name:<13} {len(latencies) / duration:>7.0f} req/s  p50 {pct(0.5):6.1f} ms  "
+              f"p95 {pct(0.95):6.1f} ms  p99 {pct(0.99):6.1f} ms  {statuses}")
+
+    if streams:
+        statuses = {}
+        for status, _ in streams:
+            statuses[status] = statuses.get(status, 0) + 1
+        received = sum(events for status, events in streams if status == 200)
+        print(f"  {len(streams)} event streams {statuses}, {received} events received")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test for the game backend")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--streams", type=int, default=0, help="event streams held open during the run")
+    args = parser.parse_args()
+
+    machines = seed([str(2000000 + i) for i in range(args.players)])
+
+    results, streams, elapsed = asyncio.run(run(args, machines))
+    report(results, streams, elapsed)
+
+
+if __name__ == "__main__":
+    main()
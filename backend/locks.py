@@ -0,0 +1,206 @@
+# locks.py
+#
+# Per-player locks around mutation sections. activateMachine, buildMachine
+# and friends read balances, decide in Python and write back; holding the
+# player's lock for the whole handler means two concurrent clicks apply one
+# after the other instead of both passing the same cost or cooldown check.
+# Requests for different players never wait on each other.
+#
+# Locks are in-process and fair (waiters acquire in arrival order). With
+# USER_LOCK_DIR set, an flock on a per-player lock file also serializes the
+# player across worker processes on the same host.
+import collections
+import contextvars
+import logging
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import jsonify, session
+
+from config import USER_LOCK_DIR, USER_LOCK_STRIPES, USER_LOCK_TIMEOUT
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): in-process locking only
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# Waits longer than this are logged
+SLOW_WAIT_MS = 250
+
+# Keys held by the current context. Work handed to another thread with
+# contextvars.copy_context() (the group-commit writer) runs as part of the
+# request that holds the lock, so it must not try to take it again.
+_held = contextvars.ContextVar("held_user_locks", default=frozenset())
+
+
+class LockTimeout(Exception):
+    """A player's lock could not be acquired within the timeout."""
+
+
+class FairRLock:
+    """Reentrant lock handed to waiters in FIFO order."""
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._owner = None
+        self._depth = 0
+        self._waiters = collections.deque()  # (thread ident, parked lock)
+
+    def acquire(self, timeout=None):
+        me = threading.get_ident()
+        with self._mutex:
+            if self._owner == me:
+                self._depth += 1
+                return True
+            if self._owner is None and not self._waiters:
+                self._owner, self._depth = me, 1
+                return True
+            parked = threading.Lock()
+            parked.acquire()
+            waiter = (me, parked)
+            self._waiters.append(waiter)
+
+        if parked.acquire(timeout=-1 if timeout is None else timeout):
+            return True  # release() made us the owner before waking us
+        with self._mutex:
+            if self._owner == me:  # handed over just as we timed out
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def release(self):
+        with self._mutex:
+            if self._owner != threading.get_ident():
+                raise RuntimeError("release of a lock not held by this thread")
+            self._depth -= 1
+            if self._depth:
+                return
+            if self._waiters:
+                self._owner, parked = self._waiters.popleft()
+                self._depth = 1
+                parked.release()
+            else:
+                self._owner = None
+
+    def held_by_me(self):
+        return self._owner == threading.get_ident()
+
+
+class UserLocks:
+    """Keyed FairRLocks, created on first use and dropped when unused."""
+
+    def __init__(self, lock_dir="", stripes=256, timeout=10.0):
+        self.lock_dir = lock_dir if fcntl is not None else ""
+        self.stripes = stripes
+        self.timeout = timeout
+        self._entries = {}  # key -> [FairRLock, holders + waiters]
+        self._guard = threading.Lock()
+        self._stats = {"acquired": 0, "contended": 0, "timeouts": 0,
+                       "waitMsTotal": 0.0, "waitMsMax": 0.0}
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    @contextmanager
+    def hold(self, user_id):
+        key = str(user_id)
+        if key in _held.get():
+            yield
+            return
+        with self._guard:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = [FairRLock(), 0]
+            entry[1] += 1
+        lock = entry[0]
+
+        try:
+            outermost = not lock.held_by_me()
+            started = time.perf_counter()
+            if not lock.acquire(self.timeout):
+                self._record_timeout(key)
+                raise LockTimeout(f"Timed out waiting for the lock of user {key}")
+            try:
+                fd = None
+                if outermost and self.lock_dir:
+                    fd = self._flock(key, started)
+                if outermost:
+                    self._record_wait(key, (time.perf_counter() - started) * 1000)
+                token = _held.set(_held.get() | {key})
+                try:
+                    yield
+                finally:
+                    _held.reset(token)
+                    if fd is not None:
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+                        os.close(fd)
+            finally:
+                lock.release()
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._entries[key]
+
+    def _flock(self, key, started):
+        """Take the cross-process lock; the in-process lock is already held."""
+        stripe = zlib.crc32(key.encode()) % self.stripes
+        fd = os.open(os.path.join(self.lock_dir, f"user-{stripe}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                if time.perf_counter() - started > self.timeout:
+                    os.close(fd)
+                    self._record_timeout(key)
+                    raise LockTimeout(f"Timed out waiting for the lock file of user {key}")
+                time.sleep(0.002)
+
+    def _record_wait(self, key, wait_ms):
+        with self._guard:
+            stats = self._stats
+            stats["acquired"] += 1
+            stats["waitMsTotal"] += wait_ms
+            stats["waitMsMax"] = max(stats["waitMsMax"], wait_ms)
+            if wait_ms >= 1:
+                stats["contended"] += 1
+        if wait_ms >= SLOW_WAIT_MS:
+            log.warning(f"Waited {wait_ms:.0f} ms for the lock of user {key}")
+
+    def _record_timeout(self, key):
+        with self._guard:
+            self._stats["timeouts"] += 1
+        log.warning(f"Lock timeout for user {key}")
+
+    def stats(self):
+        with self._guard:
+            stats = dict(self._stats)
+            stats["activeKeys"] = len(self._entries)
+        stats["waitMsAvg"] = stats["waitMsTotal"] / stats["acquired"] if stats["acquired"] else 0.0
+        return stats
+
+
+user_locks = UserLocks(USER_LOCK_DIR, USER_LOCK_STRIPES, USER_LOCK_TIMEOUT)
+
+
+def user_locked(view):
+    """Run a view holding the logged-in player's lock.
+
+    Requests without a session run unlocked; the view rejects them itself.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if 'telegram_id' not in session:
+            return view(*args, **kwargs)
+        try:
+            with user_locks.hold(session['telegram_id']):
+                return view(*args, **kwargs)
+        except LockTimeout:
+            return jsonify({"error": "Another action is still in progress, please retry"}), 429
+    return wrapper
@@ -0,0 +1,131 @@
+# logs.py
+#
+# Logging for the backend. Records go through a queue to a listener thread
+# that formats and writes them, so request threads never wait on stdout.
+# Each line is a JSON object (LOG_FORMAT=text for a console) carrying the
+# endpoint and player of the request that logged it, plus any `extra`
+# fields.
+#
+# LOG_LEVEL sets the default level and LOG_LEVELS overrides it per module.
+# Debug records with a `payload` extra are sampled (LOG_PAYLOAD_SAMPLE)
+# before they are queued, so full dumps can stay in the code at little cost.
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+from flask import has_request_context, request, session
+
+from config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_PAYLOAD_SAMPLE
+
+# Longest payload written, in characters
+PAYLOAD_MAX_CHARS = 4000
+
+# Attributes every LogRecord has; anything else came from `extra`
+_RECORD_FIELDS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        payload = entry.get("payload")
+        if payload is not None and not isinstance(payload, (dict, list)):
+            entry["payload"] = str(payload)[:PAYLOAD_MAX_CHARS]
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Tags records with the current request's endpoint and player."""
+
+    def filter(self, record):
+        if has_request_context():
+            record.endpoint = request.endpoint
+            user_id = session.get("telegram_id")
+            if user_id is not None:
+                record.user_id = user_id
+        return True
+
+
+class PayloadSampler(logging.Filter):
+    """Keeps only a fraction of the debug records that carry a payload."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and hasattr(record, "payload"):
+            return random.random() < self.rate
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Resolve the message and traceback in the logging thread (args may
+        # change after we return), but keep them apart for the formatter
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_handler = None
+_listener = None
+
+
+def _start_listener():
+    global _listener
+    _handler.queue = queue.SimpleQueue()
+    output = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "text":
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        output.setFormatter(JSONFormatter())
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def setup_logging():
+    """Route every logger through the queue; safe to call more than once."""
+    global _handler
+    if _handler is not None:
+        return
+    _handler = _QueueHandler(queue.SimpleQueue())
+    _handler.addFilter(PayloadSampler(LOG_PAYLOAD_SAMPLE))
+    _handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(LOG_LEVEL.upper())
+    for item in LOG_LEVELS.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    _start_listener()
+    atexit.register(_stop_listener)
+    # The listener thread doesn't survive a fork (gunicorn --preload):
+    # give each worker its own queue and thread
+    os.register_at_fork(after_in_child=_start_listener)
@@ -0,0 +1,489 @@
+# machine_catalog.py
+#
+# Single source of truth for machine economics: build costs, upgrade costs,
+# level caps, build prerequisites, upgrade gating, room unlocks, production,
+# and the other prices the game charges (pets, moves, egg mints). The same
+# data is served to the frontend by /api/catalog (see catalog_manifest).
+#
+# MACHINE_CATALOG is plain data. compile_catalog() turns it into lookup
+# tables and rule closures once at import time, and every check is then
+# evaluated against the player's MachineSummary. The summary is stored in
+# the machine_summary table and updated in the same transaction as every
+# build, upgrade and amplifier upkeep change, so reading it is one PK lookup.
+
+import hashlib
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+# Rules are tuples: (rule name, *args). See RULES below for their meaning.
+MACHINE_CATALOG = {
+    "catLair": {
+        "build": [
+            {"cost": {"tcorvax": 10}},
+            {"cost": {"tcorvax": 40}},
+        ],
+        "max_level": 3,
+        # Level N costs base * 2**(N-1); the second machine of the type pays x4
+        "upgrade": {"base": {"tcorvax": 10}, "growth": 2, "second_machine_multiplier": 4},
+    },
+    "reactor": {
+        "build": [
+            {"cost": {"tcorvax": 10, "catNips": 10}},
+            {"cost": {"tcorvax": 40, "catNips": 40}},
+            {
+                "cost": {"tcorvax": 640, "catNips": 640},
+                "requires": [("has", "incubator"), ("has", "fomoHit")],
+                "error": "You need to build both Incubator and FOMO HIT before building a third Reactor."
+            },
+        ],
+        "max_level": 3,
+        "upgrade": {"base": {"tcorvax": 10, "catNips": 10}, "growth": 2, "second_machine_multiplier": 4},
+    },
+    "amplifier": {
+        "build": [
+            {"cost": {"tcorvax": 10, "catNips": 10, "energy": 10}},
+        ],
+        "max_level": 5,
+        "upgrade": {"base": {"tcorvax": 10, "catNips": 10, "energy": 10}, "growth": 2},
+        "upgrade_requires": {
+            4: [("first_at_level", "catLair", 1, 3), ("first_at_level", "reactor", 1, 3)],
+            5: [("first_at_level", "catLair", 2, 3), ("first_at_level", "reactor", 2, 3)],
+        },
+    },
+    "incubator": {
+        "build": [
+            {
+                "cost": {"tcorvax": 320, "catNips": 320, "energy": 320},
+                "requires": [
+                    ("all_at_level", "catLair", 3),
+                    ("all_at_level", "reactor", 3),
+                    ("any_at_level", "amplifier", 5),
+                ],
+                "error": "All machines must be at max level to build Incubator."
+            },
+        ],
+        "max_level": 2,
+        # Incubator upgrades have a flat price per level
+        "upgrade": {"levels": {2: {"tcorvax": 640, "catNips": 640, "energy": 640}}},
+    },
+    "fomoHit": {
+        "build": [
+            {
+                "cost": {"tcorvax": 640, "catNips": 640, "energy": 640},
+                "requires": [
+                    ("has", "catLair"),
+                    ("has", "reactor"),
+                    ("has", "amplifier"),
+                    ("has", "incubator"),
+                ],
+            },
+        ],
+        "max_level": 1,
+    },
+}
+
+# Room N is unlocked once all of its rules hold
+ROOM_UNLOCKS = {
+    2: [("count_at_least", "catLair", 2), ("count_at_least", "reactor", 2), ("count_at_least", "amplifier", 1)],
+}
+
+
+# Activation cooldown shared by every producing machine
+ACTIVATION_COOLDOWN_MS = 3600 * 1000
+
+# What one activation produces (see the *_output helpers below)
+MACHINE_PRODUCTION = {
+    "catLair": {"catNips_base": 5, "catNips_per_level": 1},
+    "reactor": {
+        "catNips_cost": 3,
+        "tcorvax_by_level": {1: 1.0, 2: 1.5, 3: 2.0},
+        "energy": 2,
+        # Added per amplifier level while the amplifier is online
+        "amplifier_bonus_per_level": 0.5,
+    },
+    "fomoHit": {"tcorvax": 5},
+    "incubator": {
+        "scvx_per_tcorvax": 100,
+        "tcorvax_cap": 10,
+        "bonus_min_level": 2,
+        "bonus_scvx_per_tcorvax": 1000,
+        "scvx_per_egg": 500,
+    },
+}
+
+
+# Amplifiers cost energy_per_level * level energy every interval_ms to stay online
+AMPLIFIER_UPKEEP_COST = {"energy_per_level": 2, "interval_ms": 24 * 3600 * 1000}
+
+# Prices outside the machine tables
+PET_CATALOG = {"cat": {"cost": {"catNips": 1500}}}
+MOVE_COST = {"tcorvax": 50}
+EGG_MINT_COST = {"eggs": 150}
+# Creature NFT actions, paid in XRD on-chain or in eggs deducted here once the
+# transaction commits. upgradeStats is per stat point, up to maxPoints per call.
+CREATURE_ACTION_COSTS = {
+    "upgradeStats": {"xrd": 50, "eggs": 50, "maxPoints": 3},
+    "evolve": {"xrd": 150, "eggs": 150, "maxForm": 3},
+    "combine": {},
+}
+
+
+class MachineSummary:
+    """Everything the rules need to know about one player's machines."""
+
+    # How many of the oldest machines per type we keep ids/levels for
+    TRACKED_FIRST = 2
+
+    def __init__(self):
+        self.counts = {}          # type -> number built
+        self.level_counts = {}    # type -> {level: number at that level}
+        self.first_ids = {}       # type -> ids of the oldest TRACKED_FIRST machines
+        self.first_levels = {}    # type -> their levels, same order
+        self.amplifier_level = 0
+        self.amplifier_online = False
+        self.rooms = 1
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (id, machine_type, level, is_offline) rows ordered by id."""
+        summary = cls()
+        for machine_id, machine_type, level, is_offline in rows:
+            summary.add_machine(machine_id, machine_type, level, is_offline)
+        return summary
+
+    def add_machine(self, machine_id, machine_type, level=1, is_offline=0):
+        self.counts[machine_type] = self.counts.get(machine_type, 0) + 1
+        by_level = self.level_counts.setdefault(machine_type, {})
+        by_level[level] = by_level.get(level, 0) + 1
+
+        first = self.first_ids.setdefault(machine_type, [])
+        if len(first) < self.TRACKED_FIRST:
+            first.append(machine_id)
+            self.first_levels.setdefault(machine_type, []).append(level)
+
+        if machine_type == "amplifier" and level >= self.amplifier_level:
+            self.amplifier_level = level
+            self.amplifier_online = not is_offline
+
+        self.rooms = self.rooms_unlocked()
+
+    def upgrade_machine(self, machine_id, machine_type, old_level, new_level):
+        by_level = self.level_counts.setdefault(machine_type, {})
+        by_level[old_level] = by_level.get(old_level, 0) - 1
+        if by_level[old_level] <= 0:
+            del by_level[old_level]
+        by_level[new_level] = by_level.get(new_level, 0) + 1
+
+        index = self.index_of(machine_type, machine_id)
+        if index is not None:
+            self.first_levels[machine_type][index] = new_level
+
+        if machine_type == "amplifier" and new_level > self.amplifier_level:
+            self.amplifier_level = new_level
+
+    def set_amplifier_online(self, online):
+        self.amplifier_online = bool(online)
+
+    def to_json(self):
+        return json.dumps({
+            "counts": self.counts,
+            "level_counts": self.level_counts,
+            "first_ids": self.first_ids,
+            "first_levels": self.first_levels,
+            "amplifier_level": self.amplifier_level,
+            "amplifier_online": self.amplifier_online,
+            "rooms": self.rooms,
+        }, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        summary = cls()
+        summary.counts = data["counts"]
+        # JSON object keys are strings; levels are ints
+        summary.level_counts = {t: {int(lvl): n for lvl, n in by_level.items()}
+                                for t, by_level in data["level_counts"].items()}
+        summary.first_ids = data["first_ids"]
+        summary.first_levels = data["first_levels"]
+        summary.amplifier_level = data["amplifier_level"]
+        summary.amplifier_online = data["amplifier_online"]
+        summary.rooms = data["rooms"]
+        return summary
+
+    def count(self, machine_type):
+        return self.counts.get(machine_type, 0)
+
+    def count_at_least(self, machine_type, level):
+        return sum(n for lvl, n in self.level_counts.get(machine_type, {}).items() if lvl >= level)
+
+    def index_of(self, machine_type, machine_id):
+        """Position of a machine among its type by id, if among the first few."""
+        first = self.first_ids.get(machine_type, [])
+        return first.index(machine_id) if machine_id in first else None
+
+    def rooms_unlocked(self):
+        rooms = 1
+        for room, check in sorted(ROOM_CHECKS.items()):
+            if check(self):
+                rooms = room
+        return rooms
+
+
+def scan_machine_summary(cur, user_id):
+    """Rebuild a player's MachineSummary from user_machines (one query)."""
+    cur.execute("""
+        SELECT id, machine_type, level, is_offline
+        FROM user_machines
+        WHERE user_id=?
+        ORDER BY id
+    """, (user_id,))
+    return MachineSummary.from_rows(tuple(row) for row in cur.fetchall())
+
+
+def load_machine_summary(cur, user_id):
+    """Read the stored summary, backfilling it from user_machines if missing.
+
+    Callers that change machines apply the same change to the summary and
+    save_machine_summary() it in the same transaction. Triggers on
+    user_machines drop the stored row on any other change (e.g. by the bot),
+    so it is rebuilt here on the next read.
+    """
+    try:
+        cur.execute("SELECT summary FROM machine_summary WHERE user_id=?", (user_id,))
+        row = cur.fetchone()
+    except Exception as e:
+        log.exception(f"Error reading machine_summary: {e}")
+        return scan_machine_summary(cur, user_id)
+
+    if row is not None:
+        return MachineSummary.from_json(row[0])
+
+    summary = scan_machine_summary(cur, user_id)
+    # A read-only caller (outside any transaction) never commits, so keep
+    # the backfill here; otherwise it goes in with the caller's transaction
+    standalone = not cur.connection.in_transaction
+    save_machine_summary(cur, user_id, summary)
+    if standalone:
+        try:
+            cur.connection.commit()
+        except Exception as e:
+            log.warning(f"Could not store machine_summary backfill: {e}")
+    return summary
+
+
+def save_machine_summary(cur, user_id, summary):
+    try:
+        cur.execute("""
+            INSERT OR REPLACE INTO machine_summary (user_id, summary)
+            VALUES (?, ?)
+        """, (user_id, summary.to_json()))
+    except Exception as e:
+        log.exception(f"Error saving machine_summary: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Rule compilation
+# ---------------------------------------------------------------------------
+
+def _rule_has(machine_type):
+    return lambda s: s.count(machine_type) > 0
+
+
+def _rule_count_at_least(machine_type, n):
+    return lambda s: s.count(machine_type) >= n
+
+
+def _rule_all_at_level(machine_type, level):
+    return lambda s: s.count(machine_type) > 0 and s.count_at_least(machine_type, level) == s.count(machine_type)
+
+
+def _rule_any_at_level(machine_type, level):
+    return lambda s: s.count_at_least(machine_type, level) > 0
+
+
+def _rule_first_at_level(machine_type, n, level):
+    def check(s):
+        levels = s.first_levels.get(machine_type, [])[:n]
+        return len(levels) == n and all(lvl >= level for lvl in levels)
+    return check
+
+
+RULES = {
+    "has": _rule_has,                        # at least one machine of the type
+    "count_at_least": _rule_count_at_least,  # at least n machines of the type
+    "all_at_level": _rule_all_at_level,      # some built, and every one at >= level
+    "any_at_level": _rule_any_at_level,      # at least one at >= level
+    "first_at_level": _rule_first_at_level,  # the n oldest all at >= level
+}
+
+_RULE_MESSAGES = {
+    "has": "Must build {0} first.",
+}
+
+
+def compile_rules(rules, error=None):
+    """Compile rule tuples into one function returning None or an error message."""
+    compiled = []
+    for rule in rules:
+        name, args = rule[0], rule[1:]
+        if name not in RULES:
+            raise ValueError(f"Unknown machine rule: {name}")
+        message = error or _RULE_MESSAGES.get(name, "Requirements not met.").format(*args)
+        compiled.append((RULES[name](*args), message))
+
+    def check(summary):
+        for test, message in compiled:
+            if not test(summary):
+                return message
+        return None
+    return check
+
+
+def _always_ok(summary):
+    return None
+
+
+def compile_catalog(catalog):
+    """Flatten the catalog into per-(type, index) and per-(type, level) tables."""
+    build_table = {}
+    upgrade_table = {}
+    for machine_type, spec in catalog.items():
+        for index, slot in enumerate(spec.get("build", [])):
+            check = compile_rules(slot["requires"], slot.get("error")) if slot.get("requires") else _always_ok
+            build_table[(machine_type, index)] = (dict(slot["cost"]), check)
+
+        upgrade = spec.get("upgrade")
+        if not upgrade:
+            continue
+        gating = spec.get("upgrade_requires", {})
+        for next_level in range(2, spec["max_level"] + 1):
+            if "levels" in upgrade:
+                cost = dict(upgrade["levels"][next_level])
+            else:
+                mult = upgrade["growth"] ** (next_level - 1)
+                cost = {res: val * mult for res, val in upgrade["base"].items()}
+            check = compile_rules(gating[next_level]) if next_level in gating else _always_ok
+            upgrade_table[(machine_type, next_level)] = (cost, check, upgrade.get("second_machine_multiplier", 1))
+    return build_table, upgrade_table
+
+
+BUILD_TABLE, UPGRADE_TABLE = compile_catalog(MACHINE_CATALOG)
+ROOM_CHECKS = {room: (lambda check: lambda s: check(s) is None)(compile_rules(rules))
+               for room, rules in ROOM_UNLOCKS.items()}
+
+
+def build_cost(summary, machine_type):
+    """Return (cost dict, None) or (None, error message) for the next machine of a type."""
+    entry = BUILD_TABLE.get((machine_type, summary.count(machine_type)))
+    if entry is None:
+        return None, "Cannot build more of this machine type."
+    cost, check = entry
+    error = check(summary)
+    if error:
+        return None, error
+    return dict(cost), None
+
+
+def upgrade_cost(summary, machine_type, current_level, machine_id):
+    """Return the cost of upgrading a machine, or None if capped or gated."""
+    entry = UPGRADE_TABLE.get((machine_type, current_level + 1))
+    if entry is None:
+        return None
+    cost, check, second_mult = entry
+    if check(summary) is not None:
+        return None
+    if second_mult != 1 and summary.index_of(machine_type, machine_id) == 1:
+        return {res: val * second_mult for res, val in cost.items()}
+    return dict(cost)
+
+
+# ---------------------------------------------------------------------------
+# Production
+# ---------------------------------------------------------------------------
+
+def cat_lair_output(level):
+    """catNips produced by one Cat Lair activation."""
+    spec = MACHINE_PRODUCTION["catLair"]
+    return spec["catNips_base"] + spec["catNips_per_level"] * (level - 1)
+
+
+def reactor_output(level, summary):
+    """Return (catNips consumed, tcorvax produced, energy produced) for one Reactor activation."""
+    spec = MACHINE_PRODUCTION["reactor"]
+    tcorvax = spec["tcorvax_by_level"].get(level, spec["tcorvax_by_level"][1])
+    if summary.amplifier_level and summary.amplifier_online:
+        tcorvax += spec["amplifier_bonus_per_level"] * summary.amplifier_level
+    return spec["catNips_cost"], tcorvax, spec["energy"]
+
+
+def incubator_output(staked_cvx, level):
+    """Return (base tcorvax, bonus tcorvax, eggs) for one Incubator activation."""
+    spec = MACHINE_PRODUCTION["incubator"]
+    level = level or 1
+    base_reward = min(spec["tcorvax_cap"], int(staked_cvx // spec["scvx_per_tcorvax"]))
+    bonus_reward = 0
+    if level >= spec["bonus_min_level"]:
+        bonus_reward = int(staked_cvx // spec["bonus_scvx_per_tcorvax"])
+    eggs_reward = int(staked_cvx // spec["scvx_per_egg"])
+    return base_reward, bonus_reward, eggs_reward
+
+
+# ---------------------------------------------------------------------------
+# Client manifest
+# ---------------------------------------------------------------------------
+
+def _rules_to_json(rules):
+    return [list(rule) for rule in rules]
+
+
+def catalog_manifest():
+    """Everything the frontend needs for local cost previews and gating.
+
+    Upgrade costs are the expanded UPGRADE_TABLE, so clients never re-derive
+    the growth formula; rules keep their (name, *args) form (see RULES).
+    """
+    machines = {}
+    for machine_type, spec in MACHINE_CATALOG.items():
+        gating = spec.get("upgrade_requires", {})
+        upgrades = {}
+        for (upgrade_type, level), (cost, _, second_mult) in UPGRADE_TABLE.items():
+            if upgrade_type != machine_type:
+                continue
+            entry = {"cost": cost}
+            if second_mult != 1:
+                entry["secondMachineCost"] = {res: val * second_mult for res, val in cost.items()}
+            if level in gating:
+                entry["requires"] = _rules_to_json(gating[level])
+            upgrades[str(level)] = entry
+
+        machines[machine_type] = {
+            "build": [
+                {key: value for key, value in (("cost", slot["cost"]),
+                                               ("requires", _rules_to_json(slot.get("requires", []))),
+                                               ("error", slot.get("error")))
+                 if value}
+                for slot in spec.get("build", [])
+            ],
+            "maxLevel": spec["max_level"],
+            "upgrades": upgrades,
+        }
+
+    return {
+        "machines": machines,
+        "rules": sorted(RULES),
+        "roomUnlocks": {str(room): _rules_to_json(rules) for room, rules in ROOM_UNLOCKS.items()},
+        "activationCooldownMs": ACTIVATION_COOLDOWN_MS,
+        "production": MACHINE_PRODUCTION,
+        "amplifierUpkeep": AMPLIFIER_UPKEEP_COST,
+        "pets": PET_CATALOG,
+        "moveCost": MOVE_COST,
+        "eggMintCost": EGG_MINT_COST,
+        "creatureActions": CREATURE_ACTION_COSTS,
+    }
+
+
+# Serialized once; the hash changes exactly when the catalog does
+CATALOG_JSON = json.dumps(catalog_manifest(), sort_keys=True, separators=(',', ':')).encode()
+CATALOG_HASH = hashlib.sha256(CATALOG_JSON).hexdigest()[:16]
@@ -0,0 +1,317 @@
+# manifests.py
+#
+# Radix transaction manifests the backend hands to the wallet. Each manifest
+# is a ManifestTemplate parsed once at import: literal text plus typed
+# placeholders written {name:kind}. Fixed addresses are bound (and checked)
+# when the template is built; per-request values are validated by kind on
+# every render, so a malformed address or id can never reach the manifest.
+import re
+from decimal import Decimal, InvalidOperation
+
+from gateway import CREATURE_NFT_RESOURCE
+
+XRD_RESOURCE = "resource_rdx1tknxxxxxxxxxradxrdxxxxxxxxx009923554798xxxxxxxxxradxrd"
+CVX_RESOURCE = "resource_rdx1th04p2c55884yytgj0e8nq79ze9wjnvu4rpg9d7nh3t698cxdt0cr9"
+BACKEND_BADGE = "resource_rdx1tkfpjtakrtv96e4l38djre4pxdwaa49sa7djhfwt3egqm42ztt0ddw"
+DAPP_DEFINITION_ADDRESS = "account_rdx12yszc3rh4yq3h9syvg5uv4ennzg8ujkmtaptc4r3a9npe6wgzwn7ar"
+# Egg minting and creature evolution
+CREATURE_COMPONENT = "component_rdx1crz6pcapzglrv68tydmuq226ydtsu0x2vlx3793g4qe72450m3f86t"
+# FOMO HIT NFT minting
+FOMO_NFT_COMPONENT = "component_rdx1cqpv4nfsgfk9c2r9ymnqyksfkjsg07mfc49m9qw3dpgzrmjmsuuquv"
+ENERGY_DESTINATION_ACCOUNT = "account_rdx16ya2ncwya20j2w0k8d49us5ksvzepjhhh7cassx9jp9gz6hw69mhks"
+
+
+class ManifestError(ValueError):
+    """A value that can't be placed into a manifest."""
+
+
+_ADDRESS_RE = re.compile(r"^(account|resource|component|package)_(rdx|tdx_[0-9a-f]+_)1[0-9a-z]{40,70}$")
+_ACCOUNT_RE = re.compile(r"^account_(rdx|tdx_[0-9a-f]+_)1[0-9a-z]{40,70}$")
+# Integer #1#, string <abc>, bytes [0a1b] and RUID {...} local ids
+_NFT_ID_RE = re.compile(r"^(#\d{1,20}#|<[A-Za-z0-9_]{1,64}>|\[[0-9a-fA-F]{2,128}\]|\{[0-9a-fA-F-]{16,80}\})$")
+
+
+def _address(value):
+    if not isinstance(value, str) or not _ADDRESS_RE.match(value):
+        raise ManifestError(f"Invalid address: {value!r}")
+    return value
+
+
+def _account(value):
+    if not isinstance(value, str) or not _ACCOUNT_RE.match(value):
+        raise ManifestError(f"Invalid account address: {value!r}")
+    return value
+
+
+def _decimal(value):
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise ManifestError(f"Invalid amount: {value!r}")
+    if not amount.is_finite() or amount < 0:
+        raise ManifestError(f"Invalid amount: {value!r}")
+    return format(amount.normalize(), "f")
+
+
+def _u8(value):
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= 255:
+        raise ManifestError(f"Invalid u8 value: {value!r}")
+    return str(value)
+
+
+def _nft_id(value):
+    if not isinstance(value, str) or not _NFT_ID_RE.match(value):
+        raise ManifestError(f"Invalid NFT id: {value!r}")
+    return value
+
+
+def _nft_ids(values):
+    if not isinstance(values, (list, tuple)) or not values:
+        raise ManifestError("Expected a non-empty list of NFT ids")
+    return ", ".join(f'NonFungibleLocalId("{_nft_id(value)}")' for value in values)
+
+
+KINDS = {
+    "address": _address,
+    "account": _account,
+    "decimal": _decimal,
+    "u8": _u8,
+    "nft_id": _nft_id,
+    "nft_ids": _nft_ids,
+}
+
+_PLACEHOLDER_RE = re.compile(r"\{(\w+):(\w+)\}")
+
+
+class ManifestTemplate:
+    """A manifest with typed {name:kind} placeholders, parsed once.
+
+    `constants` are rendered into the literal text up front; render() then
+    only validates and joins the per-request values.
+    """
+
+    def __init__(self, name, text, **constants):
+        self.name = name
+        self.fields = {}
+        segments = []  # literal strings and (name, kind) pairs
+        pos = 0
+        for match in _PLACEHOLDER_RE.finditer(text):
+            field, kind = match.groups()
+            if kind not in KINDS:
+                raise ValueError(f"{name}: unknown placeholder kind {kind!r}")
+            if self.fields.get(field, kind) != kind:
+                raise ValueError(f"{name}: placeholder {field!r} used with two kinds")
+            segments.append(text[pos:match.start()])
+            if field in constants:
+                segments.append(KINDS[kind](constants[field]))
+            else:
+                self.fields[field] = kind
+                segments.append((field, kind))
+            pos = match.end()
+        segments.append(text[pos:])
+
+        unused = set(constants) - {seg[0] for seg in _PLACEHOLDER_RE.findall(text)}
+        if unused:
+            raise ValueError(f"{name}: constants not in template: {sorted(unused)}")
+
+        # Merge adjacent literals so rendering is a single join
+        self._segments = []
+        for seg in segments:
+            if isinstance(seg, str) and self._segments and isinstance(self._segments[-1], str):
+                self._segments[-1] += seg
+            elif seg != "":
+                self._segments.append(seg)
+
+    def render(self, **values):
+        missing = self.fields.keys() - values.keys()
+        extra = values.keys() - self.fields.keys()
+        if missing or extra:
+            raise ManifestError(f"{self.name}: missing {sorted(missing)}, unexpected {sorted(extra)}")
+        rendered = {field: KINDS[kind](values[field]) for field, kind in self.fields.items()}
+        return "".join(seg if isinstance(seg, str) else rendered[seg[0]] for seg in self._segments)
+
+
+_DEPOSIT_ALL = """
+CALL_METHOD
+    Address("{account:account}")
+    "try_deposit_batch_or_abort"
+    Expression("ENTIRE_WORKTOP")
+    None;
+"""
+
+_BACKEND_PROOF = """
+CALL_METHOD
+    Address("{dapp_definition:account}")
+    "create_proof_of_amount"
+    Address("{backend_badge:address}")
+    Decimal("1");
+CREATE_PROOF_FROM_AUTH_ZONE_OF_ALL
+    Address("{backend_badge:address}")
+    Proof("backend_proof");"""
+
+_CREATURE_PROOF = """
+CALL_METHOD
+    Address("{account:account}")
+    "create_proof_of_non_fungibles"
+    Address("{creature_resource:address}")
+    Array<NonFungibleLocalId>({nft_ids:nft_ids});
+POP_FROM_AUTH_ZONE
+    Proof("creature_proof");"""
+
+_XRD_PAYMENT = """
+CALL_METHOD
+    Address("{account:account}")
+    "withdraw"
+    Address("{xrd:address}")
+    Decimal("{payment:decimal}");
+TAKE_FROM_WORKTOP
+    Address("{xrd:address}")
+    Decimal("{payment:decimal}")
+    Bucket("payment");"""
+
+_ADDRESSES = {
+    "xrd": XRD_RESOURCE,
+    "backend_badge": BACKEND_BADGE,
+    "dapp_definition": DAPP_DEFINITION_ADDRESS,
+    "component": CREATURE_COMPONENT,
+    "creature_resource": CREATURE_NFT_RESOURCE,
+}
+
+
+def _template(name, text):
+    """Build a template, binding whichever of the fixed addresses it uses."""
+    used = {field for field, _ in _PLACEHOLDER_RE.findall(text)}
+    return ManifestTemplate(name, text, **{k: v for k, v in _ADDRESSES.items() if k in used})
+
+
+MINT_USER_NFT = ManifestTemplate("mint_user_nft", """
+CALL_METHOD
+    Address("{component:address}")
+    "mint_user_nft";
+""" + _DEPOSIT_ALL, component=FOMO_NFT_COMPONENT)
+
+BUY_ENERGY = ManifestTemplate("buy_energy", """
+CALL_METHOD
+    Address("{account:account}")
+    "withdraw"
+    Address("{cvx:address}")
+    Decimal("{amount:decimal}");
+CALL_METHOD
+    Address("{destination:account}")
+    "try_deposit_batch_or_abort"
+    Expression("ENTIRE_WORKTOP")
+    None;
+""", cvx=CVX_RESOURCE, destination=ENERGY_DESTINATION_ACCOUNT)
+
+# Egg mints are built from a per-egg step repeated `quantity` times, so a
+# batch is one transaction with one signature.
+_MINT_EGG_XRD_WITHDRAW = _template("mint_egg_xrd_withdraw", """
+CALL_METHOD
+    Address("{account:account}")
+    "withdraw"
+    Address("{xrd:address}")
+    Decimal("{total:decimal}");""")
+
+_MINT_EGG_XRD_STEP = _template("mint_egg_xrd_step", """
+TAKE_FROM_WORKTOP
+    Address("{xrd:address}")
+    Decimal("{price:decimal}")
+    Bucket("payment{index:u8}");
+CALL_METHOD
+    Address("{component:address}")
+    "mint_egg"
+    Bucket("payment{index:u8}");""")
+
+_MINT_EGG_EGGS_STEP = _template("mint_egg_eggs_step", """
+CALL_METHOD
+    Address("{component:address}")
+    "backend_mint_egg"
+    Proof("backend_proof")
+    None;""")
+
+_BACKEND_PROOF_ONLY = _template("backend_proof", _BACKEND_PROOF)
+_DROP_PROOFS_AND_DEPOSIT = _template("drop_proofs_and_deposit", """
+DROP_ALL_PROOFS;""" + _DEPOSIT_ALL)
+_DEPOSIT = _template("deposit", _DEPOSIT_ALL)
+
+MAX_EGGS_PER_MINT = 10
+
+
+def mint_eggs_manifest(account, quantity, xrd_price=None):
+    """One manifest minting `quantity` eggs.
+
+    Paid with `xrd_price` XRD per egg, or through the backend badge (eggs
+    settled off-chain) when xrd_price is None.
+    """
+    if isinstance(quantity, bool) or not isinstance(quantity, int) or not 1 <= quantity <= MAX_EGGS_PER_MINT:
+        raise ManifestError(f"Quantity must be between 1 and {MAX_EGGS_PER_MINT}")
+
+    if xrd_price is None:
+        parts = [_BACKEND_PROOF_ONLY.render()]
+        parts += [_MINT_EGG_EGGS_STEP.render()] * quantity
+        parts.append(_DROP_PROOFS_AND_DEPOSIT.render(account=account))
+    else:
+        total = Decimal(_decimal(xrd_price)) * quantity
+        parts = [_MINT_EGG_XRD_WITHDRAW.render(account=account, total=total)]
+        parts += [_MINT_EGG_XRD_STEP.render(price=xrd_price, index=i) for i in range(quantity)]
+        parts.append(_DEPOSIT.render(account=account))
+    return "".join(parts)
+
+_STAT_ARGS = """
+    {energy:u8}u8
+    {strength:u8}u8
+    {magic:u8}u8
+    {stamina:u8}u8
+    {speed:u8}u8"""
+
+UPGRADE_STATS_XRD = _template("upgrade_stats_xrd", _CREATURE_PROOF + _XRD_PAYMENT + """
+CALL_METHOD
+    Address("{component:address}")
+    "upgrade_stats"
+    Proof("creature_proof")""" + _STAT_ARGS + """
+    Bucket("payment");
+DROP_ALL_PROOFS;""" + _DEPOSIT_ALL)
+
+UPGRADE_STATS_EGGS = _template("upgrade_stats_eggs", _CREATURE_PROOF + _BACKEND_PROOF + """
+CALL_METHOD
+    Address("{component:address}")
+    "backend_upgrade_stats"
+    Proof("backend_proof")
+    Proof("creature_proof")""" + _STAT_ARGS + """;
+DROP_ALL_PROOFS;""" + _DEPOSIT_ALL)
+
+EVOLVE_XRD = _template("evolve_xrd", _CREATURE_PROOF + _XRD_PAYMENT + """
+CALL_METHOD
+    Address("{component:address}")
+    "evolve_creature"
+    Proof("creature_proof")
+    Bucket("payment");
+DROP_ALL_PROOFS;""" + _DEPOSIT_ALL)
+
+EVOLVE_EGGS = _template("evolve_eggs", _CREATURE_PROOF + _BACKEND_PROOF + """
+CALL_METHOD
+    Address("{component:address}")
+    "backend_evolve_creature"
+    Proof("backend_proof")
+    Proof("creature_proof");
+DROP_ALL_PROOFS;""" + _DEPOSIT_ALL)
+
+COMBINE_CREATURES = _template("combine_creatures", """
+CALL_METHOD
+    Address("{account:account}")
+    "withdraw_non_fungibles"
+    Address("{creature_resource:address}")
+    Array<NonFungibleLocalId>({nft_ids:nft_ids});
+TAKE_NON_FUNGIBLES_FROM_WORKTOP
+    Address("{creature_resource:address}")
+    Array<NonFungibleLocalId>(NonFungibleLocalId("{primary:nft_id}"))
+    Bucket("primary");
+TAKE_NON_FUNGIBLES_FROM_WORKTOP
+    Address("{creature_resource:address}")
+    Array<NonFungibleLocalId>(NonFungibleLocalId("{secondary:nft_id}"))
+    Bucket("secondary");
+CALL_METHOD
+    Address("{component:address}")
+    "combine_creatures"
+    Bucket("primary")
+    Bucket("secondary");""" + _DEPOSIT_ALL)
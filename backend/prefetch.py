@@ -0,0 +1,51 @@
+# prefetch.py
+#
+# Background pre-warming of the gateway caches in gateway.py. Login and the
+# first getGameState of a session enqueue the player's known account
+# addresses, so the sCVX balance (incubator) and owned NFTs (MyCreatures)
+# are already cached when the UI asks for them.
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import PREFETCH_WORKERS
+from gateway import fetch_scvx_balance, fetch_nft_ids, fetch_nft_data
+
+log = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+# Addresses with a job queued or running, so repeated logins don't pile up
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def _prewarm(account_address):
+    fetch_scvx_balance(account_address)
+    fetch_nft_data(fetch_nft_ids(account_address))
+
+
+def _run_prewarm(account_address):
+    try:
+        _prewarm(account_address)
+        log.debug(f"Prefetched gateway data for {account_address}")
+    except Exception as e:
+        log.exception(f"Error prefetching gateway data for {account_address}: {e}")
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(account_address)
+
+
+def enqueue_prefetch(account_addresses):
+    """Queue prefetch jobs; returns how many new jobs were queued."""
+    queued = 0
+    for account_address in account_addresses:
+        if not account_address:
+            continue
+        with _in_flight_lock:
+            if account_address in _in_flight:
+                continue
+            _in_flight.add(account_address)
+        _executor.submit(_run_prewarm, account_address)
+        queued += 1
+    return queued
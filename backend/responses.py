@@ -0,0 +1,172 @@
+# responses.py
+#
+# Response encoding for the API: a Flask JSON provider backed by orjson
+# (falls back to the stdlib encoder when orjson isn't installed), one-pass
+# conversion of sqlite rows into the camelCase dicts the client uses,
+# MessagePack content negotiation, and gzip/brotli compression of larger
+# responses.
+import gzip
+
+from flask import current_app, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+from config import COMPRESS_MIN_SIZE
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # clients asking for MessagePack get JSON instead
+    msgpack = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # 0-11; mid qualities suit responses compressed per request
+
+MSGPACK_MIMETYPE = "application/msgpack"
+COMPRESSIBLE_MIMETYPES = {"application/json", MSGPACK_MIMETYPE}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify() through orjson, writing bytes straight into the response."""
+
+    def _orjson_options(self):
+        options = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._orjson_options()).decode()
+        except (TypeError, orjson.JSONEncodeError):
+            # e.g. integers wider than 64 bits
+            return super().dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = orjson.dumps(obj, default=self.default,
+                                option=self._orjson_options() | orjson.OPT_APPEND_NEWLINE)
+        except (TypeError, orjson.JSONEncodeError):
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def _camel(name):
+    head, *rest = name.split("_")
+    return head + "".join(part.title() for part in rest)
+
+
+def rows_to_json(cur, renames=None, defaults=None):
+    """Fetch the cursor's rows as camelCase dicts in a single pass.
+
+    Keys come from the selected column names (snake_case -> camelCase, or
+    `renames`); `defaults` fills keys for columns the query didn't select.
+    """
+    renames = renames or {}
+    keys = [renames.get(col[0], _camel(col[0])) for col in cur.description]
+    rows = [dict(zip(keys, row)) for row in cur.fetchall()]
+    missing = {key: value for key, value in (defaults or {}).items() if key not in keys}
+    if missing:
+        for row in rows:
+            row.update(missing)
+    return rows
+
+
+def wants_msgpack():
+    """Whether the current request prefers MessagePack and we can produce it.
+
+    Chosen with `Accept: application/msgpack` or `?format=msgpack`; plain
+    axios requests (Accept: application/json, */*) keep getting JSON.
+    """
+    if msgpack is None:
+        return False
+    if request.args.get("format") == "msgpack":
+        return True
+    return request.accept_mimetypes.best_match(["application/json", MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+
+def to_columns(rows):
+    """Same-shaped dicts -> {"count": n, "columns": {key: [values...]}}.
+
+    Sends each key once instead of once per row; frontend/src/utils/MsgPack.js
+    turns it back into a list of objects.
+    """
+    keys = list(rows[0]) if rows else []
+    return {"count": len(rows), "columns": {key: [row.get(key) for row in rows] for key in keys}}
+
+
+def negotiate_response(payload, columnar=()):
+    """JSON, or MessagePack with the `columnar` lists sent as column arrays.
+
+    A list payload is sent as columns as a whole.
+    """
+    if not wants_msgpack():
+        response = jsonify(payload)
+    else:
+        if isinstance(payload, list):
+            body = to_columns(payload)
+        else:
+            body = dict(payload)
+            for key in columnar:
+                if isinstance(body.get(key), list):
+                    body[key] = to_columns(body[key])
+        response = current_app.response_class(msgpack.packb(body, use_bin_type=True),
+                                              mimetype=MSGPACK_MIMETYPE)
+    response.vary.add("Accept")
+    return response
+
+
+def _pick_encoding(accept_encodings):
+    for name in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if accept_encodings.quality(name) > 0:
+            return name
+    return None
+
+
+def compress_response(response, accept_encodings):
+    """Compress a buffered API response when the client accepts it and it's worth it."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or "Content-Encoding" in response.headers):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    encoding = _pick_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    if encoding == "br":
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+    response.headers["Content-Encoding"] = encoding
+
+    # The bytes now differ per encoding, so a strong validator would be wrong
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
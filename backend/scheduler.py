@@ -0,0 +1,219 @@
+# scheduler.py
+#
+# In-process hierarchical timer wheel tracking when each machine's cooldown
+# ends and when each amplifier's next upkeep is due. Rebuilt from
+# user_machines at startup and kept current by the routes in app.py, so
+# readiness can be pushed (events.py) and upkeep settled in the background
+# instead of only being noticed when the player's next request arrives.
+#
+# Scheduling, cancelling and firing are O(1) per timer; each tick only looks
+# at one bucket per level. Timers live in this process only.
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from machine_catalog import ACTIVATION_COOLDOWN_MS
+
+log = logging.getLogger(__name__)
+
+TICK_MS = 1000
+WHEEL_BITS = 6
+WHEEL_SIZE = 1 << WHEEL_BITS  # buckets per level
+WHEEL_MASK = WHEEL_SIZE - 1
+WHEEL_LEVELS = 5  # 64**5 one-second ticks ~ 34 years
+
+# Timer kinds
+MACHINE_READY = "machineReady"
+AMPLIFIER_UPKEEP = "amplifierUpkeep"
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+class TimerWheel:
+    """Hierarchical timing wheel keyed by (user_id, machine_id, kind).
+
+    Level 0 has one bucket per tick; each bucket of level n covers 64**n
+    ticks and is redistributed into lower levels when the wheel reaches it.
+    Rescheduling a key just replaces its entry; stale bucket entries are
+    skipped when they come up.
+    """
+
+    def __init__(self, tick_ms=TICK_MS, now_ms=None):
+        self.tick_ms = tick_ms
+        self.current_tick = (now_ms if now_ms is not None else _now_ms()) // tick_ms
+        self._levels = [[[] for _ in range(WHEEL_SIZE)] for _ in range(WHEEL_LEVELS)]
+        self._timers = {}  # key -> (due_ms, generation, data)
+        self._by_user = {}  # user_id -> set of keys, for per-player queries
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._timers)
+
+    def schedule(self, user_id, machine_id, kind, due_ms, data=None):
+        key = (str(user_id), machine_id, kind)
+        with self._lock:
+            self._generation += 1
+            self._timers[key] = (due_ms, self._generation, data)
+            self._by_user.setdefault(key[0], set()).add(key)
+            self._insert(key, due_ms // self.tick_ms, self._generation)
+
+    def cancel(self, user_id, machine_id, kind):
+        key = (str(user_id), machine_id, kind)
+        with self._lock:
+            self._forget(key)
+
+    def upcoming(self, user_id, limit=None):
+        """The player's pending timers, soonest first."""
+        with self._lock:
+            keys = self._by_user.get(str(user_id), ())
+            timers = [
+                {"machineId": key[1], "type": key[2], "at": self._timers[key][0], "data": self._timers[key][2]}
+                for key in keys
+            ]
+        timers.sort(key=lambda t: t["at"])
+        return timers[:limit] if limit else timers
+
+    def advance(self, now_ms=None):
+        """Move the wheel up to `now_ms`; returns the timers that came due."""
+        target_tick = (now_ms if now_ms is not None else _now_ms()) // self.tick_ms
+        fired = []
+        with self._lock:
+            while self.current_tick < target_tick:
+                self.current_tick += 1
+                self._cascade()
+                bucket = self._levels[0][self.current_tick & WHEEL_MASK]
+                self._levels[0][self.current_tick & WHEEL_MASK] = []
+                for key, generation in bucket:
+                    timer = self._timers.get(key)
+                    if timer is None or timer[1] != generation:
+                        continue  # cancelled or rescheduled
+                    self._forget(key)
+                    fired.append({"userId": key[0], "machineId": key[1], "type": key[2],
+                                  "at": timer[0], "data": timer[2]})
+        return fired
+
+    # -- internals (caller holds the lock) ---------------------------------
+
+    def _insert(self, key, due_tick, generation, earliest_tick=None):
+        # Outside advance() the current tick's bucket has already been
+        # processed, so anything already due fires on the next tick
+        if earliest_tick is None:
+            earliest_tick = self.current_tick + 1
+        due_tick = max(due_tick, earliest_tick)
+        delta = due_tick - self.current_tick
+
+        for level in range(WHEEL_LEVELS):
+            if delta < WHEEL_SIZE ** (level + 1):
+                slot = (due_tick >> (WHEEL_BITS * level)) & WHEEL_MASK
+                self._levels[level][slot].append((key, generation))
+                return
+
+        # Beyond the top level: park in the last top-level bucket before the
+        # wheel wraps; it gets re-examined (and re-parked) when reached.
+        top = WHEEL_LEVELS - 1
+        slot = ((self.current_tick >> (WHEEL_BITS * top)) - 1) & WHEEL_MASK
+        self._levels[top][slot].append((key, generation))
+
+    def _cascade(self):
+        # When a level's lower bits roll over to zero, redistribute the
+        # matching bucket of the next level down into finer buckets.
+        for level in range(1, WHEEL_LEVELS):
+            if self.current_tick & ((1 << (WHEEL_BITS * level)) - 1):
+                return
+            slot = (self.current_tick >> (WHEEL_BITS * level)) & WHEEL_MASK
+            bucket = self._levels[level][slot]
+            self._levels[level][slot] = []
+            for key, generation in bucket:
+                timer = self._timers.get(key)
+                if timer is None or timer[1] != generation:
+                    continue
+                self._insert(key, timer[0] // self.tick_ms, generation, self.current_tick)
+
+    def _forget(self, key):
+        if self._timers.pop(key, None) is None:
+            return
+        keys = self._by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[key[0]]
+
+
+class CooldownScheduler:
+    """Drives a TimerWheel from a background thread and dispatches due timers.
+
+    Listeners registered with on(kind, fn) run on a worker thread as
+    fn(timer), where timer is the dict produced by TimerWheel.advance.
+    """
+
+    def __init__(self, tick_ms=TICK_MS):
+        self.wheel = TimerWheel(tick_ms)
+        self._listeners = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scheduler")
+        self._thread = None
+        self._stop = threading.Event()
+
+    def on(self, kind, fn):
+        self._listeners.setdefault(kind, []).append(fn)
+
+    def machine_activated(self, user_id, machine_id, machine_type, activated_ms):
+        self.wheel.schedule(user_id, machine_id, MACHINE_READY, activated_ms + ACTIVATION_COOLDOWN_MS,
+                            {"machineType": machine_type})
+
+    def amplifier_upkeep(self, user_id, machine_id, due_ms):
+        if due_ms:
+            self.wheel.schedule(user_id, machine_id, AMPLIFIER_UPKEEP, due_ms)
+
+    def rebuild(self, conn):
+        """Load every pending cooldown and upkeep from user_machines."""
+        now_ms = _now_ms()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT user_id, id, machine_type, last_activated, next_cost_time
+            FROM user_machines
+            WHERE last_activated > ? OR (machine_type='amplifier' AND next_cost_time > 0)
+        """, (now_ms - ACTIVATION_COOLDOWN_MS,))
+        count = 0
+        for user_id, machine_id, machine_type, last_activated, next_cost_time in cur.fetchall():
+            if last_activated and last_activated + ACTIVATION_COOLDOWN_MS > now_ms:
+                self.machine_activated(user_id, machine_id, machine_type, last_activated)
+                count += 1
+            if machine_type == 'amplifier' and next_cost_time:
+                self.amplifier_upkeep(user_id, machine_id, next_cost_time)
+                count += 1
+        cur.close()
+        log.info(f"Scheduler rebuilt with {count} timers")
+        return count
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cooldown-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.wheel.tick_ms / 1000):
+            try:
+                for timer in self.wheel.advance():
+                    for fn in self._listeners.get(timer["type"], ()):
+                        self._executor.submit(self._dispatch, fn, timer)
+            except Exception as e:
+                log.exception(f"Error advancing scheduler: {e}")
+
+    @staticmethod
+    def _dispatch(fn, timer):
+        try:
+            fn(timer)
+        except Exception as e:
+            log.exception(f"Error handling {timer['type']} timer for user {timer['userId']}: {e}")
+
+
+cooldown_scheduler = CooldownScheduler()
@@ -0,0 +1,138 @@
+# shard_migrate.py
+#
+# Splits the player tables of an existing database into shard files for
+# sharded mode (see shards.py). The source is only read: its tables stay in
+# place for the Telegram bot and as a fallback.
+#
+# Usage:
+#   python shard_migrate.py --source /root/telegram_bot/bot.db \
+#       --dest /root/telegram_bot/shards --shards 8
+#
+# Stop the backend before migrating, then start it with SHARD_COUNT and
+# SHARD_DIR set to the same values. --dry-run only prints how players would
+# be distributed.
+import argparse
+import os
+import sqlite3
+import sys
+
+from config import DATABASE_PATH, SHARD_COUNT, SHARD_DIR
+from shards import SHARDED_TABLES, shard_index, shard_path
+
+# Rows inserted per executemany() call
+CHUNK_SIZE = 1000
+
+
+def read_schema(source):
+    """CREATE statements of the sharded tables, their indexes and triggers."""
+    placeholders = ",".join("?" * len(SHARDED_TABLES))
+    rows = source.execute(f"""
+        SELECT type, name, tbl_name, sql FROM sqlite_master
+        WHERE tbl_name IN ({placeholders}) AND sql IS NOT NULL
+    """, SHARDED_TABLES).fetchall()
+    tables = [row for row in rows if row[0] == "table"]
+    # Triggers are created after the copy so they don't rewrite the versions
+    later = [row for row in rows if row[0] != "table"]
+    later.sort(key=lambda row: row[0] == "trigger")
+    return tables, later
+
+
+def copy_table(source, shard_conns, table, count):
+    cur = source.execute(f"SELECT * FROM {table}")
+    columns = [col[0] for col in cur.description]
+    if "user_id" not in columns:
+        print(f"Skipping {table}: no user_id column")
+        return 0
+    user_col = columns.index("user_id")
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    copied = 0
+    while True:
+        rows = cur.fetchmany(CHUNK_SIZE)
+        if not rows:
+            return copied
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(shard_index(row[user_col], count), []).append(row)
+        for index, shard_rows in by_shard.items():
+            shard_conns[index].executemany(insert, shard_rows)
+        copied += len(rows)
+
+
+def migrate(source_path, dest, count, force=False):
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    source.execute("BEGIN")  # one consistent snapshot for every table
+    tables, later = read_schema(source)
+    if not any(row[1] == "users" for row in tables):
+        raise SystemExit(f"{source_path} has no users table")
+
+    os.makedirs(dest, exist_ok=True)
+    paths = [shard_path(i, dest) for i in range(count)]
+    existing = [path for path in paths if os.path.exists(path)]
+    if existing and not force:
+        raise SystemExit(f"{len(existing)} shard files already exist in {dest}; use --force to replace them")
+
+    # Build each shard under a temporary name and move it into place at the end
+    shard_conns = []
+    for path in paths:
+        if os.path.exists(path + ".tmp"):
+            os.remove(path + ".tmp")
+        conn = sqlite3.connect(path + ".tmp", isolation_level=None)
+        conn.execute("BEGIN")
+        for _, _, _, sql in tables:
+            conn.execute(sql)
+        shard_conns.append(conn)
+
+    totals = {}
+    for _, table, _, _ in tables:
+        totals[table] = copy_table(source, shard_conns, table, count)
+
+    for conn in shard_conns:
+        for _, _, _, sql in later:
+            conn.execute(sql)
+        conn.execute("COMMIT")
+
+    # Every row must have landed in exactly one shard
+    for table, total in totals.items():
+        sharded = sum(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for conn in shard_conns)
+        if sharded != total:
+            raise SystemExit(f"{table}: copied {sharded} rows, source has {total}; shards left as .tmp files")
+
+    for conn, path in zip(shard_conns, paths):
+        players = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        conn.close()
+        os.replace(path + ".tmp", path)
+        print(f"{path}: {players} players")
+    source.close()
+
+    for table, total in totals.items():
+        print(f"{table}: {total} rows")
+    return totals
+
+
+def distribution(source_path, count):
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    players = [0] * count
+    for (user_id,) in source.execute("SELECT user_id FROM users"):
+        players[shard_index(user_id, count)] += 1
+    source.close()
+    for index, n in enumerate(players):
+        print(f"shard {index:03d}: {n} players")
+    return players
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split the player tables into per-player shard files")
+    parser.add_argument("--source", default=DATABASE_PATH)
+    parser.add_argument("--dest", default=SHARD_DIR)
+    parser.add_argument("--shards", type=int, default=SHARD_COUNT or 8)
+    parser.add_argument("--force", action="store_true", help="replace existing shard files")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.shards < 1:
+        sys.exit("--shards must be at least 1")
+    if args.dry_run:
+        distribution(args.source, args.shards)
+    else:
+        migrate(args.source, args.dest, args.shards, args.force)
@@ -0,0 +1,66 @@
+# shards.py
+#
+# Optional per-player sharding (SHARD_COUNT > 0). Every table keyed by
+# user_id moves out of the shared bot.db into one of SHARD_COUNT SQLite
+# files, picked by a stable hash of the user id, so writes for players on
+# different shards no longer queue behind one write lock. A player's rows
+# all live in the same file, which keeps the state-version triggers and
+# per-player transactions local to it.
+#
+# With sharding off every path resolves to DATABASE_PATH.
+import contextvars
+import os
+import zlib
+from contextlib import contextmanager
+
+from config import DATABASE_PATH, SHARD_COUNT, SHARD_DIR
+
+# Tables partitioned by user_id; anything else stays in DATABASE_PATH
+SHARDED_TABLES = ("users", "resources", "user_machines", "pets", "user_accounts", "machine_summary")
+
+# Set by pinned() for code that works on one file without a player in hand
+# (startup schema checks, scheduler rebuild)
+_pinned = contextvars.ContextVar("pinned_database", default=None)
+
+
+def enabled():
+    return SHARD_COUNT > 0
+
+
+def shard_index(user_id, count=None):
+    """Stable shard number of a player (crc32, not hash(), so it survives restarts)."""
+    return zlib.crc32(str(user_id).encode()) % (count or SHARD_COUNT)
+
+
+def shard_path(index, directory=None):
+    return os.path.join(directory or SHARD_DIR, f"shard-{index:03d}.db")
+
+
+def database_path(user_id=None):
+    """The file holding user_id's rows.
+
+    Without a player this is the file pinned() in this context, if any,
+    else DATABASE_PATH.
+    """
+    if not enabled():
+        return DATABASE_PATH
+    if user_id is not None:
+        return shard_path(shard_index(user_id))
+    return _pinned.get() or DATABASE_PATH
+
+
+def all_paths():
+    """Every file holding player rows."""
+    if not enabled():
+        return [DATABASE_PATH]
+    return [shard_path(i) for i in range(SHARD_COUNT)]
+
+
+@contextmanager
+def pinned(path):
+    """Route every connection opened in the block to `path`."""
+    token = _pinned.set(path)
+    try:
+        yield path
+    finally:
+        _pinned.reset(token)
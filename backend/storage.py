@@ -0,0 +1,425 @@
+# storage.py
+#
+# Where the game tables live, and the queries on them that handlers share.
+#
+# A storage backend maps a player to a database and opens connections to it.
+# SQLiteStorage uses DATABASE_PATH, or the player's shard file (shards.py).
+# MemoryStorage keeps everything in a process-private in-memory database
+# created with the base schema, so the game logic can run in tests and
+# benchmarks without a bot.db on disk. STORAGE_BACKEND picks one at startup;
+# use_storage() swaps it before the app is imported.
+#
+# The repositories take a cursor, so they work inside whatever transaction
+# (unit of work, group-commit batch) the caller is already in.
+import itertools
+import os
+import sqlite3
+
+from config import STORAGE_BACKEND, DB_SYNCHRONOUS, DB_LOCK_TIMEOUT
+import shards
+
+# Tables the Telegram bot normally creates; the app's startup checks add
+# the rest (pets, user_accounts, machine_summary, version columns).
+BASE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        first_name TEXT,
+        corvax_count REAL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS resources (
+        user_id INTEGER NOT NULL,
+        resource_name TEXT NOT NULL,
+        amount REAL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS user_machines (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        machine_type TEXT NOT NULL,
+        x INTEGER NOT NULL,
+        y INTEGER NOT NULL,
+        level INTEGER DEFAULT 1,
+        last_activated INTEGER DEFAULT 0,
+        is_offline INTEGER DEFAULT 0,
+        next_cost_time INTEGER DEFAULT 0
+    );
+"""
+
+
+class Storage:
+    """A place the game tables live."""
+
+    def database_path(self, user_id=None):
+        """Database holding user_id's rows (the default one without a player)."""
+        raise NotImplementedError
+
+    def all_paths(self):
+        """Every database holding player rows."""
+        raise NotImplementedError
+
+    def connect(self, path, **kwargs):
+        kwargs.setdefault("check_same_thread", False)
+        kwargs.setdefault("timeout", DB_LOCK_TIMEOUT)  # sqlite3 sets busy_timeout from this
+        conn = sqlite3.connect(path, uri=path.startswith("file:"), **kwargs)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+
+class SQLiteStorage(Storage):
+    """Files on disk: DATABASE_PATH, or SHARD_COUNT shard files."""
+
+    def connect(self, path, **kwargs):
+        conn = super().connect(path, **kwargs)
+        conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+        return conn
+
+    def database_path(self, user_id=None):
+        return shards.database_path(user_id)
+
+    def all_paths(self):
+        return shards.all_paths()
+
+
+class MemoryStorage(Storage):
+    """One in-memory database shared by every connection in the process.
+
+    Uses SQLite's memdb VFS, which locks like a file (busy timeouts and
+    BEGIN IMMEDIATE behave as on disk) but never touches one.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name=None):
+        name = name or f"game-{os.getpid()}-{next(self._ids)}"
+        self.uri = f"file:/{name}?vfs=memdb"
+        # The database lives as long as one connection to it stays open
+        self._anchor = self.connect(self.uri)
+        self._anchor.executescript(BASE_SCHEMA)
+
+    def database_path(self, user_id=None):
+        return self.uri
+
+    def all_paths(self):
+        return [self.uri]
+
+
+def make_storage(backend):
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SQLiteStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}")
+
+
+storage = make_storage(STORAGE_BACKEND)
+
+
+def use_storage(backend):
+    """Replace the storage backend; call before importing app."""
+    global storage
+    storage = backend
+    return backend
+
+
+def database_path(user_id=None):
+    return storage.database_path(user_id)
+
+
+def all_paths():
+    return storage.all_paths()
+
+
+def connect(path, **kwargs):
+    return storage.connect(path, **kwargs)
+
+
+class UserRepository:
+    def __init__(self, cur):
+        self.cur = cur
+
+    def exists(self, user_id):
+        self.cur.execute("SELECT 1 FROM users WHERE user_id=?", (user_id,))
+        return self.cur.fetchone() is not None
+
+    def get(self, user_id):
+        """The player's users row as a dict (whichever columns this database
+        has), or None for an unknown player."""
+        self.cur.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
+        row = self.cur.fetchone()
+        return dict(row) if row else None
+
+    def create(self, user_id, first_name):
+        """A new player with an empty eggs balance."""
+        self.cur.execute(
+            "INSERT INTO users (user_id, first_name, corvax_count, seen_room_unlock) VALUES (?, ?, 0, 0)",
+            (user_id, first_name))
+        self.cur.execute(
+            "INSERT INTO resources (user_id, resource_name, amount) VALUES (?, 'eggs', 0)", (user_id,))
+
+    def corvax(self, user_id):
+        """TCorvax balance, or None for an unknown player."""
+        self.cur.execute("SELECT corvax_count FROM users WHERE user_id=?", (user_id,))
+        row = self.cur.fetchone()
+        return float(row[0]) if row else None
+
+    def set_corvax(self, user_id, amount):
+        self.cur.execute("UPDATE users SET corvax_count=? WHERE user_id=?", (amount, user_id))
+
+    def state_version(self, user_id):
+        self.cur.execute("SELECT state_version FROM users WHERE user_id=?", (user_id,))
+        row = self.cur.fetchone()
+        return row[0] if row else None
+
+    def mark_room_unlock_seen(self, user_id):
+        self.cur.execute("UPDATE users SET seen_room_unlock=1 WHERE user_id=?", (user_id,))
+
+
+class AccountRepository:
+    def __init__(self, cur):
+        self.cur = cur
+
+    def remember(self, user_id, account_address, last_seen):
+        self.cur.execute("""
+            INSERT OR REPLACE INTO user_accounts (user_id, account_address, last_seen)
+            VALUES (?, ?, ?)
+        """, (user_id, account_address, last_seen))
+
+    def recent(self, user_id, limit):
+        """The player's wallet addresses, most recently used first."""
+        self.cur.execute("""
+            SELECT account_address FROM user_accounts
+            WHERE user_id=?
+            ORDER BY last_seen DESC
+            LIMIT ?
+        """, (user_id, limit))
+        return [row[0] for row in self.cur.fetchall()]
+
+
+class ResourceRepository:
+    def __init__(self, cur):
+        self.cur = cur
+
+    def get_or_create(self, user_id, resource_name):
+        self.cur.execute("SELECT amount FROM resources WHERE user_id=? AND resource_name=?",
+                         (user_id, resource_name))
+        row = self.cur.fetchone()
+        if row is None:
+            self.cur.execute("INSERT INTO resources (user_id, resource_name, amount) VALUES (?, ?, 0)",
+                             (user_id, resource_name))
+            return 0
+        return row[0]
+
+    def set(self, user_id, resource_name, amount):
+        self.cur.execute("UPDATE resources SET amount=? WHERE user_id=? AND resource_name=?",
+                         (amount, user_id, resource_name))
+        if self.cur.rowcount == 0:
+            self.cur.execute("INSERT INTO resources (user_id, resource_name, amount) VALUES (?, ?, ?)",
+                             (user_id, resource_name, amount))
+
+    def deduct(self, user_id, resource_name, amount):
+        """Subtract `amount` only if the balance covers it, in a single UPDATE so
+        concurrent requests can't both spend the same balance. Returns the new
+        balance, or None when it was too low (nothing is changed)."""
+        self.cur.execute("""
+            UPDATE resources SET amount = amount - ?
+            WHERE user_id=? AND resource_name=? AND amount >= ?
+        """, (amount, user_id, resource_name, amount))
+        if self.cur.rowcount == 0:
+            return None
+        self.cur.execute("SELECT amount FROM resources WHERE user_id=? AND resource_name=?",
+                         (user_id, resource_name))
+        return float(self.cur.fetchone()[0])
+
+    def changed_since(self, user_id, since):
+        """{resource_name: amount} of the resources whose version is newer than `since`."""
+        self.cur.execute("""
+            SELECT resource_name, amount FROM resources
+            WHERE user_id=? AND version>?
+        """, (user_id, since))
+        return {row[0]: float(row[1]) for row in self.cur.fetchall()}
+
+
+class MachineRepository:
+    # What list() and get() return of a machine
+    FIELDS = ("id", "machine_type", "x", "y", "level", "last_activated", "is_offline",
+              "provisional_mint", "room")
+
+    def __init__(self, cur):
+        self.cur = cur
+        self._columns = None
+
+    def columns(self):
+        if self._columns is None:
+            self.cur.execute("PRAGMA table_info(user_machines)")
+            self._columns = {column[1] for column in self.cur.fetchall()}
+        return self._columns
+
+    def _fields(self):
+        # Databases the startup checks couldn't migrate may lack provisional_mint/room
+        columns = self.columns()
+        return ", ".join(field for field in self.FIELDS if field in columns)
+
+    def get(self, user_id, machine_id):
+        """One machine as a dict, or None."""
+        self.cur.execute(f"SELECT {self._fields()} FROM user_machines WHERE user_id=? AND id=?",
+                         (user_id, machine_id))
+        row = self.cur.fetchone()
+        return dict(row) if row else None
+
+    def list(self, user_id, room=None, since=None):
+        """Cursor over the player's machines in id order, for rows_to_json():
+        only one room's with `room`, only those whose version is newer than
+        `since` with `since`."""
+        sql = f"SELECT {self._fields()} FROM user_machines WHERE user_id=?"
+        args = [user_id]
+        if room is not None and "room" in self.columns():
+            sql += " AND room=?"
+            args.append(room)
+        if since is not None:
+            sql += " AND version>?"
+            args.append(since)
+        self.cur.execute(sql + " ORDER BY id", args)
+        return self.cur
+
+    def timers(self, user_id):
+        """Rows of (id, machine_type, last_activated, is_offline, next_cost_time)."""
+        self.cur.execute("""
+            SELECT id, machine_type, last_activated, is_offline, next_cost_time
+            FROM user_machines
+            WHERE user_id=?
+        """, (user_id,))
+        return self.cur.fetchall()
+
+    def amplifiers(self, user_id):
+        self.cur.execute("""
+            SELECT id, level, is_offline, next_cost_time
+            FROM user_machines
+            WHERE user_id=? AND machine_type='amplifier'
+        """, (user_id,))
+        return self.cur.fetchall()
+
+    def add(self, user_id, machine_type, x, y, room=1, is_offline=0):
+        """Insert a level 1 machine and return its id. Databases the startup
+        checks couldn't migrate may lack the provisional_mint/room columns."""
+        values = {"user_id": user_id, "machine_type": machine_type, "x": x, "y": y, "level": 1,
+                  "last_activated": 0, "is_offline": is_offline, "next_cost_time": 0}
+        columns = self.columns()
+        if "provisional_mint" in columns:
+            values["provisional_mint"] = 0
+        if "room" in columns:
+            values["room"] = room
+        self.cur.execute(
+            f"INSERT INTO user_machines ({', '.join(values)}) VALUES ({', '.join('?' * len(values))})",
+            tuple(values.values()))
+        return self.cur.lastrowid
+
+    def move(self, user_id, machine_id, x, y, room):
+        self.cur.execute("""
+            UPDATE user_machines
+            SET x=?, y=?, room=?
+            WHERE user_id=? AND id=?
+        """, (x, y, room, user_id, machine_id))
+
+    def move_many(self, user_id, moves):
+        """Apply (machine_id, x, y, room) moves; the room is dropped on databases
+        without the column. Returns how many machines were updated."""
+        if "room" in self.columns():
+            self.cur.executemany("""
+                UPDATE user_machines
+                SET x=?, y=?, room=?
+                WHERE user_id=? AND id=?
+            """, [(x, y, room, user_id, machine_id) for machine_id, x, y, room in moves])
+        else:
+            self.cur.executemany("""
+                UPDATE user_machines
+                SET x=?, y=?
+                WHERE user_id=? AND id=?
+            """, [(x, y, user_id, machine_id) for machine_id, x, y, _ in moves])
+        return self.cur.rowcount
+
+    def positions(self, user_id):
+        """Rows of (id, x, y, room), for LayoutIndex.from_rows()."""
+        self.cur.execute("SELECT id, x, y, room FROM user_machines WHERE user_id=?", (user_id,))
+        return self.cur.fetchall()
+
+    def set_level(self, user_id, machine_id, level):
+        self.cur.execute("UPDATE user_machines SET level=? WHERE user_id=? AND id=?",
+                         (level, user_id, machine_id))
+
+    def activate(self, user_id, machine_id, now_ms, is_offline=None):
+        """Start a machine's cooldown at `now_ms`, also setting is_offline when given."""
+        self.activate_many(user_id, [(machine_id, now_ms, is_offline)])
+
+    def activate_many(self, user_id, activations):
+        """activate() for each (machine_id, now_ms, is_offline) in one go."""
+        keep = [(now_ms, user_id, machine_id) for machine_id, now_ms, is_offline in activations
+                if is_offline is None]
+        store = [(now_ms, is_offline, user_id, machine_id) for machine_id, now_ms, is_offline in activations
+                 if is_offline is not None]
+        if keep:
+            self.cur.executemany("UPDATE user_machines SET last_activated=? WHERE user_id=? AND id=?", keep)
+        if store:
+            self.cur.executemany("""
+                UPDATE user_machines
+                SET last_activated=?, is_offline=?
+                WHERE user_id=? AND id=?
+            """, store)
+
+    def set_provisional_mint(self, user_id, machine_id, pending):
+        """Flag a FOMO HIT whose NFT mint hasn't been confirmed yet. Does
+        nothing on databases without the provisional_mint column."""
+        if "provisional_mint" in self.columns():
+            self.cur.execute("UPDATE user_machines SET provisional_mint=? WHERE user_id=? AND id=?",
+                             (1 if pending else 0, user_id, machine_id))
+
+    def set_upkeep(self, user_id, machine_id, next_cost_time, is_offline):
+        """An amplifier's next upkeep time and online state."""
+        self.cur.execute("""
+            UPDATE user_machines
+            SET next_cost_time=?, is_offline=?
+            WHERE user_id=? AND id=?
+        """, (next_cost_time, is_offline, user_id, machine_id))
+
+
+class PetRepository:
+    def __init__(self, cur):
+        self.cur = cur
+
+    def list(self, user_id, room=None, since=None):
+        """Cursor over the player's pets, for rows_to_json(); filtered as
+        MachineRepository.list()."""
+        sql = """
+            SELECT id, x, y, room, type, parent_machine
+            FROM pets
+            WHERE user_id=?
+        """
+        args = [user_id]
+        if room is not None:
+            sql += " AND room=?"
+            args.append(room)
+        if since is not None:
+            sql += " AND version>?"
+            args.append(since)
+        self.cur.execute(sql, args)
+        return self.cur
+
+    def count_of_type(self, user_id, pet_type):
+        self.cur.execute("SELECT COUNT(*) FROM pets WHERE user_id=? AND type=?", (user_id, pet_type))
+        return self.cur.fetchone()[0]
+
+    def exists(self, user_id, pet_id):
+        self.cur.execute("SELECT 1 FROM pets WHERE user_id=? AND id=?", (user_id, pet_id))
+        return self.cur.fetchone() is not None
+
+    def add(self, user_id, pet_type, x, y, room=1, parent_machine=None):
+        self.cur.execute("""
+            INSERT INTO pets (user_id, x, y, room, type, parent_machine)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (user_id, x, y, room, pet_type, parent_machine))
+        return self.cur.lastrowid
+
+    def move(self, user_id, pet_id, x, y, room):
+        self.cur.execute("""
+            UPDATE pets
+            SET x=?, y=?, room=?
+            WHERE user_id=? AND id=?
+        """, (x, y, room, user_id, pet_id))
@@ -0,0 +1,270 @@
+# unit_of_work.py
+#
+# One SQLite transaction per mutating request. The handlers were written
+# against plain connections and call conn.commit() after each step; inside a
+# unit of work those calls become savepoint checkpoints and the request ends
+# with a single COMMIT (one fsync) instead of one per step. Writes after the
+# handler's last commit() are rolled back, as they were before, and a crash
+# mid-request leaves nothing half-applied.
+#
+# The transaction starts with BEGIN IMMEDIATE so the write lock is taken up
+# front, and both BEGIN and COMMIT are retried with backoff on SQLITE_BUSY.
+import contextvars
+import logging
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import jsonify, request, session
+
+from config import DB_BUSY_TIMEOUT, DB_BUSY_RETRIES, DB_BUSY_BACKOFF_MS
+from storage import database_path, connect as storage_connect
+
+log = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("unit_of_work", default=None)
+
+
+class DatabaseBusy(Exception):
+    """SQLITE_BUSY persisted through every retry."""
+
+
+class UnitOfWorkConnection(sqlite3.Connection):
+    """sqlite3 connection whose commit/rollback/close defer to its unit of work."""
+
+    unit = None
+
+    def commit(self):
+        if self.unit is None:
+            return super().commit()
+        self.unit.checkpoint()
+
+    def rollback(self):
+        if self.unit is None:
+            return super().rollback()
+        self.unit.rollback_to_checkpoint()
+
+    def close(self):
+        if self.unit is None:
+            return super().close()
+
+
+class TransactionStats:
+    """Per-route counters: real commits vs the commit() calls they replaced."""
+
+    FIELDS = ("units", "commits", "checkpoints", "rollbacks", "busyRetries", "busyFailures")
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def add(self, route, **counts):
+        with self._lock:
+            entry = self._routes.setdefault(route, dict.fromkeys(self.FIELDS, 0))
+            for key, value in counts.items():
+                entry[key] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {route: dict(entry) for route, entry in self._routes.items()}
+
+
+transaction_stats = TransactionStats()
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+class UnitOfWork:
+    """One request's transaction.
+
+    Normally the unit owns a connection and a BEGIN IMMEDIATE transaction.
+    Given `shared`, a connection already inside a transaction (the
+    group-commit writer's batch), it runs as a savepoint in it instead and
+    leaves the COMMIT and the after-commit hooks to the owner.
+    `user_id` picks the database file when sharding is on.
+    """
+
+    def __init__(self, name, shared=None, user_id=None):
+        self.name = name
+        self.shared = shared
+        self.path = database_path(user_id)
+        self.conn = None
+        self.checkpoints = 0
+        self.hooks = []
+
+    def begin(self):
+        if self.shared is not None:
+            self.conn = self.shared
+            self.conn.execute("SAVEPOINT unit")
+        else:
+            self.conn = connect(self.path)
+            try:
+                retry_busy(self.conn, "BEGIN IMMEDIATE", self.name)
+            except Exception:
+                self.conn.close()
+                raise
+        self.conn.execute("SAVEPOINT uow")
+        self.conn.unit = self
+
+    def checkpoint(self):
+        """A handler commit(): keep everything so far."""
+        self.conn.execute("RELEASE uow")
+        self.conn.execute("SAVEPOINT uow")
+        self.checkpoints += 1
+
+    def rollback_to_checkpoint(self):
+        self.conn.execute("ROLLBACK TO uow")
+
+    def after_commit(self, fn):
+        self.hooks.append(fn)
+
+    def finish(self, ok=True):
+        """Keep what the handler committed and discard the rest.
+
+        An owned unit commits and releases its connection; a shared one
+        only closes its savepoint. Returns whether anything was kept.
+        """
+        conn = self.conn
+        conn.unit = None
+        keep = ok and self.checkpoints > 0
+        if self.shared is not None:
+            if keep:
+                conn.execute("ROLLBACK TO uow")
+                conn.execute("RELEASE uow")
+                conn.execute("RELEASE unit")
+            else:
+                conn.execute("ROLLBACK TO unit")
+                conn.execute("RELEASE unit")
+            transaction_stats.add(self.name, units=1, checkpoints=self.checkpoints, rollbacks=int(not keep))
+            return keep
+
+        committed = False
+        try:
+            if keep:
+                conn.execute("ROLLBACK TO uow")
+                conn.execute("RELEASE uow")
+                retry_busy(conn, "COMMIT", self.name)
+                committed = True
+            else:
+                conn.execute("ROLLBACK")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            transaction_stats.add(self.name, units=1, commits=int(committed), checkpoints=self.checkpoints,
+                                  rollbacks=int(not committed))
+            conn.close()
+
+        run_hooks(self.hooks, self.name)
+        return committed
+
+
+def connect(path):
+    """A connection in autocommit mode; transactions are issued explicitly."""
+    return storage_connect(path, timeout=DB_BUSY_TIMEOUT, isolation_level=None, factory=UnitOfWorkConnection)
+
+
+def retry_busy(conn, sql, name):
+    """Execute `sql`, retrying with backoff while the database is busy."""
+    for attempt in range(DB_BUSY_RETRIES + 1):
+        try:
+            conn.execute(sql)
+            return
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            if attempt == DB_BUSY_RETRIES:
+                transaction_stats.add(name, busyFailures=1)
+                raise DatabaseBusy(f"{sql} on {name}: {e}") from e
+            transaction_stats.add(name, busyRetries=1)
+            # Exponential backoff with jitter so retries don't collide again
+            delay_ms = DB_BUSY_BACKOFF_MS * (2 ** attempt)
+            time.sleep(random.uniform(delay_ms / 2, delay_ms) / 1000)
+
+
+def run_hooks(hooks, name):
+    for fn in hooks:
+        try:
+            fn()
+        except Exception as e:
+            log.error(f"Error in after-commit hook of {name}: {e}")
+
+
+def current_connection(path):
+    """The connection of the unit of work running in this context on `path`, if any."""
+    unit = _current.get()
+    return unit.conn if unit is not None and unit.path == path else None
+
+
+def after_commit(fn):
+    """Run fn once the current unit of work commits, or now if there is none."""
+    unit = _current.get()
+    if unit is None:
+        fn()
+    else:
+        unit.after_commit(fn)
+
+
+@contextmanager
+def unit_of_work(name, shared=None, user_id=None):
+    """One transaction for everything in the block (reentrant: nested blocks join it)."""
+    if _current.get() is not None:
+        yield _current.get()
+        return
+    unit = UnitOfWork(name, shared, user_id)
+    unit.begin()
+    token = _current.set(unit)
+    try:
+        yield unit
+    except BaseException:
+        _current.reset(token)
+        unit.finish(ok=False)
+        raise
+    _current.reset(token)
+    unit.finish()
+
+
+# Set by group_commit.enable_group_commit(); when present, transactional
+# views run on its writer thread instead of opening their own transaction.
+_group_writer = None
+
+
+def set_group_writer(writer):
+    global _group_writer
+    _group_writer = writer
+
+
+def transactional(view=None, prepare=None):
+    """Run a view as one unit of work named after its endpoint.
+
+    `prepare`, an optional function, runs first, outside the transaction,
+    for slow lookups (e.g. gateway calls) the view would otherwise make
+    while holding the write lock. Persistent SQLITE_BUSY answers 503.
+    With group commit enabled the view runs on the writer thread, batched
+    with other requests into one transaction.
+    """
+    if view is None:
+        return lambda v: transactional(v, prepare)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if prepare is not None:
+            prepare()
+        name = request.endpoint or view.__name__
+        user_id = session.get('telegram_id')
+        try:
+            if _group_writer is not None:
+                return _group_writer.submit(name, user_id, view, *args, **kwargs).result()
+            with unit_of_work(name, user_id=user_id):
+                return view(*args, **kwargs)
+        except DatabaseBusy as e:
+            log.warning(f"Database busy: {e}")
+            return jsonify({"error": "The server is busy, please retry"}), 503
+    return wrapper
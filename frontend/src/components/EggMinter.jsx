@@ -30,6 +30,7 @@ const EggMinter = ({ onClose }) => {
   const [statusCheckCount, setStatusCheckCount] = useState(0);
   const [paymentMethod, setPaymentMethod] = useState(null); // 'xrd' or 'eggs'
   const [showConnectionDetails, setShowConnectionDetails] = useState(false);
+  const [quantity, setQuantity] = useState(1); // eggs minted in one transaction
 
   // Check connection status
   useEffect(() => {
@@ -147,7 +148,8 @@ const EggMinter = ({ onClose }) => {
         },
         body: JSON.stringify({
           accountAddress: accounts[0].address,
-          paymentMethod: 'xrd'
+          paymentMethod: 'xrd',
+          quantity
         }),
         credentials: 'same-origin'
       });
@@ -190,8 +192,8 @@ const EggMinter = ({ onClose }) => {
     
     try {
       // Check if user has enough egg resources
-      if (eggs < 150) {
-        throw new Error("Not enough egg resources. 150 eggs required.");
+      if (eggs < eggsCost) {
+        throw new Error(`Not enough egg resources. ${eggsCost} eggs required.`);
       }
       
       // Get the backend mint manifest
@@ -202,7 +204,8 @@ const EggMinter = ({ onClose }) => {
         },
         body: JSON.stringify({
           accountAddress: accounts[0].address,
-          paymentMethod: 'eggs'
+          paymentMethod: 'eggs',
+          quantity
         }),
         credentials: 'same-origin'
       });
@@ -241,8 +244,10 @@ const EggMinter = ({ onClose }) => {
   };
 
   // Check if user can afford the payment method
-  const canAffordXrd = tcorvax >= 300;
-  const canAffordEggs = eggs >= 150;
+  const xrdCost = 300 * quantity;
+  const eggsCost = 150 * quantity;
+  const canAffordXrd = tcorvax >= xrdCost;
+  const canAffordEggs = eggs >= eggsCost;
 
   return (
     <div className="welcome-message" style={{ maxWidth: '800px' }}>
@@ -415,6 +420,17 @@ const EggMinter = ({ onClose }) => {
             <h2 style={{ color: '#FF3D00', margin: '0 0 15px 0' }}>Choose your payment method</h2>
             <p>Mint a random Evolving Creature Egg using XRD or in-game eggs.</p>
             <p>Each mint has a 5% chance to earn a bonus item!</p>
+
+            <div style={{ display: 'flex', alignItems: 'center', justifyContent: 'center', gap: '10px' }}>
+              <button onClick={() => setQuantity(q => Math.max(1, q - 1))} disabled={quantity <= 1}>-</button>
+              <span style={{ fontSize: '18px', fontWeight: 'bold' }}>
+                {quantity} {quantity === 1 ? 'egg' : 'eggs'}
+              </span>
+              <button onClick={() => setQuantity(q => Math.min(10, q + 1))} disabled={quantity >= 10}>+</button>
+            </div>
+            {quantity > 1 && (
+              <p style={{ fontSize: '12px', opacity: 0.7 }}>All {quantity} eggs are minted in a single transaction.</p>
+            )}
             
             <div style={{ 
               display: 'flex', 
@@ -436,7 +452,7 @@ const EggMinter = ({ onClose }) => {
               onClick={canAffordXrd ? handleXrdMint : undefined}
               >
                 <h3>Pay with XRD</h3>
-                <p style={{ fontSize: '20px', fontWeight: 'bold' }}>300 XRD</p>
+                <p style={{ fontSize: '20px', fontWeight: 'bold' }}>{xrdCost} XRD</p>
                 <p style={{ fontSize: '14px' }}>Current balance: {formatResource(tcorvax)} XRD</p>
                 {!canAffordXrd && <p style={{ color: '#F44336' }}>Not enough XRD</p>}
               </div>
@@ -453,7 +469,7 @@ const EggMinter = ({ onClose }) => {
               onClick={canAffordEggs ? handleEggResourceMint : undefined}
               >
                 <h3>Pay with Eggs</h3>
-                <p style={{ fontSize: '20px', fontWeight: 'bold' }}>150 Eggs</p>
+                <p style={{ fontSize: '20px', fontWeight: 'bold' }}>{eggsCost} Eggs</p>
                 <p style={{ fontSize: '14px' }}>Current balance: {formatResource(eggs)} Eggs</p>
                 {!canAffordEggs && <p style={{ color: '#F44336' }}>Not enough eggs</p>}
               </div>
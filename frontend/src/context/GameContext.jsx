@@ -10,6 +10,8 @@ import { useRadixConnect } from './RadixConnectContext';
 
 // Import the service classes
 import PetService from '../utils/PetService';
+import EventService from '../utils/EventService';
+import { getPacked } from '../utils/MsgPack';
 import TransactionService from '../utils/TransactionService';
 
 // Updated machineTypes with fomoHit cost change and incubator maxLevel
@@ -223,7 +225,9 @@ export const GameProvider = ({ children }) => {
 
   const loadGameFromServer = useCallback(async () => {
     try {
-      const resp = await axios.get('/api/getGameState');
+      // MessagePack with column-packed machines/pets when the server supports it
+      const resp = await getPacked('/api/getGameState', {}, ['machines', 'pets']);
+      if (!resp.data) return;
       setTcorvax(parseFloat(resp.data.tcorvax));
       setCatNips(parseFloat(resp.data.catNips));
       setEnergy(parseFloat(resp.data.energy));
@@ -1062,6 +1066,23 @@ export const GameProvider = ({ children }) => {
     checkLoginStatus();
   }, [checkLoginStatus]);
 
+  // Live events: resource changes made elsewhere (other tabs, background
+  // transactions, amplifier upkeep) arrive without polling. While the
+  // stream is down or refused, the game state is polled instead.
+  useEffect(() => {
+    if (!isLoggedIn) return;
+    return EventService.subscribe({
+      resources: (data) => {
+        if (data.tcorvax !== undefined) setTcorvax(parseFloat(data.tcorvax));
+        if (data.catNips !== undefined) setCatNips(parseFloat(data.catNips));
+        if (data.energy !== undefined) setEnergy(parseFloat(data.energy));
+        if (data.eggs !== undefined) setEggs(parseFloat(data.eggs));
+      },
+      amplifier: () => loadGameFromServer(),
+      transaction: () => loadGameFromServer()
+    }, { poll: loadGameFromServer });
+  }, [isLoggedIn, loadGameFromServer]);
+
   // Detect mobile
   useEffect(() => {
     const checkMobile = () => {
@@ -0,0 +1,82 @@
+// src/utils/CatalogService.js
+import axios from 'axios';
+
+const STORAGE_KEY = 'corvaxCatalog';
+
+let catalogPromise = null;
+
+/**
+ * Service class for the game catalog (/api/catalog): costs, production and
+ * unlock rules, served from the backend's machine_catalog.py
+ */
+class CatalogService {
+  /**
+   * Fetch the catalog once per page load. The last copy is kept in
+   * localStorage and pinned by its version, so the browser serves repeat
+   * visits from its HTTP cache until a release changes the catalog.
+   * @returns {Promise<Object|null>} The catalog, or null if unavailable
+   */
+  static getCatalog() {
+    if (!catalogPromise) {
+      catalogPromise = CatalogService.loadCatalog();
+    }
+    return catalogPromise;
+  }
+
+  static async loadCatalog() {
+    let stored = null;
+    try {
+      stored = JSON.parse(localStorage.getItem(STORAGE_KEY) || 'null');
+    } catch (error) {
+      stored = null;
+    }
+
+    try {
+      const response = await axios.get('/api/catalog', {
+        params: stored ? { v: stored.version } : {}
+      });
+      const version = response.headers['x-catalog-version'];
+      if (stored && stored.version === version) {
+        return stored.catalog;
+      }
+      try {
+        localStorage.setItem(STORAGE_KEY, JSON.stringify({ version, catalog: response.data }));
+      } catch (error) {
+        // Storage full or disabled; the HTTP cache still helps
+      }
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching catalog:', error);
+      catalogPromise = null;
+      return stored ? stored.catalog : null;
+    }
+  }
+
+  /**
+   * Cost of building the next machine of a type, from local counts only
+   * @param {Object} catalog - The catalog
+   * @param {string} machineType - e.g. 'reactor'
+   * @param {number} builtCount - How many of this type the player already has
+   * @returns {Object|null} Cost map, or null if no more can be built
+   */
+  static buildCost(catalog, machineType, builtCount) {
+    const slot = catalog?.machines?.[machineType]?.build?.[builtCount];
+    return slot ? slot.cost : null;
+  }
+
+  /**
+   * Cost of upgrading a machine to the next level
+   * @param {Object} catalog - The catalog
+   * @param {string} machineType - e.g. 'catLair'
+   * @param {number} currentLevel - The machine's current level
+   * @param {boolean} isSecondMachine - Whether it is the second-oldest of its type
+   * @returns {Object|null} Cost map, or null if already at max level
+   */
+  static upgradeCost(catalog, machineType, currentLevel, isSecondMachine = false) {
+    const entry = catalog?.machines?.[machineType]?.upgrades?.[String(currentLevel + 1)];
+    if (!entry) return null;
+    return (isSecondMachine && entry.secondMachineCost) || entry.cost;
+  }
+}
+
+export default CatalogService;
@@ -0,0 +1,84 @@
+// src/utils/EventService.js
+
+/**
+ * Service class for the live game event stream (/api/events)
+ */
+class EventService {
+  /**
+   * Open the event stream for the logged-in player
+   * @param {Object} handlers - Map of event type (e.g. 'resources', 'transaction') to callback(data)
+   * @param {Object} [options]
+   * @param {Function} [options.poll] - Called every pollIntervalMs while the stream is down
+   *   (refused when the server is at its stream limit, or unsupported), so the game still
+   *   sees changes made elsewhere
+   * @param {number} [options.pollIntervalMs=15000]
+   * @param {number} [options.retryMs=30000] - Wait before reopening a refused stream
+   * @returns {Function} Call to close the stream
+   */
+  static subscribe(handlers, { poll, pollIntervalMs = 15000, retryMs = 30000 } = {}) {
+    let source = null;
+    let pollTimer = null;
+    let retryTimer = null;
+    let closed = false;
+
+    const startPolling = () => {
+      if (poll && !pollTimer) {
+        pollTimer = setInterval(poll, pollIntervalMs);
+      }
+    };
+
+    const stopPolling = () => {
+      clearInterval(pollTimer);
+      pollTimer = null;
+    };
+
+    if (typeof window === 'undefined' || !window.EventSource) {
+      console.warn('EventSource not supported; polling for game events');
+      startPolling();
+      return stopPolling;
+    }
+
+    const open = () => {
+      if (closed) return;
+      source = new EventSource('/api/events', { withCredentials: true });
+
+      Object.entries(handlers).forEach(([type, handler]) => {
+        source.addEventListener(type, (event) => {
+          try {
+            handler(JSON.parse(event.data));
+          } catch (error) {
+            console.error(`Error handling ${type} event:`, error);
+          }
+        });
+      });
+
+      source.onopen = () => {
+        stopPolling();
+      };
+
+      source.onerror = () => {
+        // Poll while the stream is down; EventSource reconnects on its own
+        // unless the server refused it (e.g. 503 at its stream limit)
+        startPolling();
+        if (source.readyState === EventSource.CLOSED) {
+          console.warn('Event stream refused, polling and retrying later');
+          source.close();
+          retryTimer = setTimeout(open, retryMs);
+        } else {
+          console.warn('Event stream interrupted, reconnecting...');
+        }
+      };
+    };
+
+    open();
+
+    return () => {
+      closed = true;
+      if (source) source.close();
+      stopPolling();
+      clearTimeout(retryTimer);
+    };
+  }
+}
+
+export default EventService;
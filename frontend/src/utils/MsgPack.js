@@ -0,0 +1,130 @@
+// src/utils/MsgPack.js
+import axios from 'axios';
+
+const textDecoder = new TextDecoder();
+
+/**
+ * Minimal MessagePack decoder covering everything the backend sends
+ * (nil, booleans, ints, floats, str, bin, array, map).
+ * @param {ArrayBuffer|Uint8Array} input - Encoded bytes
+ * @returns {*} The decoded value
+ */
+export function decode(input) {
+  const bytes = input instanceof Uint8Array ? input : new Uint8Array(input);
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  let pos = 0;
+
+  const str = (length) => {
+    const value = textDecoder.decode(bytes.subarray(pos, pos + length));
+    pos += length;
+    return value;
+  };
+  const bin = (length) => {
+    const value = bytes.slice(pos, pos + length);
+    pos += length;
+    return value;
+  };
+  const array = (length) => {
+    const value = new Array(length);
+    for (let i = 0; i < length; i++) value[i] = read();
+    return value;
+  };
+  const map = (length) => {
+    const value = {};
+    for (let i = 0; i < length; i++) {
+      const key = read();
+      value[key] = read();
+    }
+    return value;
+  };
+
+  function read() {
+    const type = bytes[pos++];
+    if (type <= 0x7f) return type;
+    if (type >= 0xe0) return type - 0x100;
+    if (type >= 0x80 && type <= 0x8f) return map(type & 0x0f);
+    if (type >= 0x90 && type <= 0x9f) return array(type & 0x0f);
+    if (type >= 0xa0 && type <= 0xbf) return str(type & 0x1f);
+
+    let value;
+    switch (type) {
+      case 0xc0: return null;
+      case 0xc2: return false;
+      case 0xc3: return true;
+      case 0xc4: value = bytes[pos]; pos += 1; return bin(value);
+      case 0xc5: value = view.getUint16(pos); pos += 2; return bin(value);
+      case 0xc6: value = view.getUint32(pos); pos += 4; return bin(value);
+      case 0xca: value = view.getFloat32(pos); pos += 4; return value;
+      case 0xcb: value = view.getFloat64(pos); pos += 8; return value;
+      case 0xcc: value = view.getUint8(pos); pos += 1; return value;
+      case 0xcd: value = view.getUint16(pos); pos += 2; return value;
+      case 0xce: value = view.getUint32(pos); pos += 4; return value;
+      case 0xcf: value = Number(view.getBigUint64(pos)); pos += 8; return value;
+      case 0xd0: value = view.getInt8(pos); pos += 1; return value;
+      case 0xd1: value = view.getInt16(pos); pos += 2; return value;
+      case 0xd2: value = view.getInt32(pos); pos += 4; return value;
+      case 0xd3: value = Number(view.getBigInt64(pos)); pos += 8; return value;
+      case 0xd9: value = bytes[pos]; pos += 1; return str(value);
+      case 0xda: value = view.getUint16(pos); pos += 2; return str(value);
+      case 0xdb: value = view.getUint32(pos); pos += 4; return str(value);
+      case 0xdc: value = view.getUint16(pos); pos += 2; return array(value);
+      case 0xdd: value = view.getUint32(pos); pos += 4; return array(value);
+      case 0xde: value = view.getUint16(pos); pos += 2; return map(value);
+      case 0xdf: value = view.getUint32(pos); pos += 4; return map(value);
+      default:
+        throw new Error(`Unsupported MessagePack type 0x${type.toString(16)}`);
+    }
+  }
+
+  return read();
+}
+
+/**
+ * Turn a column table ({count, columns: {key: [...]}}) back into row objects
+ * @param {Object} table - Column table as sent by the backend
+ * @returns {Array<Object>} One object per row
+ */
+export function expandColumns(table) {
+  if (!table || !table.columns) return table;
+  const keys = Object.keys(table.columns);
+  const rows = new Array(table.count);
+  for (let i = 0; i < table.count; i++) {
+    const row = {};
+    for (const key of keys) row[key] = table.columns[key][i];
+    rows[i] = row;
+  }
+  return rows;
+}
+
+/**
+ * GET an endpoint preferring MessagePack, falling back to JSON when the
+ * server answers with JSON. Column tables in `columnar` are expanded.
+ * @param {string} url - Endpoint URL
+ * @param {Object} config - Extra axios config (params, headers...)
+ * @param {Array<string>} columnar - Payload keys sent as column tables ('' = the whole payload)
+ * @returns {Promise<Object>} axios-like { status, headers, data }
+ */
+export async function getPacked(url, config = {}, columnar = []) {
+  const response = await axios.get(url, {
+    ...config,
+    responseType: 'arraybuffer',
+    headers: { Accept: 'application/msgpack, application/json;q=0.9', ...(config.headers || {}) },
+    validateStatus: (status) => (status >= 200 && status < 300) || status === 304
+  });
+
+  if (response.status === 304 || !response.data || response.data.byteLength === 0) {
+    return { status: response.status, headers: response.headers, data: null };
+  }
+
+  let data;
+  if ((response.headers['content-type'] || '').includes('application/msgpack')) {
+    data = decode(response.data);
+    columnar.forEach((key) => {
+      if (key === '') data = expandColumns(data);
+      else if (data && data[key]) data[key] = expandColumns(data[key]);
+    });
+  } else {
+    data = JSON.parse(textDecoder.decode(new Uint8Array(response.data)));
+  }
+  return { status: response.status, headers: response.headers, data };
+}
@@ -86,12 +86,14 @@ class NFTService {
   /**
    * Check transaction status
    * @param {string} intentHash - The transaction intent hash
+   * @param {string} actionId - The actionId returned with the manifest, if any
    * @returns {Promise<Object>} Transaction status info
    */
-  static async checkTransactionStatus(intentHash) {
+  static async checkTransactionStatus(intentHash, actionId = null) {
     try {
       const response = await axios.post('/api/checkNFTTransactionStatus', {
-        intentHash
+        intentHash,
+        ...(actionId ? { actionId } : {})
       });
       return response.data;
     } catch (error) {
@@ -100,6 +102,24 @@ class NFTService {
     }
   }
 
+  /**
+   * Check several transactions in one request
+   * @param {Object} actionIds - Map of intent hash -> actionId (null when there is none)
+   * @returns {Promise<Object>} Map of intent hash -> transaction status
+   */
+  static async checkTransactionStatuses(actionIds) {
+    try {
+      const response = await axios.post('/api/checkNFTTransactionStatus', {
+        intentHashes: Object.keys(actionIds),
+        actionIds
+      });
+      return response.data.transactions;
+    } catch (error) {
+      console.error('Error checking transaction statuses:', error);
+      throw new Error(error.response?.data?.error || 'Failed to check transaction statuses');
+    }
+  }
+
   /**
    * Create transaction manifest for combining two creatures
    * @param {string} accountAddress - The user's account address